@@ -0,0 +1,324 @@
+"""Benchmarks for the CÖDEBULLAR solver.
+
+    python bench.py hash [--files 5000,100000,1000000] [--workers 1,4,8] [--file-bytes 0]
+                         [--dir /tmp] [--drop-caches]
+    python bench.py cluster [--bits 4000] [--quality 30-95] [--jobs 1,2,4] [--seeds 4,8,16]
+                            [--scale 100000,1000000] [--noise 0.0078]
+    python bench.py decode [--bits 100000,1000000,10000000] [--shuffle 320]
+    python bench.py encode [--bits 10000,1000000] [--modes serial,pool,cached,link] [--max-reencode 20000]
+
+builds a corpus of each size in a scratch directory and times the original
+serial read-and-MD5 loop against hashing.hash_files. --file-bytes 0 fills
+the corpus with copies of encoded/ (about 64 KB a file); a smaller size
+keeps a million-file corpus to a sensible footprint.
+
+The cluster benchmark runs codebullar.py --mode pool on a random secret,
+with assets rebuilt from encoded/ and solve.hash_to_bit_map, re-encoding
+every bit at a random --quality so no two files share a digest. It reports
+thumbnail decoding images/s per --jobs, whether clustering recovered the
+source pictures, and decoding accuracy with one label per cluster and with
+only a few labelled files. It then clusters --scale corpora resampled from
+those fingerprints with a little extra noise, to time clustering alone.
+
+The decode benchmark times turning labelled bits into text: the original
+string concatenation against bitstream.BitDecoder, fed in order and with
+each bit displaced by up to --shuffle places, as unordered hashing does.
+
+The encode benchmark reports codebullar.py's bits/s in each --mode on the
+same rebuilt assets. Modes that re-encode every bit are skipped above
+--max-reencode bits, and cached (one full copy per bit) when the disk
+can't hold it; outputs are checked to be identical across modes.
+"""
+import argparse
+import glob
+import hashlib
+import itertools
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import bitstream
+import cluster
+import codebullar
+import hashing
+from solve import hash_to_bit_map
+
+
+def serial_hashes(directory):
+    """The loop solve.py used to run: glob, sort by parsed name, read each
+    file whole and MD5 it."""
+    files = glob.glob(os.path.join(directory, '*.jpeg'))
+    files.sort(key=lambda x: int(os.path.basename(x).split('.')[0]))
+    hashes = []
+    for filepath in files:
+        with open(filepath, 'rb') as f:
+            hashes.append(hashlib.md5(f.read()).hexdigest())
+    return hashes
+
+
+def build_corpus(directory, count, file_bytes):
+    if file_bytes:
+        contents = [os.urandom(file_bytes) for _ in range(64)]
+    else:
+        contents = []
+        for _, path in hashing.numbered_files('encoded')[:64]:
+            with open(path, 'rb') as f:
+                contents.append(f.read())
+    total = 0
+    for i, data in zip(range(count), itertools.cycle(contents)):
+        with open(os.path.join(directory, f'{i:04}.jpeg'), 'wb') as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+
+def drop_caches():
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3')
+        return True
+    except OSError:
+        return False
+
+
+def bench_hash(args):
+    for count in map(int, args.files.split(',')):
+        scratch = tempfile.mkdtemp(prefix='codebullar-', dir=args.dir)
+        try:
+            start = time.perf_counter()
+            total = build_corpus(scratch, count, args.file_bytes)
+            print(f'[*] {count} files, {total / 2 ** 20:,.0f} MB in {scratch}, built in '
+                  f'{time.perf_counter() - start:.1f}s; {os.cpu_count()} CPUs')
+            cold = args.drop_caches and drop_caches()
+            if args.drop_caches and not cold:
+                print('[!] could not drop the page cache; timings are warm')
+            print(f'  {"method":>18} {"seconds":>8} {"files/s":>9} {"MB/s":>8} {"speedup":>8}')
+            start = time.perf_counter()
+            expected = serial_hashes(scratch)
+            baseline = time.perf_counter() - start
+            print(f'  {"serial read":>18} {baseline:8.2f} {count / baseline:9,.0f} '
+                  f'{total / 2 ** 20 / baseline:8.1f} {1:7.2f}x')
+            for workers in map(int, args.workers.split(',')):
+                if cold:
+                    drop_caches()
+                start = time.perf_counter()
+                digests = [digest for _, _, digest in hashing.hash_files(hashing.numbered_files(scratch), workers)]
+                elapsed = time.perf_counter() - start
+                if digests != expected:
+                    print(f'[!] hash_files with {workers} workers disagrees with the serial loop')
+                print(f'  {f"{workers} threads":>18} {elapsed:8.2f} {count / elapsed:9,.0f} '
+                      f'{total / 2 ** 20 / elapsed:8.1f} {baseline / elapsed:7.2f}x')
+        finally:
+            shutil.rmtree(scratch)
+
+
+def build_assets(directory):
+    """codebullar.py's assets/ rebuilt from one file per digest in encoded/,
+    sorted by solve.hash_to_bit_map; returns (köttbullar, hotdogs) paths."""
+    representatives = {}
+    for _, path, digest in hashing.hash_files(hashing.numbered_files('encoded')):
+        representatives.setdefault(digest, path)
+    files = ([], [])
+    for digest, path in representatives.items():
+        bit = int(hash_to_bit_map[digest])
+        folder = os.path.join(directory, 'assets', ('köttbullar', 'hotdogs')[bit])
+        os.makedirs(folder, exist_ok=True)
+        files[bit].append(shutil.copy(path, os.path.join(folder, f'{digest}.jpeg')))
+    return files
+
+
+def synthetic_corpus(directory, bits, quality, rng):
+    """Runs codebullar.py in ``directory`` on a secret of ``bits`` bits,
+    re-encoding every bit at a quality in ``quality`` ('LOW-HIGH').
+    Returns the encoded/ path and the secret's bits."""
+    build_assets(directory)
+    secret = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz_{}0123456789') for _ in range(bits // 8))
+    with open(os.path.join(directory, 'secret.txt'), 'w') as f:
+        f.write(secret)
+    subprocess.run([sys.executable, os.path.abspath('codebullar.py'), '--mode', 'pool', '--quality', quality,
+                    '--seed', str(rng.getrandbits(32))], cwd=directory, check=True, stdout=subprocess.DEVNULL)
+    return os.path.join(directory, 'encoded'), np.array([int(b) for c in secret for b in format(ord(c), '08b')])
+
+
+def bench_cluster(args):
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory(prefix='codebullar-') as scratch:
+        start = time.perf_counter()
+        encoded, truth = synthetic_corpus(scratch, args.bits, args.quality, rng)
+        files = hashing.numbered_files(encoded)
+        paths = [path for _, path in files]
+        digests = [digest for _, _, digest in hashing.hash_files(files)]
+        print(f'[*] {len(files)} files, {len(set(digests))} distinct digests, quality {args.quality}, '
+              f'built in {time.perf_counter() - start:.1f}s; {os.cpu_count()} CPUs')
+        print(f'  {"jobs":>4} {"seconds":>8} {"images/s":>9} {"speedup":>8}')
+        baseline = None
+        for jobs in map(int, args.jobs.split(',')):
+            start = time.perf_counter()
+            thumbs = cluster.thumbnails(paths, jobs)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f'  {jobs:>4} {elapsed:8.2f} {len(paths) / elapsed:9,.0f} {baseline / elapsed:7.2f}x')
+
+        start = time.perf_counter()
+        prints = cluster.fingerprints(thumbs)
+        clusters = cluster.cluster(prints, args.threshold)
+        elapsed = time.perf_counter() - start
+        count = clusters.max() + 1
+        pure = all(len(set(truth[clusters == c])) == 1 for c in range(count))
+        print(f'[*] Fingerprinted and clustered in {elapsed * 1000:.0f} ms: {count} clusters from '
+              f'{len(set(hash_to_bit_map))} source pictures, {"all" if pure else "NOT all"} single-bit')
+
+        print(f'  {"labelled files":>22} {"accuracy":>9} {"guessed":>8}')
+        # one labelled file per cluster, as cluster.py --interactive asks for
+        seeds = {int(np.flatnonzero(clusters == c)[0]): int(truth[clusters == c][0]) for c in range(count)}
+        trials = [(f'one per cluster ({count})', seeds)]
+        for k in map(int, args.seeds.split(',')):
+            rows = rng.sample(range(len(truth)), k)
+            trials.append((f'{k} random', {row: int(truth[row]) for row in rows}))
+        for name, seeds in trials:
+            bits, guessed = cluster.label_clusters(clusters, prints, seeds)
+            print(f'  {name:>22} {(bits == truth).mean():9.1%} {guessed.mean():8.1%}')
+
+        # Clustering alone at corpus sizes too slow to encode here: the
+        # fingerprints above resampled, with each bit flipped at --noise.
+        print(f'  {"files":>9} {"seconds":>8} {"clusters":>9} {"single-bit":>11}')
+        noise = np.random.default_rng(1)
+        for size in map(int, args.scale.split(',')):
+            rows = noise.integers(0, len(prints), size)
+            bits = np.unpackbits(prints[rows], axis=1)
+            bits ^= (noise.random(bits.shape) < args.noise).astype(np.uint8)
+            start = time.perf_counter()
+            clusters = cluster.cluster(np.packbits(bits, axis=1), args.threshold)
+            elapsed = time.perf_counter() - start
+            pure = all(len(set(truth[rows][clusters == c])) == 1 for c in range(clusters.max() + 1))
+            print(f'  {size:>9} {elapsed:8.2f} {clusters.max() + 1:>9} {"yes" if pure else "NO":>11}')
+
+
+def concatenated_text(bits):
+    """solve.py's first decoder: a binary string built with += per file,
+    then text built with += per character."""
+    binary_string = ""
+    for bit in bits:
+        binary_string += str(bit)
+    text = ""
+    for i in range(0, len(binary_string), 8):
+        byte = binary_string[i:i+8]
+        if len(byte) == 8:
+            text += chr(int(byte, 2))
+    return text
+
+
+def streamed_text(pairs):
+    decoder = bitstream.BitDecoder()
+    out = bytearray()
+    for chunk in decoder.feed(pairs):
+        out += chunk
+    out += decoder.finish(len(pairs))
+    return out.decode('latin-1')
+
+
+def bench_decode(args):
+    rng = random.Random(1)
+    print(f'  {"bits":>9} {"concatenation":>14} {"in order":>9} {"shuffled":>9}')
+    for count in map(int, args.bits.split(',')):
+        bits = [rng.getrandbits(1) for _ in range(count)]
+        order = list(range(count))
+        for i in range(count):
+            j = min(count - 1, i + rng.randrange(args.shuffle + 1))
+            order[i], order[j] = order[j], order[i]
+        times = []
+        start = time.perf_counter()
+        expected = concatenated_text(bits)
+        times.append(time.perf_counter() - start)
+        for pairs in (list(enumerate(bits)), [(i, bits[i]) for i in order]):
+            start = time.perf_counter()
+            text = streamed_text(pairs)
+            times.append(time.perf_counter() - start)
+            if text != expected:
+                print(f'[!] BitDecoder output differs for {count} bits')
+        print(f'  {count:>9} {times[0]:13.2f}s {times[1]:8.2f}s {times[2]:8.2f}s')
+
+
+def bench_encode(args):
+    quality = (args.quality, args.quality)
+    with tempfile.TemporaryDirectory(prefix='codebullar-', dir=args.dir) as scratch:
+        köttbullar, hotdogs = build_assets(scratch)
+        average = sum(len(codebullar.encode_image(src, args.quality)) for src in köttbullar + hotdogs) / \
+            len(köttbullar + hotdogs)
+        print(f'[*] {len(köttbullar)} + {len(hotdogs)} source pictures, {average / 1024:.0f} KB each at quality '
+              f'{args.quality}; {os.cpu_count()} CPUs')
+        # seconds per bit of the first mode timed, which speedups are against
+        baseline = None
+        for count in map(int, args.bits.split(',')):
+            bin_str = ''.join(random.Random(count).choice('01') for _ in range(count))
+            print(f'  {"bits":>8} {"mode":>7} {"seconds":>8} {"bits/s":>10} {"speedup":>8}')
+            reference = None
+            for mode in args.modes.split(','):
+                if mode in ('serial', 'pool') and count > args.max_reencode:
+                    print(f'  {count:>8} {mode:>7}  skipped: over --max-reencode')
+                    continue
+                if mode == 'cached' and count * average > shutil.disk_usage(scratch).free / 2:
+                    print(f'  {count:>8} {mode:>7}  skipped: needs {count * average / 2 ** 30:.0f} GB')
+                    continue
+                output = os.path.join(scratch, mode)
+                start = time.perf_counter()
+                codebullar.encode(bin_str, köttbullar, hotdogs, output, mode, quality, rng=random.Random(1))
+                elapsed = time.perf_counter() - start
+                baseline = baseline or elapsed / count
+                sample = [digest for _, _, digest in hashing.hash_files(hashing.numbered_files(output)[:1000])]
+                if reference not in (None, sample):
+                    print(f'[!] --mode {mode} wrote different files')
+                reference = sample
+                print(f'  {count:>8} {mode:>7} {elapsed:8.2f} {count / elapsed:10,.0f} '
+                      f'{baseline * count / elapsed:7.1f}x')
+                shutil.rmtree(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    hash_ = sub.add_parser('hash', help='corpus hashing throughput, serial against hashing.hash_files')
+    hash_.add_argument('--files', default='5000,100000,1000000')
+    hash_.add_argument('--workers', default=f'1,4,{hashing.WORKERS}')
+    hash_.add_argument('--file-bytes', type=int, default=0, help='size of each synthetic file; 0 copies encoded/')
+    hash_.add_argument('--dir', help='where to build the corpus (default: the system temp directory)')
+    hash_.add_argument('--drop-caches', action='store_true', help='time cold reads (Linux, needs root)')
+    hash_.set_defaults(func=bench_hash)
+
+    cluster_ = sub.add_parser('cluster', help='perceptual clustering speed and accuracy on a synthetic corpus')
+    cluster_.add_argument('--bits', type=int, default=4000)
+    cluster_.add_argument('--quality', default='30-95', help='range of re-encoding qualities')
+    cluster_.add_argument('--jobs', default=','.join(str(2 ** i) for i in range((os.cpu_count() or 1).bit_length())))
+    cluster_.add_argument('--seeds', default='4,8,16', help='sizes of random labelled samples to try')
+    cluster_.add_argument('--threshold', type=int, default=cluster.THRESHOLD)
+    cluster_.add_argument('--scale', default='100000,1000000', help='resampled corpus sizes to cluster')
+    cluster_.add_argument('--noise', type=float, default=1 / 128, help='bit flip rate of the resampled fingerprints')
+    cluster_.set_defaults(func=bench_cluster)
+
+    decode = sub.add_parser('decode', help='bits-to-text time, string concatenation against bitstream.BitDecoder')
+    decode.add_argument('--bits', default='100000,1000000,10000000')
+    decode.add_argument('--shuffle', type=int, default=hashing.WORKERS * 4 * hashing.BATCH,
+                        help='how far a bit may arrive out of place (default: what hash_files keeps in flight)')
+    decode.set_defaults(func=bench_decode)
+
+    encode = sub.add_parser('encode', help="codebullar.py bits/s in each --mode")
+    encode.add_argument('--bits', default='10000,1000000')
+    encode.add_argument('--modes', default='serial,pool,cached,link')
+    encode.add_argument('--quality', type=int, default=95)
+    encode.add_argument('--max-reencode', type=int, default=20000,
+                        help='largest payload to time the per-bit re-encoding modes on')
+    encode.add_argument('--dir', help='where to write the outputs (default: the system temp directory)')
+    encode.set_defaults(func=bench_encode)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
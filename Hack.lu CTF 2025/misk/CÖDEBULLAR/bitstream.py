@@ -0,0 +1,115 @@
+"""Assembles the encoded bits into bytes as they arrive, in any order.
+
+Bit i is bit 7 - i % 8 of byte i // 8, most significant first, as
+codebullar.py lays them out. Each bit is OR'd into its byte as soon as it
+arrives, in a ring of ``window`` bytes starting at the first byte not yet
+emitted; a byte goes out once all eight of its bits are in and every byte
+before it has gone out. Memory is the ring, however long the corpus.
+
+A gap that never fills -- a file missing from the corpus -- is emitted as
+MISSING when finish() is called, or earlier if a bit arrives more than
+``window`` bytes past it.
+"""
+MISSING = ord('?')
+WINDOW = 1 << 16
+FLUSH_BYTES = 4096
+
+
+class BitDecoder:
+    def __init__(self, window=WINDOW, missing=MISSING):
+        if window & (window - 1):
+            raise ValueError("window must be a power of two")
+        self.window = window
+        self.missing_byte = missing
+        # bits seen and their values for bytes next .. next + window - 1,
+        # at position byte % window
+        self.seen = bytearray(window)
+        self.values = bytearray(window)
+        # first byte not yet emitted, and the highest byte any bit fell in
+        self.next = 0
+        self.highest = -1
+        self.bits = self.duplicate = self.late = self.missing = 0
+
+    def feed(self, pairs):
+        """Takes (index, bit) pairs and yields the bytes they complete, in
+        order, a few KB at a time and whenever ``pairs`` runs dry."""
+        seen, values, wrap = self.seen, self.values, self.window - 1
+        next_, highest, bits = self.next, self.highest, 0
+        out = bytearray()
+        try:
+            for index, bit in pairs:
+                byte = index >> 3
+                if byte < next_:
+                    self.late += 1
+                    continue
+                if byte > highest:
+                    highest = byte
+                    if byte - next_ > wrap:
+                        self.next = next_
+                        self._skip_to(byte - wrap, out)
+                        next_ = self.next
+                p = byte & wrap
+                mask = 0x80 >> (index & 7)
+                s = seen[p]
+                if s & mask:
+                    self.duplicate += 1
+                    continue
+                s |= mask
+                seen[p] = s
+                if bit:
+                    values[p] |= mask
+                bits += 1
+                if s == 0xFF and byte == next_:
+                    while seen[p] == 0xFF:
+                        out.append(values[p])
+                        seen[p] = values[p] = 0
+                        next_ += 1
+                        p = next_ & wrap
+                    if len(out) >= FLUSH_BYTES:
+                        yield bytes(out)
+                        out.clear()
+            if out:
+                yield bytes(out)
+        finally:
+            self.next, self.highest = next_, highest
+            self.bits += bits
+
+    def add(self, index, bit):
+        """feed() for a single bit; returns the bytes it completes."""
+        return b''.join(self.feed(((index, bit),)))
+
+    def finish(self, total_bits=None):
+        """Emits whatever is left, up to bit ``total_bits``, with gaps
+        filled in as MISSING; a last byte with fewer than eight bits in the
+        corpus is dropped. Without ``total_bits``, goes up to the last byte
+        any bit fell in."""
+        end = (self.highest + 1) if total_bits is None else total_bits >> 3
+        out = bytearray()
+        self._skip_to(end, out)
+        return bytes(out)
+
+    def _skip_to(self, end, out):
+        wrap = self.window - 1
+        while self.next < end:
+            p = self.next & wrap
+            if self.seen[p] == 0xFF:
+                out.append(self.values[p])
+            else:
+                out.append(self.missing_byte)
+                self.missing += 1
+            self.seen[p] = self.values[p] = 0
+            self.next += 1
+        p = self.next & wrap
+        while self.seen[p] == 0xFF:
+            out.append(self.values[p])
+            self.seen[p] = self.values[p] = 0
+            self.next += 1
+            p = self.next & wrap
+
+
+def pack_bits(binary_string):
+    """'0'/'1' text to bytes, dropping a trailing partial byte."""
+    usable = len(binary_string) // 8
+    if not usable:
+        return b''
+    return int(binary_string[:usable * 8], 2).to_bytes(usable, 'big')
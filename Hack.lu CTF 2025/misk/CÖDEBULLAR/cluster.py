@@ -0,0 +1,220 @@
+"""Labels the encoded corpus by what the pictures look like rather than by
+exact MD5, for corpora where every bit was re-encoded differently.
+
+Every image is shrunk to an 8x9 grayscale thumbnail (JPEG draft mode does
+most of the shrinking while decoding, in a process pool) and given a
+128-bit fingerprint: an aHash of the thumbnail's 8x8 column-pair means and
+a dHash of its horizontal gradients. Re-encodings of one source picture
+land a few bits apart; different pictures land tens of bits apart, so
+clustering under a Hamming threshold recovers one cluster per source
+picture.
+
+Clusters take their bit from labelled files inside them: digests already
+labelled in the hash index, or, with --interactive, an answer for one
+representative of each cluster that has none. That is one label per
+source picture -- 32 for this challenge, however many files there are.
+A meatball and a hotdog are no further apart to these hashes than two
+meatballs, so a cluster with no label can only be guessed from its
+nearest labelled neighbour; --guess writes those guesses too.
+
+    python cluster.py [encoded] [--threshold 16] [--jobs N] [--interactive] [--guess]
+"""
+import argparse
+import concurrent.futures
+import os
+import numpy as np
+from PIL import Image
+from hash_index import HashIndex
+
+THUMB = (9, 8)
+THRESHOLD = 16
+# fingerprint pairs compared at once; bounds the distance temporaries to a
+# few tens of MB however large the corpus
+BLOCK_PAIRS = 1 << 20
+# 8-bit popcounts, for numpy without bitwise_count (before 2.0)
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def thumbnail(path):
+    """An 8x9 grayscale thumbnail as a (8, 9) uint8 array."""
+    with Image.open(path) as img:
+        img.draft('L', (THUMB[0] * 8, THUMB[1] * 8))
+        return np.asarray(img.convert('L').resize(THUMB, Image.BILINEAR))
+
+
+def thumbnails(paths, jobs=None):
+    """Decodes ``paths`` on ``jobs`` processes; returns (n, 8, 9) uint8."""
+    if jobs == 1:
+        thumbs = list(map(thumbnail, paths))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            thumbs = list(pool.map(thumbnail, paths, chunksize=64))
+    return np.stack(thumbs) if thumbs else np.empty((0, THUMB[1], THUMB[0]), dtype=np.uint8)
+
+
+def fingerprints(thumbs):
+    """aHash + dHash for a stack of thumbnails; returns (n, 16) uint8."""
+    thumbs = thumbs.astype(np.int16)
+    means = thumbs[:, :, :-1] + thumbs[:, :, 1:]
+    ahash = means > means.mean(axis=(1, 2), keepdims=True)
+    dhash = thumbs[:, :, 1:] > thumbs[:, :, :-1]
+    return np.packbits(np.concatenate([ahash.reshape(len(thumbs), -1), dhash.reshape(len(thumbs), -1)], axis=1),
+                       axis=1)
+
+
+def pack(prints):
+    """(n, 16) uint8 fingerprints as (n, 2) uint64 words, for hamming()."""
+    return np.ascontiguousarray(prints).view(np.uint64)
+
+
+def popcount(words):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return POPCOUNT[words.view(np.uint8)].reshape(*words.shape, -1).sum(axis=-1, dtype=np.uint8)
+
+
+def hamming(a, b):
+    """Pairwise Hamming distances between the rows of packed fingerprints
+    ``a`` and ``b``: XOR and popcount one uint64 word at a time, so the
+    temporaries are a few bytes per pair."""
+    distances = np.zeros((len(a), len(b)), dtype=np.uint16)
+    for word in range(a.shape[1]):
+        distances += popcount(a[:, word, None] ^ b[None, :, word])
+    return distances
+
+
+def blocks(rows, columns):
+    """Row slices of ``rows`` that hold at most BLOCK_PAIRS pairs against
+    ``columns`` columns."""
+    step = max(1, BLOCK_PAIRS // max(columns, 1))
+    return [slice(start, start + step) for start in range(0, rows, step)]
+
+
+def cluster(prints, threshold=THRESHOLD, block=4096):
+    """Leader clustering of the fingerprints. Rows are taken in turn; a row
+    within ``threshold`` bits of a cluster's leader joins that cluster, a
+    row within ``threshold`` of several leaders merges their clusters, and a
+    row near no leader starts a cluster and leads it. Each row is compared
+    with the leaders only -- a few per source picture -- so the work grows
+    with the number of rows, not with the number of close pairs. Returns a
+    cluster number per row, numbered from 0 in order of first appearance.
+
+    Where re-encodings of one picture sit a few bits apart and different
+    pictures tens of bits apart, as here, this finds the same clusters as
+    single linkage; two rows within ``threshold`` of each other but not of
+    a shared leader, with no row bridging their leaders, stay apart."""
+    packed = pack(prints)
+    leaders = np.empty((0, packed.shape[1]), dtype=np.uint64)
+    leader_of = np.empty(len(packed), dtype=np.int64)
+    parent = []
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for start in range(0, len(packed), block):
+        rows = packed[start:start + block]
+        close = hamming(rows, leaders) <= threshold
+        near = close.any(axis=1)
+        if len(leaders):
+            leader_of[start:start + len(rows)] = close.argmax(axis=1)
+        # rows near more than one leader join those leaders' clusters; they
+        # fall into a handful of distinct patterns
+        for pattern in np.unique(close[close.sum(axis=1) > 1], axis=0):
+            first, *rest = (find(x) for x in np.flatnonzero(pattern))
+            for other in rest:
+                if other != first:
+                    parent[max(first, other)] = min(first, other)
+                    first = min(first, other)
+        # rows near no leader elect new ones among themselves, in order
+        pending = np.flatnonzero(~near)
+        while len(pending):
+            leader = len(leaders)
+            leaders = np.concatenate([leaders, rows[pending[:1]]])
+            parent.append(leader)
+            joined = hamming(rows[pending[:1]], rows[pending])[0] <= threshold
+            leader_of[start + pending[joined]] = leader
+            pending = pending[~joined]
+    roots = np.array([find(x) for x in range(len(leaders))], dtype=np.int64)[leader_of]
+    _, first, numbers = np.unique(roots, return_index=True, return_inverse=True)
+    # renumber by first appearance so cluster 0 holds file 0
+    order = np.argsort(np.argsort(first))
+    return order[numbers.reshape(-1)]
+
+
+def label_clusters(clusters, prints, seeds):
+    """Spreads ``seeds`` ({row: bit}) over ``clusters``. Returns
+    (bits, guessed): a bit per row, by majority of the seeds in its
+    cluster, or for a cluster without seeds, the bit of the nearest seeded
+    row; ``guessed`` marks the rows labelled that way. With no seeds at
+    all every bit is -1."""
+    count = int(clusters.max()) + 1 if len(clusters) else 0
+    votes = np.zeros((count, 2), dtype=np.int64)
+    for row, bit in seeds.items():
+        votes[clusters[row], bit] += 1
+    seeded = votes.sum(axis=1) > 0
+    cluster_bits = np.where(seeded, votes.argmax(axis=1), -1)
+    if seeds and not seeded.all():
+        packed = pack(prints)
+        rows = np.array(list(seeds))
+        seed_bits = np.array(list(seeds.values()))
+        for c in np.flatnonzero(~seeded):
+            members = np.flatnonzero(clusters == c)
+            nearest = np.full(len(rows), np.iinfo(np.uint16).max, dtype=np.uint16)
+            for block in blocks(len(members), len(rows)):
+                np.minimum(nearest, hamming(packed[members[block]], packed[rows]).min(axis=0), out=nearest)
+            cluster_bits[c] = seed_bits[nearest.argmin()]
+    return cluster_bits[clusters], ~seeded[clusters]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default='./encoded')
+    parser.add_argument('--threshold', type=int, default=THRESHOLD, help='Hamming bits, of 128, within one cluster')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--interactive', action='store_true', help='ask for a label for each unlabelled cluster')
+    parser.add_argument('--guess', action='store_true',
+                        help='also write nearest-neighbour guesses for clusters nobody labelled')
+    args = parser.parse_args()
+
+    with HashIndex() as index:
+        files, _ = index.scan(args.directory, progress=True)
+        if not files:
+            print(f"[!] No files in {args.directory}")
+            return
+        paths = [path for _, path, _ in files]
+        digests = [digest for _, _, digest in files]
+        prints = fingerprints(thumbnails(paths, args.jobs))
+        clusters = cluster(prints, args.threshold)
+        labels = index.labels()
+        seeds = {row: labels[digest] for row, digest in enumerate(digests) if digest in labels}
+        print(f"[*] {len(files)} files, {len(set(digests))} distinct digests, {clusters.max() + 1} clusters, "
+              f"{len(seeds)} files already labelled")
+
+        if args.interactive:
+            for c in range(clusters.max() + 1):
+                members = np.flatnonzero(clusters == c)
+                if any(row in seeds for row in members):
+                    continue
+                print(f"\n--- UNLABELLED CLUSTER ({len(members)} files) ---")
+                print(f"File to inspect: {paths[members[0]]}")
+                bit = ""
+                while bit not in ('0', '1'):
+                    bit = input("What's in the picture? (0 = meatball, 1 = hotdog): ")
+                index.label(digests[members[0]], bit)
+                seeds[int(members[0])] = int(bit)
+
+        bits, guessed = label_clusters(clusters, prints, seeds)
+        keep = bits >= 0 if args.guess else (bits >= 0) & ~guessed
+        index.add_labels({digests[row]: int(bits[row]) for row in np.flatnonzero(keep)})
+        print(f"[*] Labelled {keep.sum()} of {len(files)} files", end='')
+        if guessed.any():
+            print(f"; {len(set(clusters[guessed]))} clusters had no label and were "
+                  f"{'guessed from their nearest neighbour' if args.guess else 'left alone (see --guess)'}", end='')
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+import argparse
+import concurrent.futures
+import io
 import os
 import random
 from PIL import Image
@@ -5,20 +8,130 @@ from PIL import Image
 köttbullar_dir = './assets/köttbullar'
 hotdogs_dir = './assets/hotdogs'
 output_dir = './encoded'
-os.makedirs(output_dir, exist_ok=True)
 
-köttbullar_files = [os.path.join(köttbullar_dir, f) for f in os.listdir(köttbullar_dir)]
-hotdogs_files = [os.path.join(hotdogs_dir, f) for f in os.listdir(hotdogs_dir)]
 
-with open('./secret.txt', 'r') as f:
-    FLAG = f.read().strip()
+def encode_image(src, quality=95):
+    """src re-saved as a JPEG at ``quality``, as bytes."""
+    with Image.open(src) as img:
+        out = io.BytesIO()
+        img.save(out, format='JPEG', quality=quality)
+        return out.getvalue()
 
-bin_str = ''.join(format(ord(c), '08b') for c in FLAG)
 
-for i, bit in enumerate(bin_str):
-    src = random.choice(köttbullar_files) if bit == '0' else random.choice(hotdogs_files)
-    dst = os.path.join(output_dir, f'{i:04}.jpeg')
-    with Image.open(src) as img:
-        img.save(dst, format='JPEG', quality=95)
+def save_image(img, dst, quality):
+    """img saved as a JPEG at dst. Written to a new file and renamed into
+    place, never through dst's inode, which --mode link shares between
+    outputs."""
+    img.save(dst + '.tmp', format='JPEG', quality=quality)
+    os.replace(dst + '.tmp', dst)
+
+
+def write_file(dst, data):
+    """data written to dst the same way save_image does."""
+    with open(dst + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(dst + '.tmp', dst)
+
+
+def pick_sources(bin_str, köttbullar_files, hotdogs_files, rng=random):
+    return [rng.choice(köttbullar_files) if bit == '0' else rng.choice(hotdogs_files) for bit in bin_str]
+
+
+def encode_serial(sources, output_dir, qualities):
+    """The original loop: decode and re-encode the source for every bit."""
+    for i, (src, quality) in enumerate(zip(sources, qualities)):
+        dst = os.path.join(output_dir, f'{i:04}.jpeg')
+        with Image.open(src) as img:
+            save_image(img, dst, quality)
+
+
+def _encode_batch(jobs):
+    for src, dst, quality in jobs:
+        with Image.open(src) as img:
+            save_image(img, dst, quality)
+    return len(jobs)
+
+
+def encode_pool(sources, output_dir, qualities, workers=None, batch=64):
+    """encode_serial on a process pool, for when every bit needs its own
+    re-encode (a random quality, say)."""
+    jobs = [(src, os.path.join(output_dir, f'{i:04}.jpeg'), quality)
+            for i, (src, quality) in enumerate(zip(sources, qualities))]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for _ in pool.map(_encode_batch, [jobs[i:i + batch] for i in range(0, len(jobs), batch)]):
+            pass
+
+
+def encode_cached(sources, output_dir, quality=95, link=False):
+    """Encodes each distinct source once and writes every bit's file from
+    those bytes. At a fixed quality Pillow produces the same bytes each
+    time, so the output matches encode_serial's. With ``link``, the files
+    are hard links to one copy per source kept in output_dir/.sources."""
+    cache = {src: encode_image(src, quality) for src in dict.fromkeys(sources)}
+    if link:
+        source_dir = os.path.join(output_dir, '.sources')
+        os.makedirs(source_dir, exist_ok=True)
+        originals = {}
+        for n, (src, data) in enumerate(cache.items()):
+            originals[src] = os.path.join(source_dir, f'{n}.jpeg')
+            write_file(originals[src], data)
+    for i, src in enumerate(sources):
+        dst = os.path.join(output_dir, f'{i:04}.jpeg')
+        if link:
+            if os.path.lexists(dst + '.tmp'):
+                os.unlink(dst + '.tmp')
+            os.link(originals[src], dst + '.tmp')
+            os.replace(dst + '.tmp', dst)
+        else:
+            write_file(dst, cache[src])
+
+
+def encode(bin_str, köttbullar_files, hotdogs_files, output_dir, mode='cached', quality=(95, 95), workers=None,
+           rng=random):
+    os.makedirs(output_dir, exist_ok=True)
+    sources = pick_sources(bin_str, köttbullar_files, hotdogs_files, rng)
+    if mode in ('cached', 'link'):
+        if quality[0] != quality[1]:
+            raise ValueError(f"--mode {mode} encodes each source once, so it needs a single quality")
+        encode_cached(sources, output_dir, quality[0], link=mode == 'link')
+        return
+    qualities = [rng.randint(*quality) for _ in sources]
+    if mode == 'pool':
+        encode_pool(sources, output_dir, qualities, workers)
+    else:
+        encode_serial(sources, output_dir, qualities)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hides secret.txt in pictures of köttbullar (0) and hotdogs (1).")
+    parser.add_argument('--mode', choices=('cached', 'link', 'serial', 'pool'), default='cached',
+                        help="cached: encode each source once and copy the bytes (default); link: the same, "
+                             "but hard-link the outputs; serial: re-encode for every bit; pool: serial on a "
+                             "process pool")
+    parser.add_argument('--quality', default='95',
+                        help="JPEG quality, or a LOW-HIGH range to draw from for every bit (serial and pool)")
+    parser.add_argument('--workers', type=int, help="processes for --mode pool (default: one per CPU)")
+    parser.add_argument('--seed', type=int, help="seed the random choice of pictures")
+    args = parser.parse_args()
+    low, _, high = args.quality.partition('-')
+    quality = (int(low), int(high or low))
+
+    köttbullar_files = [os.path.join(köttbullar_dir, f) for f in os.listdir(köttbullar_dir)]
+    hotdogs_files = [os.path.join(hotdogs_dir, f) for f in os.listdir(hotdogs_dir)]
+
+    with open('./secret.txt', 'r') as f:
+        FLAG = f.read().strip()
+
+    bin_str = ''.join(format(ord(c), '08b') for c in FLAG)
+
+    rng = random.Random(args.seed) if args.seed is not None else random
+    try:
+        encode(bin_str, köttbullar_files, hotdogs_files, output_dir, args.mode, quality, args.workers, rng)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f'Encoded {len(bin_str)} bits with CODEBULLAR encoding')
+
 
-print(f'Encoded {len(bin_str)} bits with CODEBULLAR encoding')
+if __name__ == '__main__':
+    main()
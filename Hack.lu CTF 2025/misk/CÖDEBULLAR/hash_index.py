@@ -0,0 +1,101 @@
+"""A persistent index of the encoded corpus: path, size, mtime and MD5 of
+every file, plus the bit each digest stands for.
+
+scan() only re-hashes files whose size or mtime changed since the last
+run, so decoding a corpus that has been seen before costs a directory
+listing and a stat per file. Labels are keyed by digest, because that is
+what the mapper classifies; the same picture under many file numbers is
+labelled once.
+"""
+import os
+import sqlite3
+import time
+from hashing import WORKERS, hash_files, numbered_files
+
+INDEX_PATH = './hashes.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory, number);
+CREATE TABLE IF NOT EXISTS labels (
+    digest TEXT PRIMARY KEY,
+    bit INTEGER NOT NULL CHECK (bit IN (0, 1))
+);
+'''
+
+
+class HashIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, directory, workers=WORKERS, progress=False):
+        """Brings the index up to date with ``directory`` and returns its
+        files as (number, path, digest) in number order. Also returns how
+        many files had to be hashed."""
+        files = sorted(self.iter_scan(directory, workers, progress))
+        return files, self.hashed
+
+    def iter_scan(self, directory, workers=WORKERS, progress=False):
+        """scan() as a generator: yields (number, path, digest) for files
+        the index already has first, then for the rest as their hashes
+        complete, in no particular order. ``self.files`` holds the file
+        count once the directory has been listed, and ``self.hashed`` how
+        many of them needed hashing."""
+        directory = os.path.abspath(directory)
+        started = time.time_ns()
+        known = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in self.db.execute(
+            'SELECT path, size, mtime_ns, digest FROM files WHERE directory = ?', (directory,))}
+        fresh, stale, stats = [], [], {}
+        for number, path in numbered_files(directory):
+            st = os.stat(path)
+            stats[path] = (number, st.st_size, st.st_mtime_ns)
+            entry = known.pop(path, None)
+            if entry and entry[:2] == (st.st_size, st.st_mtime_ns):
+                fresh.append((number, path, entry[2]))
+            else:
+                stale.append((number, path))
+        self.files, self.hashed = len(stats), len(stale)
+        yield from fresh
+        rows = []
+        try:
+            for number, path, digest in hash_files(stale, workers, progress, ordered=False):
+                _, size, mtime_ns = stats[path]
+                # A file written in the same tick as this scan could change again
+                # without its mtime moving; leave it to be hashed next time too.
+                rows.append((path, directory, number, size, mtime_ns if mtime_ns < started else None, digest))
+                yield number, path, digest
+        finally:
+            with self.db:
+                self.db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in known])
+                self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def labels(self):
+        """{digest: bit} for every classified digest."""
+        return dict(self.db.execute('SELECT digest, bit FROM labels'))
+
+    def label(self, digest, bit):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO labels VALUES (?, ?)', (digest, int(bit)))
+
+    def add_labels(self, mapping):
+        """Records {digest: bit} labels, keeping any already present."""
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO labels VALUES (?, ?)',
+                                [(digest, int(bit)) for digest, bit in mapping.items()])
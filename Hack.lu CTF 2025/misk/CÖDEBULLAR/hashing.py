@@ -0,0 +1,117 @@
+"""Hashes the encoded corpus for solve.py and manual_mapper.py.
+
+Files are MD5'd on a thread pool: hashlib drops the GIL while it digests a
+buffer, and each file is mapped into memory rather than read into a bytes
+object first, so several files are hashed at once without copying them.
+Results come back in file-number order, or in completion order for callers
+that can take them that way, with at most a bounded number of files in
+flight, however large the corpus.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import mmap
+import os
+import sys
+import time
+
+WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Files smaller than this are read outright; mapping them costs more than it saves.
+MMAP_THRESHOLD = 64 * 1024
+# Files handed to a worker at a time, so small warm files aren't swamped by
+# per-task overhead.
+BATCH = 16
+
+
+def numbered_files(directory, suffix='.jpeg'):
+    """The ``suffix`` files in ``directory`` as (number, path) pairs sorted
+    by number, 0000.jpeg being 0. Raises ValueError on any other name."""
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix):
+                stem = entry.name[:-len(suffix)]
+                if not stem.isdigit():
+                    raise ValueError(f"{entry.path} is not named like '0000{suffix}'")
+                files.append((int(stem), entry.path))
+    files.sort()
+    return files
+
+
+def file_digest(filepath):
+    """(MD5 hex digest, size) of a file."""
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return hashlib.md5(f.read()).hexdigest(), size
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.md5(mapped).hexdigest(), size
+
+
+def get_file_hash(filepath):
+    """Calculates the MD5 hash of a file"""
+    return file_digest(filepath)[0]
+
+
+class Progress:
+    """A one-line files/s and MB/s readout on stderr, redrawn at most every
+    ``interval`` seconds."""
+
+    def __init__(self, total, interval=0.5, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.files = self.bytes = 0
+        self.start = self.shown = time.perf_counter()
+
+    def update(self, size):
+        self.files += 1
+        self.bytes += size
+        now = time.perf_counter()
+        if now - self.shown >= self.interval or self.files == self.total:
+            self.shown = now
+            self.stream.write(f'\r{self.line()}')
+            if self.files == self.total:
+                self.stream.write('\n')
+            self.stream.flush()
+
+    def line(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (f'[*] {self.files}/{self.total} files, {self.files / elapsed:,.0f} files/s, '
+                f'{self.bytes / elapsed / 2 ** 20:,.1f} MB/s')
+
+
+def _digest_batch(paths):
+    return [file_digest(path) for path in paths]
+
+
+def hash_files(files, workers=WORKERS, progress=False, batch=BATCH, ordered=True):
+    """Yields (number, path, digest) for the (number, path) pairs in
+    ``files``, hashing up to ``workers`` files at once. Results come in the
+    order of ``files``, or with ``ordered=False`` as soon as each batch is
+    done, so one slow file doesn't hold up the rest."""
+    meter = Progress(len(files)) if progress and files else None
+    files = iter(files)
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = collections.OrderedDict()
+        try:
+            while True:
+                chunk = list(itertools.islice(files, batch))
+                if chunk:
+                    pending[pool.submit(_digest_batch, [path for _, path in chunk])] = chunk
+                if pending and (not chunk or len(pending) >= workers * 4):
+                    if ordered:
+                        done = [next(iter(pending))]
+                    else:
+                        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        for (number, path), (digest, size) in zip(pending.pop(future), future.result()):
+                            if meter:
+                                meter.update(size)
+                            yield number, path, digest
+                elif not chunk:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
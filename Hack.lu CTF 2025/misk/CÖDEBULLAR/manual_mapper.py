@@ -1,36 +1,34 @@
-import os
-import glob
-import hashlib
-
-def get_file_hash(filepath):
-    """Calculates the MD5 hash of a file"""
-    hasher = hashlib.md5()
-    with open(filepath, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
+from hash_index import HashIndex
 
 encoded_dir = './encoded'
+index = HashIndex()
 hash_to_bit_map = {}
-seen_hashes = set()
 
 # Get and sort all files numerically
-files = glob.glob(os.path.join(encoded_dir, '*.jpeg'))
 try:
-    files.sort(key=lambda x: int(os.path.basename(x).split('.')[0]))
+    files, _ = index.scan(encoded_dir, progress=True)
 except ValueError:
     print(f"Error sorting files. Ensure filenames are like '0000.jpeg'.")
     exit()
 
+# Hashes labelled on an earlier run are not asked about again.
+labels = index.labels()
+unique_hashes = {file_hash for _, _, file_hash in files}
+seen_hashes = unique_hashes & labels.keys()
+for file_hash in seen_hashes:
+    hash_to_bit_map[file_hash] = str(labels[file_hash])
+
 print("Starting manual hash mapping...")
-print(f"A total of 32 unique hashes were found.\n")
+print(f"A total of {len(unique_hashes)} unique hashes were found, {len(seen_hashes)} already labelled.\n")
+
+for _, filepath, file_hash in files:
+    if len(seen_hashes) == len(unique_hashes):
+        print(f"\n--- All {len(unique_hashes)} unique hashes have been mapped. ---")
+        break
 
-for filepath in files:
-    file_hash = get_file_hash(filepath)
-    
     # If this is a new, unseen hash
     if file_hash not in seen_hashes:
-        print(f"\n--- NEW HASH FOUND ({len(seen_hashes) + 1}/32) ---")
+        print(f"\n--- NEW HASH FOUND ({len(seen_hashes) + 1}/{len(unique_hashes)}) ---")
         print(f"File to inspect: {filepath}")
         print(f"Hash: {file_hash}")
         
@@ -41,14 +39,15 @@ for filepath in files:
         
         hash_to_bit_map[file_hash] = bit
         seen_hashes.add(file_hash)
+        index.label(file_hash, bit)
         print(f"-> Saved: '{file_hash}' is '{bit}'")
-        
-    if len(seen_hashes) == 32:
-        print("\n--- All 32 unique hashes have been mapped. ---")
-        break
+else:
+    print(f"\n--- All {len(unique_hashes)} unique hashes have been mapped. ---")
+
+index.close()
 
 print("\n\n--- COMPLETE DICTIONARY FOR DECODER ---")
-print("Copy this dictionary into your decoder.py script:\n")
+print("solve.py reads these from the index; the dictionary is for reference:\n")
 print("hash_to_bit_map = {")
 for file_hash, bit in hash_to_bit_map.items():
     print(f"    '{file_hash}': '{bit}',")
@@ -1,6 +1,5 @@
-import os
-import glob
-import hashlib
+from bitstream import BitDecoder, pack_bits
+from hash_index import HashIndex
 
 hash_to_bit_map = {
     '9b6e11ad1b835cd3fb4e4c4999bbcb5b': '0',
@@ -37,64 +36,61 @@ hash_to_bit_map = {
     'c66bd7d67171f5247a12b3acfebe01d9': '0',
 }
 
-def get_file_hash(filepath):
-    """Calculates the MD5 hash of a file"""
-    hasher = hashlib.md5()
-    with open(filepath, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
-
 def decode_bits_to_text(binary_string):
     """Converts a binary string into ASCII text"""
-    text = ""
-    for i in range(0, len(binary_string), 8):
-        byte = binary_string[i:i+8]
-        if len(byte) == 8:
+    try:
+        return pack_bits(binary_string).decode('latin-1')
+    except ValueError:
+        # Not all 0s and 1s: decode byte by byte with "?" for the bad ones
+        text = []
+        for i in range(0, len(binary_string) - 7, 8):
             try:
-                char_code = int(byte, 2)
-                text += chr(char_code)
-            except Exception:
-                text += "?" # Add '?' for non-printable chars
-    return text
+                text.append(chr(int(binary_string[i:i+8], 2)))
+            except ValueError:
+                text.append("?")
+        return "".join(text)
 
 def main():
     encoded_dir = './encoded'
-    
-    if not hash_to_bit_map:
-        print("Error: 'hash_to_bit_map' is empty. Please run manual_mapper.py first.")
-        return
+    decoder = BitDecoder()
+    flag_bytes = bytearray()
 
-    files = glob.glob(os.path.join(encoded_dir, '*.jpeg'))
-    
-    # Critically important: sort files numerically
-    try:
-        files.sort(key=lambda x: int(os.path.basename(x).split('.')[0]))
-    except ValueError as e:
-        print(f"Error sorting files: {e}")
-        return
+    with HashIndex() as index:
+        # The table above is what manual_mapper.py found for the original
+        # corpus; anything it has labelled since lives in the index.
+        index.add_labels(hash_to_bit_map)
+        labels = index.labels()
+        last = -1
 
-    print(f"Found {len(files)} files to decode...")
-    
-    binary_string = ""
-    for filepath in files:
-        file_hash = get_file_hash(filepath)
-        
-        if file_hash in hash_to_bit_map:
-            bit = hash_to_bit_map[file_hash]
-            binary_string += bit
-        else:
-            print(f"\n! ERROR: Unknown file hash: {file_hash} (for file {filepath})")
-            print("! Please add this hash to 'hash_to_bit_map'.")
+        def labelled_bits():
+            nonlocal last
+            for number, filepath, file_hash in index.iter_scan(encoded_dir, progress=True):
+                if file_hash not in labels:
+                    raise LookupError(f"Unknown file hash: {file_hash} (for file {filepath})")
+                last = max(last, number)
+                yield number, labels[file_hash]
+
+        # Bits arrive in whatever order the hashes complete; the decoder
+        # puts them back in file-number order.
+        try:
+            for chunk in decoder.feed(labelled_bits()):
+                flag_bytes += chunk
+        except ValueError as e:
+            print(f"Error sorting files: {e}")
+            return
+        except LookupError as e:
+            print(f"\n! ERROR: {e}")
+            print("! Please run manual_mapper.py to label it.")
             return
+        flag_bytes += decoder.finish(last + 1)
+
+    print(f"Decoded {index.files} files ({index.hashed} hashed, the rest unchanged since the last run)...")
+    print(f"Assembled {decoder.bits} bits into {len(flag_bytes)} bytes")
+    if decoder.missing:
+        print(f"! {decoder.missing} bytes had bits missing from the corpus and show as '?'")
 
-    print(f"Assembled binary string of length: {len(binary_string)} bits")
-    
-    # Decode the string
-    flag_text = decode_bits_to_text(binary_string)
-    
     print("\n--- RESULT ---")
-    print(flag_text)
+    print(flag_bytes.decode('latin-1'))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,17 +1,32 @@
 from flask import Flask
+import fcntl
 import os
-from models import init_db, DB_FILE
+from models import init_db, release_db, DB_FILE
 from auth import create_auth_routes
 from routes import create_main_routes
+from migrations import migrate
+from metrics import init_metrics
 
 app = Flask(__name__)
 app.secret_key = 'somesecret'
+app.teardown_appcontext(release_db)
+init_metrics(app)
 
 
 create_auth_routes(app)
 create_main_routes(app)
 
+def prepare_database():
+    """Creates the database if it is missing and applies pending migrations.
+    Processes starting together, such as uvicorn's workers, take turns on a
+    lock file, so only the first does any work."""
+    with open(DB_FILE + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(DB_FILE):
+            init_db()
+        migrate()
+
 if __name__ == '__main__':
-    if not os.path.exists(DB_FILE):
-        init_db()
+    # Development server only; production runs gunicorn -c gunicorn.conf.py app:app
+    prepare_database()
     app.run(debug=False, host='0.0.0.0')
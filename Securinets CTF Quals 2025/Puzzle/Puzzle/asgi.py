@@ -0,0 +1,197 @@
+"""ASGI entry point: uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The hot read routes -- /home, /article/<uuid>, /profile and /users/<uuid> --
+are served natively on the event loop through models_async, so thousands of
+idle keep-alive clients cost a socket each rather than a thread each. Every
+other request, and any request these handlers cannot answer without writing
+the session, goes to the Flask app through a2wsgi's thread pool of
+PUZZLE_THREADS threads.
+
+The native handlers read the same signed session cookie, render the same
+templates and return the same responses as their Flask counterparts in
+routes.py; keep the two in step. Requests are recorded in /metrics under the
+Flask URL rules.
+
+Each worker's startup runs prepare_database(), which creates and migrates
+the database. Workers that start together take turns on its lock file, and
+every worker after the first finds nothing left to do.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qsl
+from a2wsgi import WSGIMiddleware
+from flask import Response
+from itsdangerous import BadSignature
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException, InternalServerError
+from werkzeug.http import parse_cookie
+from werkzeug.utils import redirect
+from app import app as flask_app, prepare_database
+from metrics import METRICS_ENABLED, observe_request
+from models import HOME_ARTICLES_SQL, ARTICLE_COUNT_SQL, ARTICLE_SQL, USER_BY_UUID_SQL, release_db
+from models_async import get_db, close_db, fetchone, fetch_page, get_cached_user, sql_stats
+from routes import page_args
+
+WSGI_THREADS = int(os.environ.get('PUZZLE_THREADS', '4'))
+
+log = logging.getLogger('puzzle.asgi')
+wsgi_app = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+_session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+_session_max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+
+
+class Delegate(Exception):
+    """Raised by a handler to hand the request to Flask instead."""
+
+
+def load_session(scope):
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookie = parse_cookie(value.decode('latin-1')).get(flask_app.config['SESSION_COOKIE_NAME'])
+            if cookie:
+                try:
+                    return _session_serializer.loads(cookie, max_age=_session_max_age)
+                except BadSignature:
+                    return {}
+    return {}
+
+
+def render(name, session, **context):
+    start = time.perf_counter()
+    body = flask_app.jinja_env.get_template(name).render(session=session, **context)
+    stats = sql_stats.get()
+    if stats is not None:
+        stats[2] += time.perf_counter() - start
+    return Response(body)
+
+
+def json_response(data, status=200):
+    with flask_app.app_context():
+        response = flask_app.json.response(data)
+    response.status_code = status
+    return response
+
+
+async def home(session, args):
+    if not session.get('uuid'):
+        return redirect('/login')
+    user = await get_cached_user(session['uuid'])
+    if not user:
+        return redirect('/login')
+    if session.get('first_login'):
+        # Showing the first-login password clears it from the session.
+        raise Delegate
+    after, limit = page_args(args=args)
+    async with get_db() as conn:
+        rows, next_cursor = await fetch_page(conn, HOME_ARTICLES_SQL, session['uuid'], after, limit)
+        article_count = (await fetchone(conn, ARTICLE_COUNT_SQL, (session['uuid'],)))[0]
+    return render('home.html', session, articles=[dict(row) for row in rows], article_count=article_count,
+                  first_login_password=None, next_cursor=next_cursor)
+
+
+async def profile(session, args):
+    if not session.get('uuid'):
+        return redirect('/login')
+    user = await get_cached_user(session['uuid'])
+    if not user:
+        return redirect('/login')
+    return render('profile.html', session, user=user)
+
+
+async def view_article(session, args, article_uuid):
+    if not session.get('uuid'):
+        return redirect('/login')
+    async with get_db() as conn:
+        article = await fetchone(conn, ARTICLE_SQL, (article_uuid,))
+    if not article:
+        return Response('Article not found', 404)
+    return render('article.html', session, article=dict(article))
+
+
+async def get_user_details(session, args, target_uuid):
+    if not session.get('uuid'):
+        return json_response({'error': 'Unauthorized'}, 401)
+    requester = await get_cached_user(session['uuid'])
+    if not requester or requester['role'] not in ('0', '1'):
+        return json_response({'error': 'Invalid user role'}, 403)
+    async with get_db() as conn:
+        user = await fetchone(conn, USER_BY_UUID_SQL, (target_uuid,))
+    if not user:
+        return json_response({'error': 'User not found'}, 404)
+    return json_response({key: user[key] for key in ('uuid', 'username', 'email', 'phone_number', 'role', 'password')})
+
+
+# (pattern, handler, URL rule reported to /metrics)
+ROUTES = [
+    (re.compile(r'/home'), home, '/home'),
+    (re.compile(r'/profile'), profile, '/profile'),
+    (re.compile(r'/article/([^/]+)'), view_article, '/article/<string:article_uuid>'),
+    (re.compile(r'/users/([^/]+)'), get_user_details, '/users/<string:target_uuid>'),
+]
+
+
+def match(scope):
+    if scope['method'] not in ('GET', 'HEAD'):
+        return None
+    for pattern, handler, rule in ROUTES:
+        m = pattern.fullmatch(scope['path'])
+        if m:
+            return handler, m.groups(), rule
+    return None
+
+
+async def send_response(send, response, head=False):
+    headers = [(k.encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]
+    headers.append((b'vary', b'Cookie'))
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'' if head else response.get_data()})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            def prepare():
+                prepare_database()
+                release_db()
+            try:
+                await asyncio.to_thread(prepare)
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_db()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    route = match(scope) if scope['type'] == 'http' else None
+    if route is None:
+        return await wsgi_app(scope, receive, send)
+    handler, params, rule = route
+    start = time.perf_counter()
+    # [sql statements, sql seconds, render seconds]
+    stats = [0, 0.0, 0.0]
+    token = sql_stats.set(stats)
+    try:
+        args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+        response = await handler(load_session(scope), args, *params)
+    except Delegate:
+        return await wsgi_app(scope, receive, send)
+    except HTTPException as e:
+        response = e.get_response()
+    except Exception:
+        log.exception('error serving %s', scope['path'])
+        response = InternalServerError().get_response()
+    finally:
+        sql_stats.reset(token)
+    await send_response(send, response, head=scope['method'] == 'HEAD')
+    if METRICS_ENABLED:
+        observe_request(rule, scope['method'], response.status_code, time.perf_counter() - start, *stats)
@@ -1,10 +1,34 @@
-from flask import request, jsonify, render_template, redirect, session
+from flask import request, jsonify, render_template, redirect, session, g
 import sqlite3
 import secrets
 import string
+import threading
 from uuid import uuid4
 from functools import wraps
-from models import DB_FILE, get_user_by_username, get_user_by_uuid
+from models import get_db, get_user_by_username, get_cached_user, user_cache
+
+_request_hits = 0
+_request_hits_lock = threading.Lock()
+
+def current_user():
+    """Resolves session['uuid'] once per request; repeat calls reuse flask.g
+    and first calls go through the cross-request user cache."""
+    global _request_hits
+    uuid_ = session.get('uuid')
+    if not uuid_:
+        return None
+    if g.get('current_user_uuid') == uuid_:
+        with _request_hits_lock:
+            _request_hits += 1
+        return g.current_user
+    g.current_user = get_cached_user(uuid_)
+    g.current_user_uuid = uuid_
+    return g.current_user
+
+def user_cache_stats():
+    stats = user_cache.stats()
+    stats['request_hits'] = _request_hits
+    return stats
 
 def admin_required(f):
     @wraps(f)
@@ -12,7 +36,7 @@ def admin_required(f):
         if not session.get('uuid'):
             return redirect('/login')
         
-        user = get_user_by_uuid(session['uuid'])
+        user = current_user()
         if not user or user['role'] != '0':
             return jsonify({'error': 'Admin access required'}), 403
             
@@ -23,7 +47,7 @@ def create_auth_routes(app):
     @app.route('/login', methods=['GET', 'POST'])
     def login():
         if session.get('uuid'):
-            user = get_user_by_uuid(session['uuid'])
+            user = current_user()
             if user:
                 return redirect('/home')
             
@@ -70,7 +94,7 @@ def create_auth_routes(app):
         uid = str(uuid4())
 
         try:
-            with sqlite3.connect(DB_FILE) as db:
+            with get_db() as db:
                 db.execute('INSERT INTO users (uuid, username, email, password, role) VALUES (?, ?, ?, ?, ?)',
                            (uid, username, email, password, role))
                 db.commit()
@@ -0,0 +1,722 @@
+"""Local benchmarks for the Puzzle app.
+
+Every benchmark runs in a scratch directory with its own db.sqlite, so it
+never touches the real database. Most requests go through Flask's test
+client, which measures the application side of each route without network
+noise; `download` needs a real server and socket, so it starts one.
+
+    python bench.py pool [--requests 2000]
+    python bench.py pagination [--sizes 10,1000,10000,100000] [--requests 300]
+    python bench.py listing [--files 20000] [--requests 200]
+    python bench.py download [--size-mb 256] [--requests 8]
+    python bench.py template [--iterations 20000]
+    python bench.py scaling [--workers 1,2,4] [--clients 32] [--duration 10]
+    python bench.py metrics [--requests 2000] [--rounds 5]
+    python bench.py writes [--publishers 1,4,16,64] [--requests 200]
+    python bench.py search [--sizes 10000,100000,1000000] [--queries 20] [--authors 1000]
+    python bench.py async [--clients 100,1000,2000] [--duration 10]
+"""
+import argparse
+import asyncio
+import atexit
+import concurrent.futures
+import contextlib
+import http.client
+import io
+import itertools
+import json
+import threading
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ORIGINAL_CWD = os.getcwd()
+WORKDIR = tempfile.mkdtemp(prefix='puzzle-bench-')
+os.chdir(WORKDIR)
+sys.path.insert(0, HERE)
+
+import models
+from models import init_db, get_db, encode_cursor
+from app import app
+from migrations import migrate
+
+
+@atexit.register
+def _remove_workdir():
+    models.close_db()
+    os.chdir(ORIGINAL_CWD)
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+def seed_user(username, role='2', articles=0):
+    uid = str(uuid4())
+    with get_db() as conn:
+        conn.execute('INSERT INTO users (uuid, username, email, password, role) VALUES (?, ?, ?, ?, ?)',
+                     (uid, username, f'{username}@bench.local', 'benchpass', role))
+        conn.executemany('INSERT INTO articles (uuid, title, content, author_uuid) VALUES (?, ?, ?, ?)',
+                         [(str(uuid4()), f'Article {i}', 'lorem ipsum ' * 40, uid) for i in range(articles)])
+    models.release_db()
+    return uid
+
+
+def login(client, uid):
+    with client.session_transaction() as sess:
+        sess['uuid'] = uid
+
+
+def measure(label, count, fn):
+    fn()
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f'  {label:<24} {count / elapsed:10.1f} req/s  ({elapsed * 1000 / count:.3f} ms/req)')
+    return count / elapsed
+
+
+def bench_pool(args):
+    init_db()
+    migrate()
+    reader = seed_user('bench_reader', articles=20)
+    with get_db() as conn:
+        article_uuid = conn.execute('SELECT uuid FROM articles LIMIT 1').fetchone()[0]
+    models.release_db()
+    # /publish caps every author at 20 articles, so rotate through writers.
+    writers = [seed_user(f'bench_writer_{i}') for i in range(args.requests // 20 * 2 + 2)]
+
+    results = {}
+    for pooled in (False, True):
+        models.DB_POOL = pooled
+        mode = 'pooled' if pooled else 'connect-per-call'
+        print(f'[{mode}]')
+        client = app.test_client()
+        login(client, reader)
+
+        def home(i=0):
+            assert client.get('/home').status_code == 200
+
+        def article(i=0):
+            assert client.get(f'/article/{article_uuid}').status_code == 200
+
+        def publish(i=0, offset=len(writers) // 2 * pooled):
+            login(client, writers[offset + i // 20])
+            client.post('/publish', data={'title': 't', 'content': 'c'})
+
+        results[mode] = [
+            measure('/home', args.requests, home),
+            measure('/article/<uuid>', args.requests, article),
+            measure('/publish', args.requests, publish),
+        ]
+    before, after = results['connect-per-call'], results['pooled']
+    print('[speedup]')
+    for label, b, a in zip(('/home', '/article/<uuid>', '/publish'), before, after):
+        print(f'  {label:<24} {a / b:10.2f}x')
+
+
+def percentiles(samples):
+    if not samples:
+        return {50: float('nan'), 99: float('nan')}
+    samples = sorted(samples)
+    return {p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000 for p in (50, 99)}
+
+
+def bench_pagination(args):
+    init_db()
+    migrate()
+    client = app.test_client()
+    localhost = {'REMOTE_ADDR': '127.0.0.1'}
+    print(f'  {"articles":>9}  {"endpoint":<32} {"p50 ms":>8} {"p99 ms":>8}')
+    for size in map(int, args.sizes.split(',')):
+        uid = seed_user(f'bench_history_{size}')
+        with get_db() as conn:
+            conn.executemany('INSERT INTO articles (uuid, title, content, author_uuid, created_at) VALUES (?, ?, ?, ?, ?)',
+                             ((str(uuid4()), f'Article {i}', 'lorem ipsum ' * 40, uid,
+                               time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1.6e9 + i))) for i in range(size)))
+            conn.executemany('INSERT INTO collab_requests (uuid, title, content, from_uuid, to_uuid, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                             ((str(uuid4()), f'Request {i}', 'lorem ipsum', uid, uid,
+                               time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1.6e9 + i))) for i in range(size)))
+            # Cursors from the middle of the history, to show deep pages cost
+            # the same as the first one.
+            middle = {table: encode_cursor(*conn.execute(
+                f'SELECT created_at, uuid FROM {table} WHERE {column} = ? ORDER BY created_at DESC, uuid DESC LIMIT 1 OFFSET ?',
+                (uid, size // 2)).fetchone()) for table, column in (('articles', 'author_uuid'), ('collab_requests', 'from_uuid'))}
+        models.release_db()
+        login(client, uid)
+        endpoints = [
+            ('/home', lambda: client.get('/home')),
+            ('/home?before=<middle>', lambda: client.get(f"/home?before={middle['articles']}")),
+            ('/collaborations', lambda: client.get('/collaborations')),
+            ('/collab/requests', lambda: client.get('/collab/requests', environ_base=localhost)),
+            ('/collab/requests?before=<middle>',
+             lambda: client.get(f"/collab/requests?before={middle['collab_requests']}", environ_base=localhost)),
+        ]
+        for label, call in endpoints:
+            samples = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                assert call().status_code == 200
+                samples.append(time.perf_counter() - start)
+            p = percentiles(samples)
+            print(f'  {size:>9}  {label:<32} {p[50]:8.3f} {p[99]:8.3f}')
+
+
+def bench_listing(args):
+    import dircache
+    init_db()
+    migrate()
+    for i in range(args.files):
+        with open(os.path.join(models.DB_DIR, f'dump_{i:06}.sqlite'), 'wb') as f:
+            f.write(b'\0' * (i % 4096))
+    # Age the directory past the racy-mtime window so listings get cached.
+    old = time.time_ns() - 10 ** 10
+    os.utime(models.DB_DIR, ns=(old, old))
+    client = app.test_client()
+    print(f'[{args.files} files in /db]')
+    measure('/db uncached', args.requests, lambda i=0: (dircache.invalidate(), client.get('/db')))
+    measure('/db cached', args.requests, lambda i=0: client.get('/db'))
+    measure('/db/ uncached', args.requests, lambda i=0: (dircache.invalidate(), client.get('/db/')))
+    measure('/db/ cached', args.requests, lambda i=0: client.get('/db/'))
+
+
+def bench_template(args):
+    from flask import render_template_string
+    import templating
+    cases = (
+        ('plain message', 'User account alice is too recent to be banned'),
+        ('message with {{ }}', 'User {{ 7 * 7 }} does not exist.'),
+    )
+    with app.test_request_context():
+        for label, source in cases:
+            print(f'[{label}]')
+            before = measure('render_template_string', args.iterations, lambda i=0: render_template_string(source))
+            after = measure('render_cached_string', args.iterations, lambda i=0: templating.render_cached_string(source))
+            print(f'  {"speedup":<24} {after / before:10.2f}x')
+    print(f'[*] Template cache: {templating.cache_stats()}')
+
+
+def serve(args):
+    """Runs the app on a real server for `download`, plus two helper routes:
+    the stock send_file baseline and the worker's CPU clock."""
+    from flask import send_file, jsonify
+    os.chdir(args.workdir)
+
+    @app.route('/bench/send_file/<name>')
+    def bench_send_file(name):
+        return send_file(os.path.abspath(os.path.join(models.DB_DIR, name)))
+
+    @app.route('/bench/cpu')
+    def bench_cpu():
+        return jsonify(cpu=time.process_time())
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        from werkzeug.serving import run_simple
+        run_simple('127.0.0.1', args.port, app, threaded=True)
+        return
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'127.0.0.1:{args.port}')
+            self.cfg.set('workers', 1)
+            self.cfg.set('loglevel', 'warning')
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def bench_download(args):
+    path = os.path.join(models.DB_DIR, 'dump.bin')
+    with open(path, 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+    size = args.size_mb * 1024 * 1024
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '_serve',
+                               '--port', str(port), '--workdir', WORKDIR])
+    try:
+        for _ in range(100):
+            try:
+                http.client.HTTPConnection('127.0.0.1', port, timeout=1).request('GET', '/bench/cpu')
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        def fetch(url, headers):
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', url, headers=headers)
+            resp = conn.getresponse()
+            received = 0
+            while chunk := resp.read(1024 * 1024):
+                received += len(chunk)
+            conn.close()
+            return received
+
+        def cpu():
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', '/bench/cpu')
+            return float(conn.getresponse().read().split(b':')[1].strip(b'}\n '))
+
+        print(f'  {"route":<28} {"request":<12} {"MB/s":>9} {"CPU s/GB":>9}')
+        for label, url in (('send_download (/db)', '/db/dump.bin'),
+                           ('send_file baseline', '/bench/send_file/dump.bin')):
+            for kind, headers in (('full', {}), ('range', {'Range': f'bytes=1-{size - 2}'})):
+                fetch(url, headers)
+                cpu_start, start = cpu(), time.perf_counter()
+                served = sum(fetch(url, headers) for _ in range(args.requests))
+                elapsed, cpu_used = time.perf_counter() - start, cpu() - cpu_start
+                gb = served / 1024 ** 3
+                print(f'  {label:<28} {kind:<12} {served / 1024 ** 2 / elapsed:9.1f} {cpu_used / gb:9.3f}')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def server_login(port, username):
+    """Logs in to a server that is still starting up; returns the cookie."""
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('POST', '/login', body=f'username={username}&password=benchpass',
+                         headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            return conn.getresponse().getheader('Set-Cookie').split(';')[0]
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def _load_process(port, cookie, paths, duration, threads):
+    """One load-generating process: ``threads`` keep-alive clients cycling
+    through ``paths`` until ``duration`` elapses. Returns latencies."""
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        mine = []
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            conn.request('GET', paths[i % len(paths)], headers={'Cookie': cookie})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f'{paths[i % len(paths)]} -> {resp.status}')
+            mine.append(time.perf_counter() - start)
+            i += 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    pool = [threading.Thread(target=client) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies
+
+
+def bench_scaling(args):
+    init_db()
+    migrate()
+    uid = seed_user('bench_scaling', articles=20)
+    with get_db() as conn:
+        article_uuid = conn.execute('SELECT uuid FROM articles WHERE author_uuid = ? LIMIT 1', (uid,)).fetchone()[0]
+    models.release_db()
+    paths = ['/home', f'/article/{article_uuid}', '/profile']
+    processes = min(args.clients, os.cpu_count() or 1)
+    print(f'[*] {os.cpu_count()} CPUs; {args.clients} keep-alive clients in {processes} processes; '
+          f'load and server share the machine')
+    print(f'  {"workers":>7} {"req/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"scaling":>8}')
+    baseline = None
+    for workers in map(int, args.workers.split(',')):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(HERE, 'gunicorn.conf.py'),
+                                   '--chdir', WORKDIR, '--pythonpath', HERE, '--bind', f'127.0.0.1:{port}',
+                                   '--workers', str(workers), '--log-level', 'warning', 'app:app'])
+        try:
+            cookie = server_login(port, 'bench_scaling')
+            threads = [args.clients // processes + (i < args.clients % processes) for i in range(processes)]
+            with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+                results = executor.map(_load_process, [port] * processes, [cookie] * processes,
+                                       [paths] * processes, [args.duration] * processes, threads)
+                latencies = [latency for result in results for latency in result]
+        finally:
+            server.terminate()
+            server.wait()
+        rate = len(latencies) / args.duration
+        baseline = baseline or rate / workers
+        p = percentiles(latencies)
+        print(f'  {workers:>7} {rate:10.1f} {p[50]:8.2f} {p[99]:8.2f} {rate / baseline:7.2f}x')
+
+
+METRICS_ROUTES = ('/home', '/article/<uuid>', '/profile', '/db')
+
+
+def metrics_run(args):
+    """One side of `metrics`: replays METRICS_ROUTES in a process whose
+    PUZZLE_METRICS was set by the parent, and prints req/s as JSON."""
+    os.chdir(args.workdir)
+    with get_db() as conn:
+        uid, article_uuid = conn.execute(
+            "SELECT author_uuid, uuid FROM articles WHERE author_uuid = "
+            "(SELECT uuid FROM users WHERE username = 'bench_metrics') LIMIT 1").fetchone()
+    models.release_db()
+    client = app.test_client()
+    login(client, uid)
+    urls = [route.replace('<uuid>', article_uuid) for route in METRICS_ROUTES]
+    rates = dict.fromkeys(METRICS_ROUTES, 0)
+    for url in urls:
+        for _ in range(50):
+            client.get(url)
+    # Short bursts, best one kept, so a noisy neighbour costs a burst and
+    # not the whole run.
+    burst = max(1, args.requests // 10)
+    for _ in range(10):
+        for route, url in zip(METRICS_ROUTES, urls):
+            start = time.perf_counter()
+            for _ in range(burst):
+                assert client.get(url).status_code == 200
+            rates[route] = max(rates[route], burst / (time.perf_counter() - start))
+    print(json.dumps(rates))
+
+
+def bench_metrics(args):
+    init_db()
+    migrate()
+    seed_user('bench_metrics', articles=20)
+    for i in range(200):
+        with open(os.path.join(models.DB_DIR, f'dump_{i:03}.sqlite'), 'wb') as f:
+            f.write(b'\0' * i)
+    best = {'0': {}, '1': {}}
+    # Alternate the two modes so drift in machine load hits both alike.
+    for _ in range(args.rounds):
+        for enabled in ('0', '1'):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '_metrics_run', '--workdir', WORKDIR,
+                                  '--requests', str(args.requests)],
+                                 env={**os.environ, 'PUZZLE_METRICS': enabled}, capture_output=True, text=True, check=True)
+            for route, rate in json.loads(out.stdout.splitlines()[-1]).items():
+                best[enabled][route] = max(best[enabled].get(route, 0), rate)
+    # The same work the hooks do for a request with two statements and one
+    # template, timed on its own: a floor that does not depend on noise.
+    import metrics
+    with app.test_request_context('/home'):
+        response = app.response_class()
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            metrics._start_request()
+            metrics._record_sql('SELECT 1', 0.0)
+            metrics._record_sql('', 0.0, statements=0)
+            metrics._render_started(app, None, None)
+            metrics._render_finished(app, None, None)
+            metrics._set_status(response)
+            metrics._finish_request()
+        hooks = (time.perf_counter() - start) / args.requests
+
+    print(f'[best of {args.rounds} rounds, {args.requests} requests each]')
+    print(f'  {"route":<24} {"off req/s":>10} {"on req/s":>10} {"overhead":>9} {"us/req":>7}')
+    for route in METRICS_ROUTES:
+        off, on = best['0'][route], best['1'][route]
+        print(f'  {route:<24} {off:10.1f} {on:10.1f} {(off / on - 1) * 100:8.1f}% {(1 / on - 1 / off) * 1e6:7.1f}')
+    print(f'[*] Hooks alone: {hooks * 1e6:.1f} us/request, '
+          f'{hooks * max(best["0"].values()) * 100:.2f}% of the fastest route')
+
+
+def bench_writes(args):
+    import logging
+    import writer
+    # Inline writers queue on SQLite's lock long enough to flood the slow-query log.
+    logging.getLogger('puzzle.sql').disabled = True
+    init_db()
+    migrate()
+    print('[*] inline: one commit per request, synchronous=NORMAL on the pooled connection')
+    print('[*] group commit: one durable (synchronous=FULL) commit per batch')
+    print(f'  {"mode":<14} {"publishers":>10} {"writes/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for batching in (False, True):
+        writer.WRITE_BATCHING = batching
+        mode = 'group commit' if batching else 'inline'
+        for publishers in map(int, args.publishers.split(',')):
+            # /publish caps every author at 20 articles.
+            authors = [[str(uuid4()) for _ in range(-(-args.requests // 20))] for _ in range(publishers)]
+            with get_db() as conn:
+                conn.executemany('INSERT INTO users (uuid, username, email, password, role) VALUES (?, ?, ?, ?, ?)',
+                                 [(uid, uid, f'{uid}@bench.local', 'benchpass', '2') for mine in authors for uid in mine])
+            models.release_db()
+            latencies, errors = [], []
+            barrier = threading.Barrier(publishers + 1)
+
+            def publisher(mine):
+                client = app.test_client()
+                samples, failed = [], 0
+                barrier.wait()
+                for i in range(args.requests):
+                    if i % 20 == 0:
+                        login(client, mine[i // 20])
+                    start = time.perf_counter()
+                    status = client.post('/publish', data={'title': 't', 'content': 'c'}).status_code
+                    samples.append(time.perf_counter() - start)
+                    failed += status != 200
+                latencies.extend(samples)
+                errors.append(failed)
+
+            threads = [threading.Thread(target=publisher, args=(mine,)) for mine in authors]
+            for t in threads:
+                t.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            p = percentiles(latencies)
+            written = len(latencies) - sum(errors)
+            print(f'  {mode:<14} {publishers:>10} {written / elapsed:10.1f} {p[50]:8.2f} {p[99]:8.2f} {sum(errors):>7}')
+    stats = writer.writer_stats()
+    print(f"[*] Group commits: {stats['batches']}, mean batch {stats['mean_batch']:.1f} writes")
+
+
+NAIVE_SEARCH_SQL = """
+    SELECT articles.uuid, articles.title, articles.created_at, author.username AS author_name
+    FROM articles JOIN users author ON author.uuid = articles.author_uuid
+    WHERE (articles.author_uuid = :user OR articles.collaborator_uuid = :user)
+      AND (articles.title LIKE :pattern OR articles.content LIKE :pattern)
+    ORDER BY articles.created_at DESC
+    LIMIT :limit
+"""
+
+
+def bench_search(args):
+    import logging
+    import random
+    import seed
+    import search
+    # The bulk loads would flood the slow-query log.
+    logging.getLogger('puzzle.sql').disabled = True
+    init_db()
+    migrate()
+    rng = random.Random(1)
+    # Zipf-distributed vocabulary, so queries can pick rare and common words.
+    vocabulary = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(4, 9))) for _ in range(20000)]
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    # Many authors, so a search has the whole corpus to ignore; one in ten
+    # articles also has a collaborator.
+    authors = [str(uuid4()) for _ in range(args.authors)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed.bulk_load({'users': ({'uuid': uid, 'username': f'bench_search_{i}'} for i, uid in enumerate(authors))})
+
+    def articles(count):
+        for _ in range(count):
+            words = rng.choices(vocabulary, cum_weights=cum_weights, k=48)
+            yield {'uuid': str(uuid4()), 'title': ' '.join(words[:4]), 'content': ' '.join(words[4:]),
+                   'author_uuid': rng.choice(authors),
+                   'collaborator_uuid': rng.choice(authors) if rng.random() < 0.1 else None,
+                   'created_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(rng.randrange(1_600_000_000, 1_700_000_000)))}
+
+    queries = {
+        'common word': lambda: vocabulary[rng.randrange(10, 50)],
+        'rare word': lambda: vocabulary[rng.randrange(5000, 20000)],
+        'two words': lambda: f'{vocabulary[rng.randrange(50, 500)]} {vocabulary[rng.randrange(50, 500)]}',
+        'prefix': lambda: vocabulary[rng.randrange(500, 5000)][:3],
+    }
+    print(f'  {"articles":>9}  {"query":<12} {"fts p50 ms":>11} {"fts p99 ms":>11} {"LIKE p50 ms":>12} {"LIKE p99 ms":>12}'
+          f' {"results":>8}')
+    loaded = 0
+    for size in map(int, args.sizes.split(',')):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed.bulk_load({'articles': articles(size - loaded)})
+        loaded = size
+        print(f'[*] {size} articles loaded and indexed in {time.perf_counter() - start:.1f}s, '
+              f'{size * 1.1 / len(authors):.0f} per author')
+        conn = get_db()
+        for label, make_query in queries.items():
+            fts, naive, found = [], [], 0
+            for _ in range(args.queries):
+                text, author = make_query(), rng.choice(authors)
+                start = time.perf_counter()
+                found += len(search.search_articles(text, author, conn=conn))
+                fts.append(time.perf_counter() - start)
+                # The naive version can only look for the words as one substring.
+                start = time.perf_counter()
+                conn.execute(NAIVE_SEARCH_SQL, {'user': author, 'pattern': f'%{text}%',
+                                                'limit': search.SEARCH_PAGE_SIZE}).fetchall()
+                naive.append(time.perf_counter() - start)
+            f, n = percentiles(fts), percentiles(naive)
+            print(f'  {size:>9}  {label:<12} {f[50]:11.2f} {f[99]:11.2f} {n[50]:12.2f} {n[99]:12.2f}'
+                  f' {found / args.queries:8.1f}')
+        models.release_db()
+
+
+async def _keepalive_client(port, requests, deadline, latencies, errors):
+    """One keep-alive HTTP/1.1 connection sending ``requests`` in turn until
+    ``deadline``, reconnecting after an error or a Connection: close."""
+    reader = writer = None
+    for request in itertools.cycle(requests):
+        if time.perf_counter() >= deadline:
+            break
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            headers = head.lower()
+            length = int(headers.split(b'content-length:')[1].split(b'\r\n')[0])
+            await reader.readexactly(length)
+            if head.split(b' ', 2)[1] != b'200':
+                raise RuntimeError(head.split(b'\r\n')[0])
+            latencies.append(time.perf_counter() - start)
+            if b'connection: close' in headers:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, IndexError, RuntimeError):
+            errors.append(1)
+            if writer is not None:
+                writer.close()
+                writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def _keepalive_load(port, cookie, paths, clients, duration):
+    requests = [f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\n\r\n'.encode() for path in paths]
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    # Each client starts at a different path so the mix stays even.
+    tasks = [asyncio.create_task(_keepalive_client(port, requests[i % len(requests):] + requests[:i % len(requests)],
+                                                   deadline, latencies, errors))
+             for i in range(clients)]
+    _, pending = await asyncio.wait(tasks, timeout=duration + 10)
+    for task in pending:
+        task.cancel()
+    return latencies, len(errors) + len(pending)
+
+
+def bench_async(args):
+    init_db()
+    migrate()
+    uid = seed_user('bench_async', role='1', articles=20)
+    with get_db() as conn:
+        article_uuid = conn.execute('SELECT uuid FROM articles WHERE author_uuid = ? LIMIT 1', (uid,)).fetchone()[0]
+    models.release_db()
+    paths = ['/home', f'/article/{article_uuid}', '/profile', f'/users/{uid}']
+    servers = {
+        'gunicorn gthread': [sys.executable, '-m', 'gunicorn', '-c', os.path.join(HERE, 'gunicorn.conf.py'),
+                             '--chdir', WORKDIR, '--pythonpath', HERE, '--workers', '1', '--log-level', 'warning',
+                             '--bind', '127.0.0.1:{port}', 'app:app'],
+        'uvicorn asgi': [sys.executable, '-m', 'uvicorn', '--app-dir', HERE, '--host', '127.0.0.1', '--port', '{port}',
+                         '--log-level', 'warning', '--no-access-log', 'asgi:app'],
+    }
+    print(f'[*] {os.cpu_count()} CPUs, one server worker each; load and server share the machine')
+    print(f'  {"server":<18} {"clients":>7} {"req/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    bodies = {}
+    for name, command in servers.items():
+        for clients in map(int, args.clients.split(',')):
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+            server = subprocess.Popen([part.format(port=port) for part in command], cwd=WORKDIR)
+            try:
+                cookie = server_login(port, 'bench_async')
+                for path in paths:
+                    conn = http.client.HTTPConnection('127.0.0.1', port)
+                    conn.request('GET', path, headers={'Cookie': cookie})
+                    resp = conn.getresponse()
+                    bodies.setdefault(path, {})[name] = (resp.status, resp.read())
+                latencies, errors = asyncio.run(_keepalive_load(port, cookie, paths, clients, args.duration))
+            finally:
+                server.terminate()
+                server.wait()
+            p = percentiles(latencies)
+            print(f'  {name:<18} {clients:>7} {len(latencies) / args.duration:10.1f} {p[50]:8.2f} {p[99]:8.2f} {errors:>7}')
+    for path, responses in bodies.items():
+        if len(set(responses.values())) > 1:
+            print(f'[!] {path} differs between servers: {({k: v[0] for k, v in responses.items()})}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    pool = sub.add_parser('pool', help='requests/sec with and without the connection pool')
+    pool.add_argument('--requests', type=int, default=2000)
+    pool.set_defaults(func=bench_pool)
+
+    pagination = sub.add_parser('pagination', help='listing latency as one user\'s history grows')
+    pagination.add_argument('--sizes', default='10,1000,10000,100000')
+    pagination.add_argument('--requests', type=int, default=300)
+    pagination.set_defaults(func=bench_pagination)
+
+    listing = sub.add_parser('listing', help='/db listing with and without the directory cache')
+    listing.add_argument('--files', type=int, default=20000)
+    listing.add_argument('--requests', type=int, default=200)
+    listing.set_defaults(func=bench_listing)
+
+    download = sub.add_parser('download', help='throughput and server CPU per GB for /db downloads')
+    download.add_argument('--size-mb', type=int, default=256)
+    download.add_argument('--requests', type=int, default=8)
+    download.set_defaults(func=bench_download)
+
+    template = sub.add_parser('template', help='ban message rendering with and without the template cache')
+    template.add_argument('--iterations', type=int, default=20000)
+    template.set_defaults(func=bench_template)
+
+    scaling = sub.add_parser('scaling', help='gunicorn throughput as workers go from 1 to N')
+    scaling.add_argument('--workers', default=','.join(str(2 ** i) for i in range((os.cpu_count() or 1).bit_length())))
+    scaling.add_argument('--clients', type=int, default=32)
+    scaling.add_argument('--duration', type=float, default=10)
+    scaling.set_defaults(func=bench_scaling)
+
+    metrics = sub.add_parser('metrics', help='request overhead of the metrics middleware')
+    metrics.add_argument('--requests', type=int, default=2000)
+    metrics.add_argument('--rounds', type=int, default=5)
+    metrics.set_defaults(func=bench_metrics)
+
+    writes = sub.add_parser('writes', help='/publish throughput and latency with and without group commits')
+    writes.add_argument('--publishers', default='1,2,4,8,16,32,64')
+    writes.add_argument('--requests', type=int, default=200, help='per publisher')
+    writes.set_defaults(func=bench_writes)
+
+    search_parser = sub.add_parser('search', help='full-text search against a LIKE scan as the table grows')
+    search_parser.add_argument('--sizes', default='10000,100000,1000000')
+    search_parser.add_argument('--queries', type=int, default=20)
+    search_parser.add_argument('--authors', type=int, default=1000)
+    search_parser.set_defaults(func=bench_search)
+
+    async_parser = sub.add_parser('async', help='hot read routes under many keep-alive clients, gunicorn against uvicorn')
+    async_parser.add_argument('--clients', default='100,1000,2000')
+    async_parser.add_argument('--duration', type=float, default=10)
+    async_parser.set_defaults(func=bench_async)
+
+    metrics_run_parser = sub.add_parser('_metrics_run')
+    metrics_run_parser.add_argument('--workdir', required=True)
+    metrics_run_parser.add_argument('--requests', type=int, required=True)
+    metrics_run_parser.set_defaults(func=metrics_run)
+
+    serve_parser = sub.add_parser('_serve')
+    serve_parser.add_argument('--port', type=int, required=True)
+    serve_parser.add_argument('--workdir', required=True)
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args()
+    if args.func not in (serve, metrics_run):
+        print(f'[*] Working directory: {WORKDIR}')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Cached directory listings for the /db and /data views.
+
+A listing is built with a single ``os.scandir`` pass and cached together with
+the directory's mtime; it is reused until that mtime changes. Adding, removing
+or renaming an entry bumps the directory mtime, but rewriting a file in place
+does not, so cached sizes can lag by up to DIR_CACHE_TTL seconds.
+PUZZLE_DIR_INOTIFY=1 closes that gap on Linux by dropping a listing as soon
+as anything inside the directory changes.
+"""
+import bisect
+import ctypes
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from models import TTLCache
+
+DIR_CACHE_SIZE = 256
+DIR_CACHE_TTL = float(os.environ.get('PUZZLE_DIR_CACHE_TTL', '60'))
+DIR_INOTIFY = os.environ.get('PUZZLE_DIR_INOTIFY') == '1'
+DIR_PAGE_SIZE = 500
+MAX_DIR_PAGE_SIZE = 5000
+
+# A directory modified this recently may still change within the same mtime
+# tick, so its listing is not cached yet.
+_RACY_NS = 1_000_000_000
+
+_cache = TTLCache(DIR_CACHE_SIZE, DIR_CACHE_TTL)
+
+
+def _scan(path, files_only):
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if files_only and not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                # Vanished mid-scan, or a dangling symlink.
+                continue
+            entries.append({
+                'name': entry.name,
+                'size': st.st_size,
+                'modified': datetime.fromtimestamp(st.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            })
+    entries.sort(key=lambda e: e['name'])
+    return entries
+
+
+def list_directory(path, files_only=False):
+    """Returns the entries of ``path`` sorted by name, each a dict with
+    name, size and a formatted modification time."""
+    path = os.path.abspath(path)
+    key = (path, files_only)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    entries = _scan(path, files_only)
+    if time.time_ns() - mtime > _RACY_NS:
+        _cache.put(key, (mtime, entries))
+        if DIR_INOTIFY:
+            _watch(path)
+    return entries
+
+
+def paginate(entries, after='', limit=DIR_PAGE_SIZE):
+    """Returns the ``limit`` entries named after ``after`` and the name to
+    continue from, or None on the last page."""
+    start = bisect.bisect_right(entries, after, key=lambda e: e['name']) if after else 0
+    page = entries[start:start + limit]
+    if start + limit < len(entries):
+        return page, page[-1]['name']
+    return page, None
+
+
+def invalidate(path=None):
+    if path is None:
+        _cache.invalidate()
+        return
+    path = os.path.abspath(path)
+    _cache.invalidate((path, False))
+    _cache.invalidate((path, True))
+
+
+def cache_stats():
+    stats = _cache.stats()
+    stats['inotify'] = _watcher is not None and _watcher.pid == os.getpid()
+    return stats
+
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+               | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct('iIII')
+
+
+class _Inotify:
+    """One inotify descriptor per process, drained by a daemon thread that
+    invalidates the listing of whichever directory an event came from."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.pid = os.getpid()
+        self.paths = {}
+        self.watched = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name='dircache-inotify', daemon=True).start()
+
+    def watch(self, path):
+        with self._lock:
+            if path in self.watched:
+                return
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+            if wd < 0:
+                return
+            self.paths[wd] = path
+            self.watched.add(path)
+
+    def _run(self):
+        while True:
+            buf = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    invalidate()
+                    continue
+                with self._lock:
+                    path = self.paths.get(wd)
+                    if mask & IN_IGNORED:
+                        self.paths.pop(wd, None)
+                        self.watched.discard(path)
+                if path is not None:
+                    invalidate(path)
+
+
+_watcher = None
+_watcher_failed = False
+_watcher_lock = threading.Lock()
+
+
+def _watch(path):
+    global _watcher, _watcher_failed
+    with _watcher_lock:
+        if _watcher_failed:
+            return
+        if _watcher is None or _watcher.pid != os.getpid():
+            try:
+                _watcher = _Inotify()
+            except (OSError, AttributeError):
+                # Not Linux, or out of inotify instances: mtime + TTL only.
+                _watcher_failed = True
+                return
+    _watcher.watch(path)
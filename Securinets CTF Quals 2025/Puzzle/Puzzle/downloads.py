@@ -0,0 +1,95 @@
+"""File downloads for /db and /data.
+
+send_download() answers conditional requests (ETag / Last-Modified -> 304)
+and single byte ranges (Range / If-Range -> 206), so interrupted dumps can be
+resumed instead of re-sent. The body is handed to the server's
+``wsgi.file_wrapper`` whenever that is safe, which lets servers such as
+gunicorn push it with os.sendfile() instead of copying it through Python.
+"""
+import mimetypes
+import os
+from datetime import datetime, timezone
+from flask import request, Response
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
+
+CHUNK_SIZE = 256 * 1024
+
+
+def _etag(st):
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+
+def _if_range_matches(etag, modified):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == modified
+    return True
+
+
+def _read_range(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _body(f, start, length, size):
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    # A generic file_wrapper reads to EOF. gunicorn stops at Content-Length
+    # (and sendfile()s from the current offset), so it can take any range.
+    if file_wrapper is not None and (start + length == size
+                                     or request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn')):
+        return file_wrapper(f, CHUNK_SIZE)
+    return _read_range(f, length)
+
+
+def send_download(path):
+    f = open(path, 'rb')
+    try:
+        st = os.fstat(f.fileno())
+        etag = _etag(st)
+        modified = datetime.fromtimestamp(st.st_mtime, timezone.utc).replace(microsecond=0)
+        response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                            direct_passthrough=True)
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.accept_ranges = 'bytes'
+        response.cache_control.no_cache = True
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+            f.close()
+            response.status_code = 304
+            return response
+
+        size = st.st_size
+        start, length = 0, size
+        # Multi-range requests are answered with the whole file, which
+        # RFC 9110 allows and saves building multipart bodies.
+        ranges = request.range
+        if ranges is not None and len(ranges.ranges) == 1 and _if_range_matches(etag, modified):
+            span = ranges.range_for_length(size)
+            if span is None:
+                f.close()
+                response.status_code = 416
+                response.content_range = ContentRange('bytes', None, None, size)
+                return response
+            start, stop = span
+            length = stop - start
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, size)
+
+        response.response = _body(f, start, length, size)
+        response.content_length = length
+        return response
+    except BaseException:
+        f.close()
+        raise
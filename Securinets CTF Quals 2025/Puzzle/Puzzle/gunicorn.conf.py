@@ -0,0 +1,26 @@
+# Production serving profile: gunicorn -c gunicorn.conf.py app:app
+#
+# Pre-fork workers, each running a small thread pool. SQLite is shared
+# safely because the database runs in WAL mode with a busy timeout, and
+# models.get_db() never hands a connection across a fork.
+import os
+
+bind = os.environ.get('PUZZLE_BIND', '0.0.0.0:5000')
+worker_class = 'gthread'
+workers = int(os.environ.get('PUZZLE_WORKERS', os.cpu_count() or 1))
+threads = int(os.environ.get('PUZZLE_THREADS', '4'))
+keepalive = 5
+timeout = 30
+# models.py creates db/ and data/ relative to the working directory.
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def on_starting(server):
+    # Runs once in the master before any worker is forked, so the schema is
+    # created and migrated exactly once however many workers start. The
+    # master's connection is closed rather than pooled, so no worker
+    # inherits it.
+    from app import prepare_database
+    from models import close_db
+    prepare_database()
+    close_db()
@@ -0,0 +1,243 @@
+"""Request latency and SQL instrumentation.
+
+Every request is timed per endpoint (the URL rule, so /article/<uuid> is one
+series however many articles exist), together with how many SQL statements
+it ran, how long they took and how long Jinja spent rendering. The totals
+are served in Prometheus text format by /metrics (localhost only).
+
+SQL is timed by the connection class models.py opens its connections with:
+execute*() and fetch*() are measured, plain iteration over a cursor is not.
+Statements slower than PUZZLE_SLOW_QUERY_MS are logged to ``puzzle.sql``.
+
+Each gunicorn worker keeps its own numbers, so /metrics shows the worker
+that answered. PUZZLE_METRICS=0 turns all of it off.
+"""
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from flask import request, before_render_template, template_rendered
+
+METRICS_ENABLED = os.environ.get('PUZZLE_METRICS', '1') != '0'
+SLOW_QUERY_SECONDS = float(os.environ.get('PUZZLE_SLOW_QUERY_MS', '100')) / 1000
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+slow_query_log = logging.getLogger('puzzle.sql')
+
+_local = threading.local()
+_lock = threading.Lock()
+_requests = {}
+_histograms = {}
+_slow_queries = 0
+_collectors = []
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_FAMILIES = (
+    ('puzzle_http_request_duration_seconds', 'Request latency.', LATENCY_BUCKETS),
+    ('puzzle_http_request_sql_statements', 'SQL statements run per request.', STATEMENT_BUCKETS),
+    ('puzzle_http_request_sql_seconds', 'Time spent in SQL per request.', LATENCY_BUCKETS),
+    ('puzzle_http_request_render_seconds', 'Time spent rendering templates per request.', LATENCY_BUCKETS),
+)
+
+
+def _record_sql(sql, elapsed, statements=1):
+    global _slow_queries
+    state = getattr(_local, 'request', None)
+    if state is not None:
+        state[0] += statements
+        state[1] += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS and statements:
+        with _lock:
+            _slow_queries += 1
+        slow_query_log.warning('slow query (%.1f ms) on %s: %s', elapsed * 1000,
+                               state[3] if state is not None else '-', ' '.join(sql.split()))
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_sql(sql_script, time.perf_counter() - start)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            # Stepping through the result is SQL time, not another statement.
+            _record_sql('', time.perf_counter() - start, statements=0)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3.Connection whose cursors report to the current request.
+    Connection.execute() and friends bypass cursor() in C, so they are
+    routed through it here."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def _start_request():
+    # [sql statements, sql seconds, render seconds, endpoint, status, started, render started]
+    rule = request.url_rule
+    _local.request = [0, 0.0, 0.0, rule.rule if rule is not None else 'unmatched',
+                      500, time.perf_counter(), None]
+
+
+def _set_status(response):
+    state = getattr(_local, 'request', None)
+    if state is not None:
+        state[4] = response.status_code
+    return response
+
+
+def _finish_request(exc=None):
+    state = _local.__dict__.pop('request', None)
+    if state is None:
+        return
+    statements, sql_seconds, render_seconds, endpoint, status = state[:5]
+    observe_request(endpoint, request.method, status, time.perf_counter() - state[5],
+                    statements, sql_seconds, render_seconds)
+
+
+def observe_request(endpoint, method, status, elapsed, statements=0, sql_seconds=0.0, render_seconds=0.0):
+    """Records one finished request; the Flask hooks call this, and so can
+    anything that serves requests outside of Flask."""
+    key = (endpoint, method)
+    with _lock:
+        status_key = key + (status,)
+        _requests[status_key] = _requests.get(status_key, 0) + 1
+        histograms = _histograms.get(key)
+        if histograms is None:
+            histograms = _histograms[key] = [_Histogram(buckets) for _, _, buckets in _FAMILIES]
+        for histogram, value in zip(histograms, (elapsed, statements, sql_seconds, render_seconds)):
+            histogram.observe(value)
+
+
+def _render_started(sender, template, context, **extra):
+    state = getattr(_local, 'request', None)
+    if state is not None:
+        state[6] = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    state = getattr(_local, 'request', None)
+    if state is not None and state[6] is not None:
+        state[2] += time.perf_counter() - state[6]
+        state[6] = None
+
+
+def init_metrics(app):
+    """Registers the request hooks. Call before any other before_request
+    handler so that their time is counted too."""
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_set_status)
+    app.teardown_request(_finish_request)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+
+def register_collector(fn):
+    """Adds ``fn() -> [(name, type, help, value)]`` to /metrics, for
+    gauges and counters that live in other modules."""
+    _collectors.append(fn)
+    return fn
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Returns every metric in Prometheus text exposition format."""
+    with _lock:
+        requests = dict(_requests)
+        histograms = {key: [(h.counts[:], h.sum, h.count) for h in value] for key, value in _histograms.items()}
+        slow_queries = _slow_queries
+
+    lines = ['# HELP puzzle_http_requests_total Requests served.',
+             '# TYPE puzzle_http_requests_total counter']
+    for (endpoint, method, status), count in sorted(requests.items()):
+        lines.append(f'puzzle_http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {count}')
+
+    for i, (name, help_text, buckets) in enumerate(_FAMILIES):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (endpoint, method), series in sorted(histograms.items()):
+            counts, total, count = series[i]
+            labels = _labels(endpoint=endpoint, method=method)
+            cumulative = 0
+            for bound, bucket in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {_format(total)}')
+            lines.append(f'{name}_count{{{labels}}} {count}')
+
+    lines += ['# HELP puzzle_sql_slow_queries_total Statements slower than PUZZLE_SLOW_QUERY_MS.',
+              '# TYPE puzzle_sql_slow_queries_total counter',
+              f'puzzle_sql_slow_queries_total {slow_queries}']
+    for collector in _collectors:
+        for name, kind, help_text, value in collector():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {_format(value)}']
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,296 @@
+"""Versioned schema migrations for the Puzzle database.
+
+The applied version lives in ``PRAGMA user_version``. Each migration runs in
+its own ``BEGIN IMMEDIATE`` transaction, so concurrent workers starting up at
+the same time apply it exactly once.
+
+    python migrations.py           apply pending migrations
+    python migrations.py --check   fail if a hot query falls back to a SCAN
+"""
+import os
+import re
+import sys
+from models import (DB_FILE, get_db, init_db, HOME_ARTICLES_SQL, ARTICLE_COUNT_SQL,
+                    INCOMING_COLLABS_SQL, OUTGOING_COLLABS_SQL, SENT_COLLABS_SQL,
+                    FIRST_PAGE, PAGE_SIZE)
+import search
+
+MIGRATIONS = [
+    (1, 'article and collaboration lookup indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_articles_author ON articles (author_uuid, created_at, uuid)',
+        'CREATE INDEX IF NOT EXISTS idx_articles_collaborator ON articles (collaborator_uuid, created_at, uuid)',
+        'CREATE INDEX IF NOT EXISTS idx_articles_created ON articles (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_collab_to ON collab_requests (to_uuid, status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_collab_from ON collab_requests (from_uuid, status, created_at)',
+    ]),
+    (2, 'trigger-maintained dashboard counters', [
+        'CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)',
+        '''CREATE TABLE IF NOT EXISTS stats_article_people (
+            kind TEXT NOT NULL,
+            uuid TEXT NOT NULL,
+            articles INTEGER NOT NULL,
+            PRIMARY KEY (kind, uuid)
+        ) WITHOUT ROWID''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users BEGIN
+            INSERT INTO stats (name, value) VALUES ('users_total', 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            INSERT INTO stats (name, value) VALUES ('users_role_' || coalesce(NEW.role, ''), 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users BEGIN
+            INSERT INTO stats (name, value) VALUES ('users_total', -1) ON CONFLICT(name) DO UPDATE SET value = value + -1;
+            INSERT INTO stats (name, value) VALUES ('users_role_' || coalesce(OLD.role, ''), -1) ON CONFLICT(name) DO UPDATE SET value = value + -1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_users_role AFTER UPDATE OF role ON users
+            WHEN OLD.role IS NOT NEW.role BEGIN
+            INSERT INTO stats (name, value) VALUES ('users_role_' || coalesce(OLD.role, ''), -1) ON CONFLICT(name) DO UPDATE SET value = value + -1;
+            INSERT INTO stats (name, value) VALUES ('users_role_' || coalesce(NEW.role, ''), 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_articles_insert AFTER INSERT ON articles BEGIN
+            INSERT INTO stats (name, value) VALUES ('articles_total', 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            INSERT INTO stats_article_people (kind, uuid, articles)
+                SELECT 'author', NEW.author_uuid, 1 WHERE NEW.author_uuid IS NOT NULL
+                ON CONFLICT(kind, uuid) DO UPDATE SET articles = articles + 1;
+            UPDATE stats SET value = value + 1 WHERE name = 'unique_authors'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'author' AND uuid = NEW.author_uuid) = 1;
+            INSERT INTO stats_article_people (kind, uuid, articles)
+                SELECT 'collaborator', NEW.collaborator_uuid, 1 WHERE NEW.collaborator_uuid IS NOT NULL
+                ON CONFLICT(kind, uuid) DO UPDATE SET articles = articles + 1;
+            UPDATE stats SET value = value + 1 WHERE name = 'unique_collaborators'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'collaborator' AND uuid = NEW.collaborator_uuid) = 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_articles_delete AFTER DELETE ON articles BEGIN
+            INSERT INTO stats (name, value) VALUES ('articles_total', -1) ON CONFLICT(name) DO UPDATE SET value = value + -1;
+            UPDATE stats_article_people SET articles = articles - 1
+                    WHERE kind = 'author' AND uuid = OLD.author_uuid;
+            UPDATE stats SET value = value - 1 WHERE name = 'unique_authors'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'author' AND uuid = OLD.author_uuid) = 0;
+            DELETE FROM stats_article_people
+                    WHERE kind = 'author' AND uuid = OLD.author_uuid AND articles = 0;
+            UPDATE stats_article_people SET articles = articles - 1
+                    WHERE kind = 'collaborator' AND uuid = OLD.collaborator_uuid;
+            UPDATE stats SET value = value - 1 WHERE name = 'unique_collaborators'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'collaborator' AND uuid = OLD.collaborator_uuid) = 0;
+            DELETE FROM stats_article_people
+                    WHERE kind = 'collaborator' AND uuid = OLD.collaborator_uuid AND articles = 0;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_articles_people AFTER UPDATE OF author_uuid, collaborator_uuid ON articles
+            WHEN OLD.author_uuid IS NOT NEW.author_uuid OR OLD.collaborator_uuid IS NOT NEW.collaborator_uuid BEGIN
+            UPDATE stats_article_people SET articles = articles - 1
+                    WHERE kind = 'author' AND uuid = OLD.author_uuid;
+            UPDATE stats SET value = value - 1 WHERE name = 'unique_authors'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'author' AND uuid = OLD.author_uuid) = 0;
+            DELETE FROM stats_article_people
+                    WHERE kind = 'author' AND uuid = OLD.author_uuid AND articles = 0;
+            UPDATE stats_article_people SET articles = articles - 1
+                    WHERE kind = 'collaborator' AND uuid = OLD.collaborator_uuid;
+            UPDATE stats SET value = value - 1 WHERE name = 'unique_collaborators'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'collaborator' AND uuid = OLD.collaborator_uuid) = 0;
+            DELETE FROM stats_article_people
+                    WHERE kind = 'collaborator' AND uuid = OLD.collaborator_uuid AND articles = 0;
+            INSERT INTO stats_article_people (kind, uuid, articles)
+                SELECT 'author', NEW.author_uuid, 1 WHERE NEW.author_uuid IS NOT NULL
+                ON CONFLICT(kind, uuid) DO UPDATE SET articles = articles + 1;
+            UPDATE stats SET value = value + 1 WHERE name = 'unique_authors'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'author' AND uuid = NEW.author_uuid) = 1;
+            INSERT INTO stats_article_people (kind, uuid, articles)
+                SELECT 'collaborator', NEW.collaborator_uuid, 1 WHERE NEW.collaborator_uuid IS NOT NULL
+                ON CONFLICT(kind, uuid) DO UPDATE SET articles = articles + 1;
+            UPDATE stats SET value = value + 1 WHERE name = 'unique_collaborators'
+                AND (SELECT articles FROM stats_article_people
+                    WHERE kind = 'collaborator' AND uuid = NEW.collaborator_uuid) = 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_collab_insert AFTER INSERT ON collab_requests BEGIN
+            INSERT INTO stats (name, value) VALUES ('collab_total', 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            INSERT INTO stats (name, value) VALUES ('collab_status_' || coalesce(NEW.status, ''), 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_collab_delete AFTER DELETE ON collab_requests BEGIN
+            INSERT INTO stats (name, value) VALUES ('collab_total', -1) ON CONFLICT(name) DO UPDATE SET value = value + -1;
+            INSERT INTO stats (name, value) VALUES ('collab_status_' || coalesce(OLD.status, ''), -1) ON CONFLICT(name) DO UPDATE SET value = value + -1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_collab_status AFTER UPDATE OF status ON collab_requests
+            WHEN OLD.status IS NOT NEW.status BEGIN
+            INSERT INTO stats (name, value) VALUES ('collab_status_' || coalesce(OLD.status, ''), -1) ON CONFLICT(name) DO UPDATE SET value = value + -1;
+            INSERT INTO stats (name, value) VALUES ('collab_status_' || coalesce(NEW.status, ''), 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END''',
+        'DELETE FROM stats',
+        'DELETE FROM stats_article_people',
+        "INSERT INTO stats SELECT 'users_total', COUNT(*) FROM users",
+        "INSERT INTO stats SELECT 'users_role_' || coalesce(role, ''), COUNT(*) FROM users GROUP BY 1",
+        "INSERT INTO stats SELECT 'articles_total', COUNT(*) FROM articles",
+        "INSERT INTO stats_article_people SELECT 'author', author_uuid, COUNT(*) FROM articles GROUP BY author_uuid",
+        '''INSERT INTO stats_article_people SELECT 'collaborator', collaborator_uuid, COUNT(*) FROM articles
+                WHERE collaborator_uuid IS NOT NULL GROUP BY collaborator_uuid''',
+        "INSERT INTO stats SELECT 'unique_authors', COUNT(*) FROM stats_article_people WHERE kind = 'author'",
+        "INSERT INTO stats SELECT 'unique_collaborators', COUNT(*) FROM stats_article_people WHERE kind = 'collaborator'",
+        "INSERT INTO stats SELECT 'collab_total', COUNT(*) FROM collab_requests",
+        "INSERT INTO stats SELECT 'collab_status_' || coalesce(status, ''), COUNT(*) FROM collab_requests GROUP BY 1",
+    ]),
+    (3, 'keyset pagination order for collaboration requests', [
+        'DROP INDEX IF EXISTS idx_collab_to',
+        'DROP INDEX IF EXISTS idx_collab_from',
+        'CREATE INDEX idx_collab_to ON collab_requests (to_uuid, status, created_at, uuid)',
+        'CREATE INDEX idx_collab_from ON collab_requests (from_uuid, status, created_at, uuid)',
+        'CREATE INDEX idx_collab_sent ON collab_requests (from_uuid, created_at, uuid)',
+    ]),
+    (4, 'full-text search over articles', [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+            title, content, content='articles', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+        )''',
+        "INSERT INTO articles_fts (articles_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+        '''CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles BEGIN
+            INSERT INTO articles_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, content) VALUES ('delete', OLD.rowid, OLD.title, OLD.content);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE OF title, content ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, content) VALUES ('delete', OLD.rowid, OLD.title, OLD.content);
+            INSERT INTO articles_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+        END''',
+        "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')",
+        "INSERT INTO articles_fts (articles_fts) VALUES ('optimize')",
+    ]),
+    (5, 'full-text search scoped to each article\'s owners', [
+        'DROP TRIGGER IF EXISTS articles_fts_insert',
+        'DROP TRIGGER IF EXISTS articles_fts_delete',
+        'DROP TRIGGER IF EXISTS articles_fts_update',
+        'DROP TABLE IF EXISTS articles_fts',
+        '''CREATE VIEW articles_search AS
+            SELECT rowid AS article_rowid, title, content,
+                   'u' || replace(author_uuid, '-', '') || coalesce(' u' || replace(collaborator_uuid, '-', ''), '') AS owners
+            FROM articles''',
+        '''CREATE VIRTUAL TABLE articles_fts USING fts5(
+            title, content, owners, content='articles_search', content_rowid='article_rowid',
+            tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        )''',
+        '''CREATE TRIGGER articles_fts_insert AFTER INSERT ON articles BEGIN
+            INSERT INTO articles_fts (rowid, title, content, owners)
+                SELECT * FROM articles_search WHERE article_rowid = NEW.rowid;
+        END''',
+        '''CREATE TRIGGER articles_fts_delete BEFORE DELETE ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, content, owners)
+                SELECT 'delete', * FROM articles_search WHERE article_rowid = OLD.rowid;
+        END''',
+        '''CREATE TRIGGER articles_fts_update_before BEFORE UPDATE OF title, content, author_uuid, collaborator_uuid ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, content, owners)
+                SELECT 'delete', * FROM articles_search WHERE article_rowid = OLD.rowid;
+        END''',
+        '''CREATE TRIGGER articles_fts_update_after AFTER UPDATE OF title, content, author_uuid, collaborator_uuid ON articles BEGIN
+            INSERT INTO articles_fts (rowid, title, content, owners)
+                SELECT * FROM articles_search WHERE article_rowid = NEW.rowid;
+        END''',
+        "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')",
+        "INSERT INTO articles_fts (articles_fts) VALUES ('optimize')",
+    ]),
+    (6, 'indexes and triggers dropped by an unfinished bulk load', [
+        'CREATE TABLE IF NOT EXISTS deferred_objects (name TEXT PRIMARY KEY, type TEXT NOT NULL, sql TEXT NOT NULL)',
+    ]),
+]
+
+_PAGE = {'user': 'x', 'created_at': FIRST_PAGE[0], 'uuid': FIRST_PAGE[1], 'limit': PAGE_SIZE}
+
+HOT_QUERIES = {
+    'home articles': (HOME_ARTICLES_SQL, _PAGE),
+    'article count': (ARTICLE_COUNT_SQL, ('x',)),
+    'incoming collabs': (INCOMING_COLLABS_SQL, _PAGE),
+    'outgoing collabs': (OUTGOING_COLLABS_SQL, _PAGE),
+    'sent collabs': (SENT_COLLABS_SQL, _PAGE),
+    'article search': (search.SEARCH_SQL, {'query': search.match_expression('x', 'x')[0]}),
+}
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn=None):
+    """Applies every pending migration and returns the versions applied.
+    Also puts back any indexes and triggers an interrupted bulk load left
+    dropped; see restore_deferred."""
+    conn = conn or get_db()
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Another worker may have won the race for the write lock.
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    restore_deferred(conn)
+    return applied
+
+
+# The start of a CREATE INDEX / CREATE TRIGGER that lacks IF NOT EXISTS.
+_CREATE = re.compile(r'^\s*CREATE\s+(?:UNIQUE\s+)?(?:INDEX|TRIGGER)\s+(?!IF\s+NOT\s+EXISTS\b)', re.IGNORECASE)
+
+
+def restore_deferred(conn=None):
+    """Recreates the indexes and triggers seed.bulk_load dropped and recorded
+    in deferred_objects, and returns their names. bulk_load does this itself
+    when it finishes or fails; migrate() does it for a load that was killed
+    first. Objects that already exist are left alone."""
+    conn = conn or get_db()
+    if not conn.execute('SELECT 1 FROM deferred_objects LIMIT 1').fetchone():
+        return []
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute('SELECT name, sql FROM deferred_objects').fetchall()
+        for _, sql in rows:
+            conn.execute(_CREATE.sub(r'\g<0>IF NOT EXISTS ', sql, count=1))
+        conn.execute('DELETE FROM deferred_objects')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [name for name, _ in rows]
+
+
+def check_query_plans(conn=None):
+    """Returns (query name, plan line) for every hot query that SCANs a table
+    or walks a whole index instead of SEARCHing one."""
+    conn = conn or get_db()
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detail = row[3]
+            # A SELECT without FROM reports "SCAN CONSTANT ROW", and an FTS
+            # MATCH "SCAN <table> VIRTUAL TABLE INDEX"; neither walks a table.
+            if (detail.startswith('SCAN ') and detail != 'SCAN CONSTANT ROW'
+                    and 'VIRTUAL TABLE INDEX' not in detail):
+                problems.append((name, detail))
+            # An index searched on a range alone, e.g. (created_at<?) with the
+            # first page's cursor, is walked from end to end as well.
+            elif detail.startswith('SEARCH ') and ' USING ' in detail and '=?' not in detail:
+                problems.append((name, detail))
+    return problems
+
+
+if __name__ == '__main__':
+    if not os.path.exists(DB_FILE):
+        init_db()
+    for version in migrate():
+        print(f'[*] Applied migration {version}')
+    print(f'[*] Schema version {schema_version(get_db())}')
+
+    if '--check' in sys.argv[1:]:
+        problems = check_query_plans()
+        for name, detail in problems:
+            print(f'[!] {name}: {detail}')
+        if problems:
+            sys.exit(1)
+        print(f'[*] All {len(HOT_QUERIES)} hot queries use an index')
@@ -1,16 +1,102 @@
 import sqlite3
 import os
+import base64
+import queue
+import threading
+import time
+from collections import OrderedDict
 from uuid import uuid4
+from metrics import METRICS_ENABLED, TimedConnection
 
 DB_FILE = 'db.sqlite'
 DB_DIR = 'db'
 DATA_DIR = 'data'
 
+# Connections are pooled per worker process and handed to one thread at a
+# time. PUZZLE_DB_POOL=0 falls back to a fresh connection per call.
+DB_POOL = os.environ.get('PUZZLE_DB_POOL', '1') != '0'
+DB_POOL_SIZE = int(os.environ.get('PUZZLE_DB_POOL_SIZE', '16'))
+DB_STATEMENT_CACHE = 256
+DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+DB_CONNECTION = TimedConnection if METRICS_ENABLED else sqlite3.Connection
+
+USER_CACHE_SIZE = int(os.environ.get('PUZZLE_USER_CACHE_SIZE', '1024'))
+USER_CACHE_TTL = float(os.environ.get('PUZZLE_USER_CACHE_TTL', '30'))
+
 os.makedirs(DB_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
+_local = threading.local()
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_pool_pid = os.getpid()
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False,
+                           cached_statements=DB_STATEMENT_CACHE, factory=DB_CONNECTION)
+    for name, value in DB_PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+def _checkout():
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        # Connections must not cross a fork; start a fresh pool in the child.
+        _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _pool_pid = os.getpid()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+def get_db():
+    """Returns the connection bound to the current thread, checking one out
+    of the pool on first use. Use it as ``with get_db() as conn:`` to get the
+    usual commit/rollback handling; the connection itself stays open."""
+    if not DB_POOL:
+        return sqlite3.connect(DB_FILE, factory=DB_CONNECTION)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _checkout()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def release_db(exc=None):
+    """Returns the current thread's connection to the pool."""
+    conn = _local.__dict__.pop('conn', None)
+    if conn is None or _local.__dict__.pop('pid', None) != os.getpid():
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+def close_db():
+    """Closes the current thread's connection and every idle one in the
+    pool, e.g. in a process about to fork, so none is inherited."""
+    conn = _local.__dict__.pop('conn', None)
+    if conn is not None and _local.__dict__.pop('pid', None) == os.getpid():
+        conn.close()
+    if _pool_pid != os.getpid():
+        return
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
 def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_db() as conn:
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS users (
                         uuid TEXT PRIMARY KEY,
@@ -21,7 +107,7 @@ def init_db():
                         role TEXT
                     )''')
         
-        c.execute('''CREATE TABLE articles (
+        c.execute('''CREATE TABLE IF NOT EXISTS articles (
                 uuid TEXT PRIMARY KEY,
                 title TEXT NOT NULL,
                 content TEXT NOT NULL,
@@ -54,8 +140,119 @@ def init_db():
 
         conn.commit()
 
+# Queries on the hot request path. migrations.check_query_plans() fails if any
+# of them stops being served by an index. Listings are keyset-paginated on
+# (created_at, uuid), newest first; see fetch_page().
+HOME_ARTICLES_SQL = """
+    SELECT
+        articles.*,
+        author.username as author_name,
+        author.uuid as author_uuid,
+        collab.username as collaborator_name,
+        collab.uuid as collaborator_uuid
+    FROM articles
+    JOIN users author ON articles.author_uuid = author.uuid
+    LEFT JOIN users collab ON articles.collaborator_uuid = collab.uuid
+    WHERE articles.author_uuid = :user
+      AND (articles.created_at, articles.uuid) < (:created_at, :uuid)
+    UNION ALL
+    SELECT
+        articles.*,
+        author.username as author_name,
+        author.uuid as author_uuid,
+        collab.username as collaborator_name,
+        collab.uuid as collaborator_uuid
+    FROM articles
+    JOIN users author ON articles.author_uuid = author.uuid
+    LEFT JOIN users collab ON articles.collaborator_uuid = collab.uuid
+    WHERE articles.collaborator_uuid = :user AND articles.author_uuid != :user
+      AND (articles.created_at, articles.uuid) < (:created_at, :uuid)
+    ORDER BY created_at DESC, uuid DESC
+    LIMIT :limit
+"""
+
+# Per-author article count kept by the stats triggers (see stats.py), so it
+# does not grow with the author's history.
+ARTICLE_COUNT_SQL = """
+    SELECT coalesce((SELECT articles FROM stats_article_people
+                     WHERE kind = 'author' AND uuid = ?), 0)
+"""
+
+INCOMING_COLLABS_SQL = """
+    SELECT cr.*, u.username as requester_name
+    FROM collab_requests cr
+    JOIN users u ON cr.from_uuid = u.uuid
+    WHERE cr.to_uuid = :user AND cr.status = 'pending'
+      AND (cr.created_at, cr.uuid) < (:created_at, :uuid)
+    ORDER BY cr.created_at DESC, cr.uuid DESC
+    LIMIT :limit
+"""
+
+OUTGOING_COLLABS_SQL = """
+    SELECT cr.*, u.username as recipient_name
+    FROM collab_requests cr
+    JOIN users u ON cr.to_uuid = u.uuid
+    WHERE cr.from_uuid = :user AND cr.status = 'pending'
+      AND (cr.created_at, cr.uuid) < (:created_at, :uuid)
+    ORDER BY cr.created_at DESC, cr.uuid DESC
+    LIMIT :limit
+"""
+
+SENT_COLLABS_SQL = """
+    SELECT * FROM collab_requests
+    WHERE from_uuid = :user AND (created_at, uuid) < (:created_at, :uuid)
+    ORDER BY created_at DESC, uuid DESC
+    LIMIT :limit
+"""
+
+ARTICLE_SQL = """
+    SELECT 
+        articles.*,
+        author.username as author_name,
+        author.uuid as author_uuid,
+        collab.username as collaborator_name,
+        collab.uuid as collaborator_uuid
+    FROM articles 
+    JOIN users author ON articles.author_uuid = author.uuid 
+    LEFT JOIN users collab ON articles.collaborator_uuid = collab.uuid
+    WHERE articles.uuid = ?
+"""
+
+USER_COLUMNS = ('uuid', 'username', 'email', 'phone_number', 'password', 'role')
+USER_BY_UUID_SQL = f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE uuid=?"
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Sorts after every real (created_at, uuid) pair.
+FIRST_PAGE = ('9999-12-31 23:59:59', '')
+
+def encode_cursor(created_at, uuid_):
+    raw = f"{created_at}|{uuid_}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Returns the (created_at, uuid) key to continue after, FIRST_PAGE for an
+    empty token, or None if the token is malformed."""
+    if not token:
+        return FIRST_PAGE
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, uuid_ = raw.split('|', 1)
+    except ValueError:
+        return None
+    return created_at, uuid_
+
+def fetch_page(c, sql, user_uuid, after, limit):
+    """Runs a keyset query on cursor ``c``; returns (rows, next cursor token).
+    One extra row is fetched to tell whether another page exists."""
+    c.execute(sql, {'user': user_uuid, 'created_at': after[0], 'uuid': after[1], 'limit': limit + 1})
+    rows = c.fetchall()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1]['created_at'], rows[limit - 1]['uuid'])
+    return rows, None
+
 def get_user_by_username(username):
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_db() as conn:
         c = conn.cursor()
         c.execute("SELECT uuid, username, email, phone_number, password, role FROM users WHERE username=?", (username,))
         row = c.fetchone()
@@ -71,17 +268,72 @@ def get_user_by_username(username):
         return None
 
 def get_user_by_uuid(uuid_):
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_db() as conn:
         c = conn.cursor()
-        c.execute("SELECT uuid, username, email, phone_number, password, role FROM users WHERE uuid=?", (uuid_,))
+        c.execute(USER_BY_UUID_SQL, (uuid_,))
         row = c.fetchone()
         if row:
-            return {
-                'uuid': row[0],
-                'username': row[1],
-                'email': row[2],
-                'phone_number': row[3],
-                'password': row[4],
-                'role': row[5]
-            }
-        return None
\ No newline at end of file
+            return dict(zip(USER_COLUMNS, row))
+        return None
+
+class TTLCache:
+    """Thread-safe LRU of at most ``maxsize`` entries, each expiring ``ttl``
+    seconds after it was stored. ``None`` means "not cached"."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+# Per process: invalidate_user() only reaches this worker, so other workers
+# may serve a stale user for up to USER_CACHE_TTL seconds.
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def get_cached_user(uuid_):
+    user = user_cache.get(uuid_)
+    if user is None:
+        user = get_user_by_uuid(uuid_)
+        if user is not None:
+            user_cache.put(uuid_, user)
+    return user
+
+def invalidate_user(uuid_=None):
+    """Must be called after any UPDATE or DELETE of a user row; None drops
+    every entry. Inserts need no call, since only users that were found get
+    cached. No route updates or deletes users today: roles are fixed at
+    registration and /admin/ban_user only renders a message. seed.bulk_load
+    drops every entry after a load."""
+    user_cache.invalidate(uuid_)
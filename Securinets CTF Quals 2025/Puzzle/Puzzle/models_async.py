@@ -0,0 +1,112 @@
+"""asyncio versions of the models.py read helpers, for asgi.py.
+
+Connections come from aiosqlite, which gives every connection its own thread
+and hands results back to the event loop, so a query never blocks it. They
+are pooled per event loop, at most DB_POOL_SIZE at a time, with the same
+pragmas and statement cache as the threaded pool. The user cache is the one
+models.py uses, shared with the Flask routes running in the same process.
+"""
+import asyncio
+import contextvars
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+import aiosqlite
+from models import (DB_FILE, DB_PRAGMAS, DB_POOL_SIZE, DB_STATEMENT_CACHE, DB_CONNECTION,
+                    USER_COLUMNS, USER_BY_UUID_SQL, encode_cursor, user_cache)
+
+# [statements, seconds] for the request being served, set by asgi.py.
+sql_stats = contextvars.ContextVar('sql_stats', default=None)
+
+
+class _Pool:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.idle = []
+        self.slots = asyncio.Semaphore(DB_POOL_SIZE)
+
+
+_pool = None
+
+
+async def _connect():
+    conn = await aiosqlite.connect(DB_FILE, cached_statements=DB_STATEMENT_CACHE, factory=DB_CONNECTION)
+    conn.row_factory = sqlite3.Row
+    for name, value in DB_PRAGMAS:
+        await conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+
+@asynccontextmanager
+async def get_db():
+    """``async with get_db() as conn:`` checks a connection out of the
+    pool, waiting for one to free up once DB_POOL_SIZE are in use."""
+    global _pool
+    if _pool is None or _pool.loop is not asyncio.get_running_loop():
+        old, _pool = _pool, _Pool()
+        if old is not None:
+            # Each aiosqlite connection keeps a non-daemon thread alive
+            # until it is closed, so a dropped pool must close its own.
+            await _close_idle(old)
+    pool = _pool
+    async with pool.slots:
+        conn = pool.idle.pop() if pool.idle else await _connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            if pool is _pool:
+                pool.idle.append(conn)
+            else:
+                await conn.close()
+
+
+async def _close_idle(pool):
+    while pool.idle:
+        await pool.idle.pop().close()
+
+
+async def close_db():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await _close_idle(pool)
+
+
+async def fetchall(conn, sql, params=()):
+    start = time.perf_counter()
+    async with conn.execute(sql, params) as c:
+        rows = await c.fetchall()
+    stats = sql_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+    return rows
+
+
+async def fetchone(conn, sql, params=()):
+    rows = await fetchall(conn, sql, params)
+    return rows[0] if rows else None
+
+
+async def fetch_page(conn, sql, user_uuid, after, limit):
+    rows = await fetchall(conn, sql, {'user': user_uuid, 'created_at': after[0], 'uuid': after[1], 'limit': limit + 1})
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1]['created_at'], rows[limit - 1]['uuid'])
+    return rows, None
+
+
+async def get_user_by_uuid(uuid_):
+    async with get_db() as conn:
+        row = await fetchone(conn, USER_BY_UUID_SQL, (uuid_,))
+    return dict(zip(USER_COLUMNS, row)) if row else None
+
+
+async def get_cached_user(uuid_):
+    user = user_cache.get(uuid_)
+    if user is None:
+        user = await get_user_by_uuid(uuid_)
+        if user is not None:
+            user_cache.put(uuid_, user)
+    return user
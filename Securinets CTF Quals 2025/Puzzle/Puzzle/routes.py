@@ -1,12 +1,21 @@
-from flask import request, jsonify, render_template, redirect, send_from_directory, session, render_template_string, send_file, abort
+from flask import request, jsonify, render_template, redirect, send_from_directory, session, abort, Response, stream_with_context
 import sqlite3
+import json
 import os
 import ipaddress
 from uuid import uuid4
-from pathlib import Path
-from datetime import datetime
-from models import DB_FILE, DB_DIR, DATA_DIR, get_user_by_username, get_user_by_uuid
-from auth import admin_required
+from models import (DB_DIR, DATA_DIR, get_db, get_user_by_username,
+                    HOME_ARTICLES_SQL, ARTICLE_COUNT_SQL, INCOMING_COLLABS_SQL,
+                    OUTGOING_COLLABS_SQL, SENT_COLLABS_SQL, ARTICLE_SQL, PAGE_SIZE, MAX_PAGE_SIZE,
+                    decode_cursor, fetch_page)
+from auth import admin_required, current_user, user_cache_stats
+from downloads import send_download
+from dircache import list_directory, paginate, cache_stats as dir_cache_stats, DIR_PAGE_SIZE, MAX_DIR_PAGE_SIZE
+from stats import dashboard_stats
+from templating import render_cached_string, cache_stats as template_cache_stats
+from metrics import render_metrics
+from writer import submit_write, WriteQueueFull, WriteTimeout, WriterUnavailable
+from search import search_articles, SEARCH_PAGE_SIZE
 
 def is_localhost():
     client_ip = request.remote_addr
@@ -16,6 +25,41 @@ def is_localhost():
     except ValueError:
         return False
 
+def page_args(param='before', args=None):
+    """Reads a keyset cursor and ?limit= from the query string, or aborts 400."""
+    args = request.args if args is None else args
+    after = decode_cursor(args.get(param))
+    try:
+        limit = int(args.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if after is None or not 0 < limit <= MAX_PAGE_SIZE:
+        abort(400)
+    return after, limit
+
+def dir_page_args():
+    after = request.args.get('after', '')
+    try:
+        limit = int(request.args.get('limit', DIR_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_DIR_PAGE_SIZE:
+        abort(400)
+    return after, limit
+
+def render_listing(path, entries, is_public):
+    files, next_after = paginate(entries, *dir_page_args())
+    return render_template('directory.html',
+                         path=path,
+                         files=files,
+                         next_after=next_after,
+                         is_public=is_public)
+
+def write_busy():
+    return jsonify({'error': 'Server busy, try again shortly'}), 503, {'Retry-After': '1'}
+
+STREAM_BATCH = 500
+
 def create_main_routes(app):
     @app.route('/static/<path:path>')
     def send_static(path):
@@ -32,7 +76,7 @@ def create_main_routes(app):
         if not session.get('uuid'):
             return redirect('/login')
         
-        user = get_user_by_uuid(session['uuid'])
+        user = current_user()
         if not user:
             return redirect('/login')
         
@@ -42,30 +86,19 @@ def create_main_routes(app):
             session.pop('first_login', None)
             session.pop('first_login_password', None)
         
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_db() as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             
-            c.execute("""
-                SELECT 
-                    articles.*,
-                    author.username as author_name,
-                    author.uuid as author_uuid,
-                    collab.username as collaborator_name,
-                    collab.uuid as collaborator_uuid
-                FROM articles 
-                JOIN users author ON articles.author_uuid = author.uuid 
-                LEFT JOIN users collab ON articles.collaborator_uuid = collab.uuid
-                WHERE articles.author_uuid = ? OR articles.collaborator_uuid = ?
-                ORDER BY articles.created_at DESC
-            """, (session['uuid'], session['uuid']))
-            
-            articles = [dict(row) for row in c.fetchall()]
+            after, limit = page_args()
+            rows, next_cursor = fetch_page(c, HOME_ARTICLES_SQL, session['uuid'], after, limit)
+            articles = [dict(row) for row in rows]
             
-            c.execute("SELECT COUNT(*) FROM articles WHERE author_uuid = ?", (session['uuid'],))
+            c.execute(ARTICLE_COUNT_SQL, (session['uuid'],))
             article_count = c.fetchone()[0]
             
-        return render_template('home.html', articles=articles, article_count=article_count, first_login_password=first_login_password)
+        return render_template('home.html', articles=articles, article_count=article_count, first_login_password=first_login_password,
+                               next_cursor=next_cursor)
 
     @app.route('/profile')
     def profile():
@@ -73,7 +106,7 @@ def create_main_routes(app):
         if not uuid_:
             return redirect('/login')
 
-        user = get_user_by_uuid(uuid_)
+        user = current_user()
         if not user:
             return redirect('/login')
 
@@ -84,7 +117,7 @@ def create_main_routes(app):
         if not session.get('uuid'):
             return redirect('/login')
     
-        user = get_user_by_uuid(session['uuid'])
+        user = current_user()
         if not user:
             return redirect('/login')
         
@@ -99,36 +132,42 @@ def create_main_routes(app):
             if not title or not content:
                 return jsonify({'error': 'Title and content are required'}), 400
             
+            author_uuid = session['uuid']
+
+            def write(conn):
+                c = conn.cursor()
+                c.execute(ARTICLE_COUNT_SQL, (author_uuid,))
+                article_count = c.fetchone()[0]
+
+                if (article_count >= 20):
+                    return {'error': 'You have reached the maximum limit of 20 articles'}, 403
+
+                if collaborator:
+                    c.execute("SELECT uuid FROM users WHERE username = ?", (collaborator,))
+                    collab_user = c.fetchone()
+                    if not collab_user:
+                        return {'error': 'Collaborator not found'}, 404
+
+                    request_uuid = str(uuid4())
+                    article_uuid = str(uuid4())
+                    c.execute("""
+                        INSERT INTO collab_requests (uuid, article_uuid, title, content, from_uuid, to_uuid)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (request_uuid, article_uuid, title, content, author_uuid, collab_user[0]))
+                    return {'message': 'Collaboration request sent'}, 200
+                else:
+                    article_uuid = str(uuid4())
+                    c.execute("""
+                        INSERT INTO articles (uuid, title, content, author_uuid)
+                        VALUES (?, ?, ?, ?)
+                    """, (article_uuid, title, content, author_uuid))
+                    return {'message': 'Article published successfully'}, 200
+
             try:
-                with sqlite3.connect(DB_FILE) as conn:
-                    c = conn.cursor()
-                    c.execute("SELECT COUNT(*) FROM articles WHERE author_uuid = ?", (session['uuid'],))
-                    article_count = c.fetchone()[0]
-                    
-                    if (article_count >= 20):
-                        return jsonify({'error': 'You have reached the maximum limit of 20 articles'}), 403
-                    
-                    if collaborator:
-                        collab_user = get_user_by_username(collaborator)
-                        if not collab_user:
-                            return jsonify({'error': 'Collaborator not found'}), 404
-                        
-                        request_uuid = str(uuid4())
-                        article_uuid = str(uuid4())
-                        c.execute("""
-                            INSERT INTO collab_requests (uuid, article_uuid, title, content, from_uuid, to_uuid)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (request_uuid, article_uuid, title, content, session['uuid'], collab_user['uuid']))
-                        conn.commit()
-                        return jsonify({'message': 'Collaboration request sent'})
-                    else:
-                        article_uuid = str(uuid4())
-                        c.execute("""
-                            INSERT INTO articles (uuid, title, content, author_uuid)
-                            VALUES (?, ?, ?, ?)
-                        """, (article_uuid, title, content, session['uuid']))
-                        conn.commit()
-                        return jsonify({'message': 'Article published successfully'})
+                body, status = submit_write(write)
+                return jsonify(body), status
+            except (WriteQueueFull, WriteTimeout, WriterUnavailable):
+                return write_busy()
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
         
@@ -139,21 +178,10 @@ def create_main_routes(app):
         if not session.get('uuid'):
             return redirect('/login')
         
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_db() as conn:
             c = conn.cursor()
-            c.execute("""
-                SELECT 
-                    articles.*,
-                    author.username as author_name,
-                    author.uuid as author_uuid,
-                    collab.username as collaborator_name,
-                    collab.uuid as collaborator_uuid
-                FROM articles 
-                JOIN users author ON articles.author_uuid = author.uuid 
-                LEFT JOIN users collab ON articles.collaborator_uuid = collab.uuid
-                WHERE articles.uuid = ?
-            """, (article_uuid,))
+            c.row_factory = sqlite3.Row
+            c.execute(ARTICLE_SQL, (article_uuid,))
             article = c.fetchone()
             
         if not article:
@@ -161,6 +189,22 @@ def create_main_routes(app):
             
         return render_template('article.html', article=dict(article))
 
+    @app.route('/search')
+    def search():
+        if not session.get('uuid'):
+            return redirect('/login')
+
+        query = request.args.get('q', '').strip()
+        try:
+            limit = int(request.args.get('limit', SEARCH_PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            abort(400)
+
+        results = search_articles(query, session['uuid'], limit) if query else []
+        return render_template('search.html', query=query, results=results)
+
     @app.route('/collab/request', methods=['POST'])
     def send_collab():
         if not is_localhost():
@@ -170,7 +214,7 @@ def create_main_routes(app):
         if not current_uuid:
             return 'Unauthorized', 401
 
-        user = get_user_by_uuid(session['uuid'])
+        user = current_user()
         if not user:
             return redirect('/login')
         if user['role'] == '0':
@@ -181,11 +225,15 @@ def create_main_routes(app):
         if not target_user:
             return 'User not found', 404
 
-        with sqlite3.connect(DB_FILE) as conn:
+        def write(conn):
             c = conn.cursor()
             query = f"INSERT INTO collab_requests VALUES ('{current_uuid}', '{target_user['uuid']}')"
             c.execute(query)
-            conn.commit()
+
+        try:
+            submit_write(write)
+        except (WriteQueueFull, WriteTimeout, WriterUnavailable):
+            return write_busy()
 
         return jsonify({
             'message': 'Request sent',
@@ -201,85 +249,100 @@ def create_main_routes(app):
         if not current_uuid:
             return 'Unauthorized', 401
         
-        user = get_user_by_uuid(session['uuid'])
+        user = current_user()
         if not user:
             return redirect('/login')
         if user['role'] == '0':
             return jsonify({'error': 'Admins cannot collaborate'}), 403
 
-        with sqlite3.connect(DB_FILE) as conn:
+        after, limit = page_args()
+        if request.args.get('stream'):
+            # The paged response's keys, produced row by row straight from
+            # the cursor. limit is ignored: every row after the cursor is
+            # sent, so next_cursor is always null.
+            def generate():
+                c = get_db().cursor()
+                c.execute(SENT_COLLABS_SQL, {'user': current_uuid, 'created_at': after[0],
+                                             'uuid': after[1], 'limit': -1})
+                yield '{"sent_requests": ['
+                sep = ''
+                while rows := c.fetchmany(STREAM_BATCH):
+                    for row in rows:
+                        yield sep + json.dumps(row)
+                        sep = ','
+                yield '], "next_cursor": null}'
+            return Response(stream_with_context(generate()), mimetype='application/json')
+
+        with get_db() as conn:
             c = conn.cursor()
-            c.execute("SELECT * FROM collab_requests WHERE from_uuid=?", (current_uuid,))
-            sent = c.fetchall()
-        return jsonify({'sent_requests': sent})
+            c.row_factory = sqlite3.Row
+            sent, next_cursor = fetch_page(c, SENT_COLLABS_SQL, current_uuid, after, limit)
+        return jsonify({'sent_requests': [tuple(row) for row in sent], 'next_cursor': next_cursor})
 
     @app.route('/collaborations')
     def view_collaborations():
         if not session.get('uuid'):
             return redirect('/login')
         
-        user = get_user_by_uuid(session['uuid'])
+        user = current_user()
         if not user:
             return redirect('/login')
         if user['role'] == '0':
             return jsonify({'error': 'Admins cannot collaborate'}), 403
         
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_db() as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             
-            c.execute("""
-                SELECT cr.*, u.username as requester_name 
-                FROM collab_requests cr
-                JOIN users u ON cr.from_uuid = u.uuid
-                WHERE cr.to_uuid = ? AND cr.status = 'pending'
-            """, (session['uuid'],))
-            incoming_requests = [dict(row) for row in c.fetchall()]
+            after, limit = page_args('incoming')
+            rows, incoming_next = fetch_page(c, INCOMING_COLLABS_SQL, session['uuid'], after, limit)
+            incoming_requests = [dict(row) for row in rows]
             
-            c.execute("""
-                SELECT cr.*, u.username as recipient_name 
-                FROM collab_requests cr
-                JOIN users u ON cr.to_uuid = u.uuid
-                WHERE cr.from_uuid = ? AND cr.status = 'pending'
-            """, (session['uuid'],))
-            outgoing_requests = [dict(row) for row in c.fetchall()]
+            after, limit = page_args('outgoing')
+            rows, outgoing_next = fetch_page(c, OUTGOING_COLLABS_SQL, session['uuid'], after, limit)
+            outgoing_requests = [dict(row) for row in rows]
         
         return render_template('collaborations.html', 
                              incoming_requests=incoming_requests,
-                             outgoing_requests=outgoing_requests)
+                             outgoing_requests=outgoing_requests,
+                             incoming_next=incoming_next,
+                             outgoing_next=outgoing_next)
 
     @app.route('/collab/accept/<string:request_uuid>', methods=['POST'])
     def accept_collaboration(request_uuid):
         if not session.get('uuid'):
             return jsonify({'error': 'Unauthorized'}), 401
         
-        user = get_user_by_uuid(session['uuid'])
+        user = current_user()
         if not user:
             return redirect('/login')
         if user['role'] == '0':
             return jsonify({'error': 'Admins cannot collaborate'}), 403
         
+        def write(conn):
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
+            
+            c.execute("SELECT * FROM collab_requests WHERE uuid = ?", (request_uuid,))
+            request = c.fetchone()
+            
+            if not request:
+                return {'error': 'Request not found'}, 404
+            
+            c.execute("""
+                INSERT INTO articles (uuid, title, content, author_uuid, collaborator_uuid)
+                VALUES (?, ?, ?, ?, ?)
+            """, (request['article_uuid'], request['title'], request['content'], 
+                  request['from_uuid'], request['to_uuid']))
+            
+            c.execute("UPDATE collab_requests SET status = 'accepted' WHERE uuid = ?", (request_uuid,))
+            return {'message': 'Collaboration accepted'}, 200
+
         try:
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.row_factory = sqlite3.Row
-                c = conn.cursor()
-                
-                c.execute("SELECT * FROM collab_requests WHERE uuid = ?", (request_uuid,))
-                request = c.fetchone()
-                
-                if not request:
-                    return jsonify({'error': 'Request not found'}), 404
-                
-                c.execute("""
-                    INSERT INTO articles (uuid, title, content, author_uuid, collaborator_uuid)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (request['article_uuid'], request['title'], request['content'], 
-                      request['from_uuid'], request['to_uuid']))
-                
-                c.execute("UPDATE collab_requests SET status = 'accepted' WHERE uuid = ?", (request_uuid,))
-                conn.commit()
-                
-                return jsonify({'message': 'Collaboration accepted'})
+            body, status = submit_write(write)
+            return jsonify(body), status
+        except (WriteQueueFull, WriteTimeout, WriterUnavailable):
+            return write_busy()
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -296,13 +359,13 @@ def create_main_routes(app):
         if not current_uuid:
             return jsonify({'error': 'Unauthorized'}), 401
         
-        current_user = get_user_by_uuid(current_uuid)
-        if not current_user or current_user['role'] not in ('0', '1'):
+        requester = current_user()
+        if not requester or requester['role'] not in ('0', '1'):
             return jsonify({'error': 'Invalid user role'}), 403
             
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_db() as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             c.execute("""
                 SELECT uuid, username, email, phone_number, role, password
                 FROM users 
@@ -322,41 +385,28 @@ def create_main_routes(app):
             'password': user['password']
         })
 
+    @app.route('/stats/cache')
+    def cache_stats():
+        if not is_localhost():
+            return jsonify({'error': 'Access denied.'}), 403
+        return jsonify({'users': user_cache_stats(), 'directories': dir_cache_stats(),
+                        'templates': template_cache_stats()})
+
+    @app.route('/metrics')
+    def metrics():
+        if not is_localhost():
+            return jsonify({'error': 'Access denied.'}), 403
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/admin')
     @admin_required
     def admin_panel(ban_message=None):
         try:
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.row_factory = sqlite3.Row
+            with get_db() as conn:
                 c = conn.cursor()
+                c.row_factory = sqlite3.Row
                 
-                c.execute("""
-                    SELECT 
-                        COUNT(*) as total_users,
-                        SUM(CASE WHEN role = '0' THEN 1 ELSE 0 END) as admin_count,
-                        SUM(CASE WHEN role = '1' THEN 1 ELSE 0 END) as editor_count,
-                        SUM(CASE WHEN role = '2' THEN 1 ELSE 0 END) as user_count
-                    FROM users
-                """)
-                user_stats = dict(c.fetchone())
-
-                c.execute("""
-                    SELECT 
-                        COUNT(*) as total_articles,
-                        COUNT(DISTINCT author_uuid) as unique_authors,
-                        COUNT(DISTINCT collaborator_uuid) as unique_collaborators
-                    FROM articles
-                """)
-                article_stats = dict(c.fetchone())
-                
-                c.execute("""
-                    SELECT 
-                        COUNT(*) as total_requests,
-                        SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending_requests,
-                        SUM(CASE WHEN status = 'accepted' THEN 1 ELSE 0 END) as accepted_requests
-                    FROM collab_requests
-                """)
-                collab_stats = dict(c.fetchone())
+                user_stats, article_stats, collab_stats = dashboard_stats(conn)
                 
                 c.execute("""
                     SELECT 
@@ -402,7 +452,7 @@ def create_main_routes(app):
         if not is_safe_input(username):
             return admin_panel(ban_message='Blocked input.'), 400
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with get_db() as conn:
             c = conn.cursor()
             c.execute("SELECT * FROM users WHERE username = ?", (username,))
             user = c.fetchone()
@@ -412,43 +462,19 @@ def create_main_routes(app):
         else:
             template = 'User account {} is too recent to be banned'.format(username)
 
-        ban_message = render_template_string(template)
+        ban_message = render_cached_string(template)
 
         return admin_panel(ban_message=ban_message), 200
 
     @app.route('/db')
     def list_db_files():
         """Public directory listing for /db"""
-        files = []
-        for file in Path(DB_DIR).glob('*'):
-            if file.is_file():
-                files.append({
-                    'name': file.name,
-                    'size': file.stat().st_size,
-                    'modified': datetime.fromtimestamp(file.stat().st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        return render_template('directory.html', 
-                             path='/db',
-                             files=files,
-                             is_public=True)
+        return render_listing('/db', list_directory(DB_DIR, files_only=True), is_public=True)
 
     @app.route('/data')
     @admin_required
     def list_data_files():
-        files = []
-        for file in Path(DATA_DIR).glob('*'):
-            if file.is_file():
-                files.append({
-                    'name': file.name,
-                    'size': file.stat().st_size,
-                    'modified': datetime.fromtimestamp(file.stat().st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        return render_template('directory.html', 
-                             path='/data',
-                             files=files,
-                             is_public=False)
+        return render_listing('/data', list_directory(DATA_DIR, files_only=True), is_public=False)
 
     @app.route('/data/', defaults={'req_path': ''})
     @app.route('/data/<path:req_path>')
@@ -463,22 +489,9 @@ def create_main_routes(app):
             return abort(404)
 
         if os.path.isfile(abs_path):
-            return send_file(abs_path)
-
-        files = []
-        for file in os.listdir(abs_path):
-            file_path = os.path.join(abs_path, file)
-            stats = os.stat(file_path)
-            files.append({
-                'name': file,
-                'size': stats.st_size,
-                'modified': datetime.fromtimestamp(stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-        return render_template('directory.html', 
-                             path=f'/data/{req_path}',
-                             files=files,
-                             is_public=False)
+            return send_download(abs_path)
+
+        return render_listing(f'/data/{req_path}', list_directory(abs_path), is_public=False)
     
     @app.route('/db/', defaults={'req_path': ''})
     @app.route('/db/<path:req_path>')
@@ -492,20 +505,7 @@ def create_main_routes(app):
             return abort(404)
 
         if os.path.isfile(abs_path):
-            return send_file(abs_path)
-
-        files = []
-        for file in os.listdir(abs_path):
-            file_path = os.path.join(abs_path, file)
-            stats = os.stat(file_path)
-            files.append({
-                'name': file,
-                'size': stats.st_size,
-                'modified': datetime.fromtimestamp(stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-        return render_template('directory.html', 
-                             path=f'/db/{req_path}',
-                             files=files,
-                             is_public=True)
+            return send_download(abs_path)
+
+        return render_listing(f'/db/{req_path}', list_directory(abs_path), is_public=True)
 
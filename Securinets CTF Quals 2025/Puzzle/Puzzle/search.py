@@ -0,0 +1,195 @@
+"""Full-text search over articles.
+
+``articles_fts`` is an FTS5 index over the ``articles_search`` view: each
+article's title and content, plus an ``owners`` column holding a token for
+its author and one for its collaborator. It is an external-content table:
+it stores only the index and reads the text back through the view by rowid,
+and triggers (migration 5 in migrations.py) keep it in step with every
+insert, update and delete.
+
+A user searches the articles they wrote or collaborate on, the same ones
+/home lists; nobody else's titles or snippets come back. The user's owner
+token is part of the MATCH, so FTS5 intersects the query words with that
+user's short list of articles inside the index, and a search costs time in
+proportion to the user's matching articles rather than to the corpus.
+
+Two things would still walk a word's whole list of articles on every search
+and are avoided for that reason. FTS5's bm25() counts every article holding
+each query word, so matches are ranked here instead, by BM25 term frequency
+and length normalisation with title hits weighted above content hits; every
+match holds every word, so the inverse document frequency BM25 would add
+only shifts the words' weights against each other. And a prefix query
+merges the lists of every word with that prefix: the index keeps prefixes
+of up to PREFIX_LENGTH characters, FTS5 matches the last word on that many,
+and the rest of it is checked against the highlighted hits here.
+
+articles has no INTEGER PRIMARY KEY, so a VACUUM may renumber its rowids and
+leave the index pointing at the wrong rows; rebuild after one.
+
+    python search.py USER_UUID "query"   print the best matches among a user's articles
+    python search.py --check             verify the index against the articles table
+    python search.py --rebuild           rebuild the index from scratch
+"""
+import heapq
+import html
+import re
+import sqlite3
+import sys
+import unicodedata
+from markupsafe import Markup, escape
+from models import get_db
+
+SEARCH_PAGE_SIZE = 20
+SNIPPET_TOKENS = 16
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+BM25_K1 = 1.2
+BM25_B = 0.75
+# The longest prefix the index keeps (prefix='1 2 3' in migration 5).
+PREFIX_LENGTH = 3
+
+# highlight() and snippet() bracket each hit with these; mark() turns them
+# into <mark> after the rest of the text has been escaped.
+_HIT_START, _HIT_END = '\x02', '\x03'
+_HIT = re.compile(f'{_HIT_START}(.*?){_HIT_END}', re.S)
+# Runs of letters and digits, which is what the unicode61 tokenizer keeps.
+_WORD = re.compile(r'[^\W_]+')
+
+REBUILD = [
+    "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')",
+    "INSERT INTO articles_fts (articles_fts) VALUES ('optimize')",
+]
+
+SEARCH_SQL = f"""
+    SELECT articles.uuid, articles.title, articles.created_at,
+           author.username AS author_name,
+           highlight(articles_fts, 0, char(2), char(3)) AS title_hits,
+           highlight(articles_fts, 1, char(2), char(3)) AS content_hits,
+           snippet(articles_fts, 1, char(2), char(3), '…', {SNIPPET_TOKENS}) AS snippet
+    FROM articles_fts
+    JOIN articles ON articles.rowid = articles_fts.rowid
+    JOIN users author ON author.uuid = articles.author_uuid
+    WHERE articles_fts MATCH :query
+"""
+
+
+def fold(word):
+    """``word`` as the index holds it: lower case, without diacritics."""
+    return ''.join(c for c in unicodedata.normalize('NFD', word) if not unicodedata.combining(c)).lower()
+
+
+def owner_token(user):
+    """The token articles_search.owners holds for ``user``."""
+    return 'u' + user.replace('-', '').lower()
+
+
+def match_expression(text, user):
+    """Turns free text into an FTS5 query over ``user``'s articles: every
+    word must appear, the last one as a prefix so results follow the user's
+    typing, and only on its first PREFIX_LENGTH characters. Quoting each
+    word keeps FTS5 operators and punctuation in ``text`` from being parsed.
+    Returns (query, folded words), or None when there is nothing to search
+    for."""
+    words = [fold(word) for word in _WORD.findall(text)]
+    owner = owner_token(user)
+    if not words or not _WORD.fullmatch(owner):
+        return None
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1][:PREFIX_LENGTH]}"*']
+    return f'owners:"{owner}" AND {{title content}}:({" ".join(terms)})', words
+
+
+def _wanted(hit, words):
+    hit = fold(hit)
+    return hit.startswith(words[-1]) or hit in words[:-1]
+
+
+def mark(snippet, words):
+    """Escapes ``snippet`` and wraps the hits that match ``words`` in
+    <mark>; hits on the shortened prefix alone are left plain."""
+    parts = _HIT.split(snippet)
+    marked = Markup()
+    for i, part in enumerate(parts):
+        if i % 2 and _wanted(part, words):
+            marked += Markup('<mark>') + escape(part) + Markup('</mark>')
+        else:
+            marked += escape(part)
+    return marked
+
+
+def _bm25(hits, length, average):
+    return hits * (BM25_K1 + 1) / (hits + BM25_K1 * (1 - BM25_B + BM25_B * length / average))
+
+
+def search_articles(text, user, limit=SEARCH_PAGE_SIZE, conn=None):
+    """Returns the best ``limit`` matches for ``text`` among the articles
+    ``user`` wrote or collaborates on, each a dict with uuid, title,
+    created_at, author_name and an HTML-safe snippet."""
+    match = match_expression(text, user)
+    if match is None:
+        return []
+    query, words = match
+    conn = conn or get_db()
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    matches = []
+    for row in c.execute(SEARCH_SQL, {'query': query}):
+        title_hits = [hit for hit in _HIT.findall(row['title_hits']) if _wanted(hit, words)]
+        content_hits = [hit for hit in _HIT.findall(row['content_hits']) if _wanted(hit, words)]
+        if not any(fold(hit).startswith(words[-1]) for hit in title_hits + content_hits):
+            continue
+        matches.append((row, len(title_hits), len(_WORD.findall(row['title'])),
+                        len(content_hits), len(_WORD.findall(row['content_hits']))))
+    if not matches:
+        return []
+    title_average = max(sum(m[2] for m in matches) / len(matches), 1)
+    content_average = max(sum(m[4] for m in matches) / len(matches), 1)
+
+    def score(m):
+        row, title_hits, title_length, content_hits, content_length = m
+        return (TITLE_WEIGHT * _bm25(title_hits, title_length, title_average)
+                + CONTENT_WEIGHT * _bm25(content_hits, content_length, content_average), row['created_at'])
+
+    results = []
+    for row, *_ in heapq.nlargest(limit, matches, key=score):
+        results.append({'uuid': row['uuid'], 'title': row['title'], 'created_at': row['created_at'],
+                        'author_name': row['author_name'], 'snippet': mark(row['snippet'], words)})
+    return results
+
+
+def rebuild_index(conn=None):
+    conn = conn or get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for statement in REBUILD:
+            conn.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def check_index(conn=None):
+    """Raises sqlite3.DatabaseError if the index disagrees with articles."""
+    conn = conn or get_db()
+    with conn:
+        conn.execute("INSERT INTO articles_fts (articles_fts, rank) VALUES ('integrity-check', 1)")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--rebuild' in args:
+        rebuild_index()
+        print('[*] Rebuilt the search index')
+    elif '--check' in args:
+        try:
+            check_index()
+        except sqlite3.DatabaseError as e:
+            print(f'[!] Search index is out of date ({e}); run python search.py --rebuild')
+            sys.exit(1)
+        print('[*] Search index matches the articles table')
+    elif len(args) >= 2:
+        for result in search_articles(' '.join(args[1:]), args[0]):
+            snippet = html.unescape(str(result['snippet']).replace('<mark>', '[').replace('</mark>', ']'))
+            print(f"{result['uuid']}  {result['title']}  ({result['author_name']})\n    {snippet}")
+    else:
+        print(__doc__)
@@ -0,0 +1,233 @@
+"""Bulk import and synthetic data for the Puzzle database.
+
+Rows are inserted with executemany() in large transactions. Secondary
+indexes and triggers on the loaded tables are dropped for the duration and
+rebuilt once at the end, and the dashboard counters and the search index are
+recomputed from scratch instead of being updated row by row. What was
+dropped is recorded in deferred_objects, so if the load is killed the next
+migrate() rebuilds it.
+
+    python seed.py import --users users.csv --articles articles.jsonl [--collabs collabs.csv]
+    python seed.py generate --users 1000 --articles 100000 --collabs 10000 [--out DIR | --load]
+
+Files are CSV with a header row or JSONL (one object per line), picked by
+extension. Missing uuid / created_at / role / status / password columns get
+the same defaults the app would give them.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import secrets
+import string
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
+from models import DB_FILE, get_db, init_db, invalidate_user
+from migrations import migrate, restore_deferred
+import stats
+import search
+
+COLUMNS = {
+    'users': ('uuid', 'username', 'email', 'phone_number', 'password', 'role'),
+    'articles': ('uuid', 'title', 'content', 'author_uuid', 'collaborator_uuid', 'created_at'),
+    'collab_requests': ('uuid', 'article_uuid', 'title', 'content', 'from_uuid', 'to_uuid', 'status', 'created_at'),
+}
+
+BATCH_SIZE = 100_000
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + '!@#$%^&*'
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+DEFAULTS = {
+    'uuid': lambda: str(uuid4()),
+    'created_at': _now,
+    'role': lambda: '2',
+    'status': lambda: 'pending',
+    'password': lambda: ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(12)),
+}
+
+
+def read_rows(path):
+    """Yields dicts from a .csv or .jsonl file."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def to_tuples(table, rows):
+    columns = COLUMNS[table]
+    for row in rows:
+        values = []
+        for column in columns:
+            value = row.get(column)
+            if value in (None, '') and column in DEFAULTS:
+                value = DEFAULTS[column]()
+            values.append(value if value != '' else None)
+        yield tuple(values)
+
+
+def _deferred_objects(conn, tables):
+    """(type, name, sql) of every explicit index and trigger on ``tables``."""
+    marks = ','.join('?' * len(tables))
+    return conn.execute(f"""SELECT type, name, sql FROM sqlite_master
+                            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+                            AND tbl_name IN ({marks})""", tables).fetchall()
+
+
+def bulk_load(sources, batch_size=BATCH_SIZE):
+    """Loads ``{table: iterable of dicts}`` and returns {table: rows loaded}."""
+    conn = get_db()
+    tables = [table for table in COLUMNS if table in sources]
+    loaded = {}
+    conn.execute('PRAGMA synchronous=OFF')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # Recorded in the same transaction as the drops, so if the process
+        # dies during the load the next migrate() knows what to put back.
+        deferred = _deferred_objects(conn, tables)
+        conn.executemany('INSERT OR REPLACE INTO deferred_objects (type, name, sql) VALUES (?, ?, ?)', deferred)
+        for kind, name, _ in deferred:
+            conn.execute(f'DROP {kind} {name}')
+        conn.commit()
+
+        for table in tables:
+            columns = COLUMNS[table]
+            sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            rows = to_tuples(table, sources[table])
+            loaded[table] = 0
+            start = time.perf_counter()
+            while batch := list(itertools.islice(rows, batch_size)):
+                with conn:
+                    conn.executemany(sql, batch)
+                loaded[table] += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f'[*] {table}: {loaded[table]} rows in {elapsed:.1f}s '
+                  f'({loaded[table] / max(elapsed, 1e-9):,.0f} rows/s)')
+    finally:
+        # A failed drop or batch is rolled back; only what was recorded as
+        # dropped is recreated.
+        if conn.in_transaction:
+            conn.rollback()
+        start = time.perf_counter()
+        restored = restore_deferred(conn)
+        print(f'[*] Rebuilt {len(restored)} indexes and triggers in {time.perf_counter() - start:.1f}s')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # Batches committed before a failure went in without the triggers,
+        # so the counters and search index need catching up either way.
+        stats.recompute_stats(conn)
+        if 'articles' in loaded:
+            search.rebuild_index(conn)
+        invalidate_user()
+    conn.execute('PRAGMA optimize')
+    return loaded
+
+
+def synthetic(users, articles, collabs, seed=None):
+    """Returns ``{table: generator of dicts}`` for a reproducible dataset.
+    Every user's password is their username."""
+    rng = random.Random(seed)
+
+    def new_uuid():
+        return str(UUID(int=rng.getrandbits(128), version=4))
+
+    user_uuids = [new_uuid() for _ in range(users)]
+    start = datetime(2025, 1, 1)
+    span = 365 * 24 * 3600
+
+    def timestamp():
+        return (start + timedelta(seconds=rng.randrange(span))).strftime('%Y-%m-%d %H:%M:%S')
+
+    def words(n):
+        return ' '.join(rng.choice(('forest', 'river', 'moss', 'cedar', 'fern', 'stone', 'tide', 'lichen'))
+                        for _ in range(n))
+
+    def gen_users():
+        for i, uid in enumerate(user_uuids):
+            yield {'uuid': uid, 'username': f'user{i}', 'email': f'user{i}@example.com',
+                   'phone_number': f'{rng.randrange(10 ** 8):08}', 'password': f'user{i}',
+                   'role': rng.choice('1222')}
+
+    def gen_articles():
+        for i in range(articles):
+            yield {'uuid': new_uuid(), 'title': words(4).title(), 'content': words(60),
+                   'author_uuid': rng.choice(user_uuids),
+                   'collaborator_uuid': rng.choice(user_uuids) if rng.random() < 0.1 else None,
+                   'created_at': timestamp()}
+
+    def gen_collabs():
+        for i in range(collabs):
+            yield {'uuid': new_uuid(), 'article_uuid': new_uuid(),
+                   'title': words(4).title(), 'content': words(60),
+                   'from_uuid': rng.choice(user_uuids), 'to_uuid': rng.choice(user_uuids),
+                   'status': 'accepted' if rng.random() < 0.3 else 'pending', 'created_at': timestamp()}
+
+    return {'users': gen_users(), 'articles': gen_articles(), 'collab_requests': gen_collabs()}
+
+
+def write_dataset(sources, out_dir, fmt):
+    os.makedirs(out_dir, exist_ok=True)
+    for table, rows in sources.items():
+        path = os.path.join(out_dir, f'{table}.{fmt}')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                writer = csv.DictWriter(f, fieldnames=COLUMNS[table])
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row) + '\n')
+        print(f'[*] Wrote {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    imp = sub.add_parser('import', help='bulk-load CSV/JSONL files')
+    imp.add_argument('--users')
+    imp.add_argument('--articles')
+    imp.add_argument('--collabs')
+    imp.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    gen = sub.add_parser('generate', help='generate a synthetic dataset')
+    gen.add_argument('--users', type=int, default=1000)
+    gen.add_argument('--articles', type=int, default=100_000)
+    gen.add_argument('--collabs', type=int, default=10_000)
+    gen.add_argument('--seed', type=int)
+    gen.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    gen.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    target = gen.add_mutually_exclusive_group(required=True)
+    target.add_argument('--out', help='write files to this directory')
+    target.add_argument('--load', action='store_true', help='load straight into the database')
+
+    args = parser.parse_args()
+    if args.command == 'generate' and args.out:
+        write_dataset(synthetic(args.users, args.articles, args.collabs, args.seed), args.out, args.format)
+        return
+
+    if not os.path.exists(DB_FILE):
+        init_db()
+    migrate()
+    if args.command == 'generate':
+        sources = synthetic(args.users, args.articles, args.collabs, args.seed)
+    else:
+        files = {'users': args.users, 'articles': args.articles, 'collab_requests': args.collabs}
+        sources = {table: read_rows(path) for table, path in files.items() if path}
+        if not sources:
+            parser.error('nothing to import')
+    bulk_load(sources, args.batch_size)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Admin dashboard counters.
+
+The ``stats`` table holds one row per counter. Triggers on users, articles
+and collab_requests (migration 2 in migrations.py) keep it current, so the
+dashboard reads a handful of rows instead of aggregating whole tables. ``stats_article_people`` counts
+articles per author and per collaborator; it exists so the distinct-author
+and distinct-collaborator counters can be maintained without a full scan.
+
+    python stats.py            report drift between counters and the tables
+    python stats.py --repair   recompute every counter from scratch
+"""
+import sys
+from models import get_db
+
+RECOMPUTE = [
+    'DELETE FROM stats',
+    'DELETE FROM stats_article_people',
+    "INSERT INTO stats SELECT 'users_total', COUNT(*) FROM users",
+    "INSERT INTO stats SELECT 'users_role_' || coalesce(role, ''), COUNT(*) FROM users GROUP BY 1",
+    "INSERT INTO stats SELECT 'articles_total', COUNT(*) FROM articles",
+    "INSERT INTO stats_article_people SELECT 'author', author_uuid, COUNT(*) FROM articles GROUP BY author_uuid",
+    """INSERT INTO stats_article_people SELECT 'collaborator', collaborator_uuid, COUNT(*) FROM articles
+       WHERE collaborator_uuid IS NOT NULL GROUP BY collaborator_uuid""",
+    "INSERT INTO stats SELECT 'unique_authors', COUNT(*) FROM stats_article_people WHERE kind = 'author'",
+    "INSERT INTO stats SELECT 'unique_collaborators', COUNT(*) FROM stats_article_people WHERE kind = 'collaborator'",
+    "INSERT INTO stats SELECT 'collab_total', COUNT(*) FROM collab_requests",
+    "INSERT INTO stats SELECT 'collab_status_' || coalesce(status, ''), COUNT(*) FROM collab_requests GROUP BY 1",
+]
+
+
+def read_counters(conn=None):
+    conn = conn or get_db()
+    return dict(conn.execute('SELECT name, value FROM stats'))
+
+
+def dashboard_stats(conn=None):
+    """Returns (user_stats, article_stats, collab_stats) for admin.html."""
+    counters = read_counters(conn)
+    user_stats = {
+        'total_users': counters.get('users_total', 0),
+        'admin_count': counters.get('users_role_0', 0),
+        'editor_count': counters.get('users_role_1', 0),
+        'user_count': counters.get('users_role_2', 0),
+    }
+    article_stats = {
+        'total_articles': counters.get('articles_total', 0),
+        'unique_authors': counters.get('unique_authors', 0),
+        'unique_collaborators': counters.get('unique_collaborators', 0),
+    }
+    collab_stats = {
+        'total_requests': counters.get('collab_total', 0),
+        'pending_requests': counters.get('collab_status_pending', 0),
+        'accepted_requests': counters.get('collab_status_accepted', 0),
+    }
+    return user_stats, article_stats, collab_stats
+
+
+def compute_counters(conn=None):
+    """Aggregates every counter straight from the source tables."""
+    conn = conn or get_db()
+    counters = {
+        'users_total': conn.execute('SELECT COUNT(*) FROM users').fetchone()[0],
+        'articles_total': conn.execute('SELECT COUNT(*) FROM articles').fetchone()[0],
+        'unique_authors': conn.execute('SELECT COUNT(DISTINCT author_uuid) FROM articles').fetchone()[0],
+        'unique_collaborators': conn.execute('SELECT COUNT(DISTINCT collaborator_uuid) FROM articles').fetchone()[0],
+        'collab_total': conn.execute('SELECT COUNT(*) FROM collab_requests').fetchone()[0],
+    }
+    for role, count in conn.execute('SELECT role, COUNT(*) FROM users GROUP BY role'):
+        counters[f"users_role_{role or ''}"] = count
+    for status, count in conn.execute('SELECT status, COUNT(*) FROM collab_requests GROUP BY status'):
+        counters[f"collab_status_{status or ''}"] = count
+    return counters
+
+
+def read_people(conn=None):
+    """{'articles_<kind>:<uuid>': articles} from stats_article_people, which
+    ARTICLE_COUNT_SQL reads for the /publish limit."""
+    conn = conn or get_db()
+    return {f'articles_{kind}:{uuid}': articles
+            for kind, uuid, articles in conn.execute('SELECT kind, uuid, articles FROM stats_article_people')}
+
+
+def compute_people(conn=None):
+    """read_people's counts aggregated straight from articles."""
+    conn = conn or get_db()
+    people = {f'articles_author:{uuid}': count for uuid, count in conn.execute(
+        'SELECT author_uuid, COUNT(*) FROM articles GROUP BY author_uuid')}
+    people.update((f'articles_collaborator:{uuid}', count) for uuid, count in conn.execute(
+        'SELECT collaborator_uuid, COUNT(*) FROM articles WHERE collaborator_uuid IS NOT NULL '
+        'GROUP BY collaborator_uuid'))
+    return people
+
+
+def recompute_stats(conn=None):
+    conn = conn or get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for statement in RECOMPUTE:
+            conn.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def reconcile_stats(conn=None, repair=False):
+    """Returns {counter: (stored, actual)} for every counter, and every
+    per-person article count, that drifted; recomputes all of them from
+    scratch when ``repair`` is set."""
+    conn = conn or get_db()
+    # One read transaction, so a write landing between the stored and the
+    # recomputed reads cannot show up as drift.
+    conn.execute('BEGIN')
+    try:
+        stored = read_counters(conn) | read_people(conn)
+        actual = compute_counters(conn) | compute_people(conn)
+    finally:
+        conn.commit()
+    drift = {}
+    for name in sorted(stored.keys() | actual.keys()):
+        if stored.get(name, 0) != actual.get(name, 0):
+            drift[name] = (stored.get(name, 0), actual.get(name, 0))
+    if drift and repair:
+        recompute_stats(conn)
+    return drift
+
+
+if __name__ == '__main__':
+    repair = '--repair' in sys.argv[1:]
+    drift = reconcile_stats(repair=repair)
+    for name, (stored, actual) in drift.items():
+        print(f'[!] {name}: stored {stored}, actual {actual}')
+    if not drift:
+        print('[*] All counters match')
+    elif repair:
+        print(f'[*] Recomputed counters, {len(drift)} had drifted')
+    else:
+        sys.exit(1)
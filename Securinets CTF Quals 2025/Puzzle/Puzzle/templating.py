@@ -0,0 +1,52 @@
+"""Compiled-template cache for templates built from strings at request time.
+
+render_template_string() parses and compiles its source on every call.
+render_cached_string() keeps the compiled Template in a bounded LRU keyed on
+the source and renders it through render_template(), so the context
+(request, session, g, config, context processors) and the template_rendered
+signal are exactly what render_template_string() would give.
+"""
+import threading
+import time
+from flask import current_app, render_template
+from models import TTLCache
+
+TEMPLATE_CACHE_SIZE = 256
+
+_cache = TTLCache(TEMPLATE_CACHE_SIZE, float('inf'))
+_counters = {'fast_path': 0, 'compiles': 0, 'compile_seconds': 0.0}
+_counters_lock = threading.Lock()
+
+
+def _is_plain_text(source):
+    # Without a '{' there is no {{ }}, {% %} or {# #} to process. Jinja also
+    # rewrites '\r\n' and '\r' to '\n', so leave those to the real renderer.
+    return '{' not in source and '\r' not in source
+
+
+def render_cached_string(source, **context):
+    if _is_plain_text(source):
+        with _counters_lock:
+            _counters['fast_path'] += 1
+        # Jinja drops a single trailing newline (keep_trailing_newline=False).
+        return source[:-1] if source.endswith('\n') else source
+
+    template = _cache.get(source)
+    if template is None:
+        start = time.perf_counter()
+        template = current_app.jinja_env.from_string(source)
+        elapsed = time.perf_counter() - start
+        _cache.put(source, template)
+        with _counters_lock:
+            _counters['compiles'] += 1
+            _counters['compile_seconds'] += elapsed
+    return render_template(template, **context)
+
+
+def cache_stats():
+    stats = _cache.stats()
+    with _counters_lock:
+        stats.update(_counters)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,90 @@
+"""Migrations on a fresh database, the EXPLAIN QUERY PLAN regression check
+for the hot queries, drift in the counters migration 2 maintains, and
+recovery from an interrupted bulk load. Run with ``python -m pytest``."""
+import sqlite3
+import pytest
+import models
+import seed
+import stats
+from migrations import MIGRATIONS, check_query_plans, migrate, schema_version
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    models.close_db()
+    models.init_db()
+    yield models.get_db()
+    models.close_db()
+
+
+def test_migrations_apply_once(conn):
+    assert migrate(conn) == [version for version, _, _ in MIGRATIONS]
+    assert migrate(conn) == []
+    assert schema_version(conn) == MIGRATIONS[-1][0]
+
+
+def test_hot_queries_use_an_index(conn):
+    migrate(conn)
+    assert check_query_plans(conn) == []
+
+
+def _schema_objects(conn):
+    return conn.execute("SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') "
+                        "ORDER BY name").fetchall()
+
+
+def test_failed_bulk_load_restores_dropped_objects(conn):
+    migrate(conn)
+    before = _schema_objects(conn)
+
+    def rows():
+        yield {'title': 'kept', 'content': 'x', 'author_uuid': 'a'}
+        raise RuntimeError('source went away')
+
+    with pytest.raises(RuntimeError, match='source went away'):
+        seed.bulk_load({'articles': rows()}, batch_size=1)
+    assert _schema_objects(conn) == before
+    assert conn.execute('SELECT count(*) FROM deferred_objects').fetchone()[0] == 0
+
+
+def test_failed_drop_keeps_the_original_error(conn, monkeypatch):
+    migrate(conn)
+    before = _schema_objects(conn)
+    real = seed._deferred_objects
+    # The second drop names an object that does not exist.
+    monkeypatch.setattr(seed, '_deferred_objects',
+                        lambda conn, tables: real(conn, tables)[:1] + [('index', 'idx_missing', 'CREATE INDEX x')])
+    with pytest.raises(sqlite3.OperationalError, match='idx_missing'):
+        seed.bulk_load({'articles': []})
+    assert _schema_objects(conn) == before
+
+
+def test_migrate_restores_objects_after_a_killed_bulk_load(conn):
+    migrate(conn)
+    before = _schema_objects(conn)
+    # What bulk_load commits before loading; a SIGKILL leaves it like this.
+    conn.execute('BEGIN IMMEDIATE')
+    deferred = seed._deferred_objects(conn, ['articles'])
+    conn.executemany('INSERT INTO deferred_objects (type, name, sql) VALUES (?, ?, ?)', deferred)
+    for kind, name, _ in deferred:
+        conn.execute(f'DROP {kind} {name}')
+    conn.commit()
+    assert _schema_objects(conn) != before
+
+    assert migrate(conn) == []
+    assert _schema_objects(conn) == before
+    assert conn.execute('SELECT count(*) FROM deferred_objects').fetchone()[0] == 0
+
+
+def test_reconcile_reports_per_person_drift(conn):
+    migrate(conn)
+    with conn:
+        conn.execute("INSERT INTO users (uuid, username, email, password, role) VALUES ('a', 'a', 'a@x', 'p', '2')")
+        conn.execute("INSERT INTO articles (uuid, title, content, author_uuid) VALUES ('1', 't', 'c', 'a')")
+    assert stats.reconcile_stats(conn) == {}
+
+    with conn:
+        conn.execute("UPDATE stats_article_people SET articles = 20 WHERE kind = 'author' AND uuid = 'a'")
+    assert stats.reconcile_stats(conn, repair=True) == {'articles_author:a': (20, 1)}
+    assert stats.reconcile_stats(conn) == {}
@@ -0,0 +1,40 @@
+"""The group-commit writer when it cannot open its connection. Run with
+``python -m pytest``."""
+import sqlite3
+import time
+import pytest
+import models
+import writer
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(writer, 'WRITE_BATCHING', True)
+    # A writer left over from another test would hold another database.
+    monkeypatch.setattr(writer, '_queue_pid', None)
+    models.close_db()
+    models.init_db()
+    yield
+    models.close_db()
+
+
+def test_writer_that_cannot_connect_fails_fast_and_restarts(db, monkeypatch):
+    connect = models._connect
+    attempts = []
+
+    def first_attempt_fails():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('unable to open database file')
+        return connect()
+
+    monkeypatch.setattr(models, '_connect', first_attempt_fails)
+    start = time.monotonic()
+    with pytest.raises(writer.WriterUnavailable) as failure:
+        writer.submit_write(lambda conn: None)
+    assert time.monotonic() - start < writer.WRITE_TIMEOUT / 2
+    assert isinstance(failure.value.__cause__, sqlite3.OperationalError)
+
+    assert writer.submit_write(lambda conn: conn.execute('SELECT 1').fetchone()[0]) == 1
+    assert len(attempts) == 2
@@ -0,0 +1,181 @@
+"""Group commits for request writes.
+
+Each worker process runs one writer thread with its own connection. Routes
+hand it a job -- a function that does the request's reads and writes on the
+connection it is given -- and block until the job's transaction has been
+committed. The writer takes every job that queued up while it was busy and
+runs them in a single transaction, each inside its own savepoint so one
+failing job does not take the others down, then commits once. With
+synchronous=FULL that commit is durable when submit_write() returns, and
+its cost is shared by the whole batch.
+
+The queue is bounded: once PUZZLE_WRITE_QUEUE jobs are waiting,
+submit_write() waits up to WRITE_QUEUE_TIMEOUT for room and then raises
+WriteQueueFull, which routes turn into a 503. A job still waiting for its
+commit after WRITE_TIMEOUT raises WriteTimeout, also a 503; the job stays
+queued and may yet commit. If the writer cannot open its connection it logs
+the error, fails every queued job with WriterUnavailable (a 503 as well)
+and exits; the next submit_write() starts a new one.
+
+PUZZLE_WRITE_BATCHING=0 runs every job inline on the request's own pooled
+connection instead.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import models
+from metrics import register_collector
+
+WRITE_BATCHING = os.environ.get('PUZZLE_WRITE_BATCHING', '1') != '0'
+WRITE_QUEUE_SIZE = int(os.environ.get('PUZZLE_WRITE_QUEUE', '1024'))
+WRITE_QUEUE_TIMEOUT = 1.0
+WRITE_BATCH_SIZE = 256
+WRITE_TIMEOUT = 30.0
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+class WriteTimeout(Exception):
+    pass
+
+
+class WriterUnavailable(Exception):
+    pass
+
+
+log = logging.getLogger('puzzle.writer')
+
+
+_queue = None
+_queue_pid = None
+_lock = threading.Lock()
+_stats = {'jobs': 0, 'batches': 0, 'failed_batches': 0, 'rejected': 0, 'timed_out': 0}
+
+
+def _run_batch(conn, batch):
+    results = []
+    conn.execute('BEGIN IMMEDIATE')
+    for fn, _ in batch:
+        conn.execute('SAVEPOINT job')
+        try:
+            results.append((True, fn(conn)))
+            conn.execute('RELEASE job')
+        except Exception as e:
+            conn.execute('ROLLBACK TO job')
+            conn.execute('RELEASE job')
+            results.append((False, e))
+    conn.commit()
+    return results
+
+
+def _abandon(jobs, error):
+    """Fails every job on a writer's queue after it could not connect, and
+    makes the next submit_write() start a fresh writer."""
+    global _queue_pid
+    with _lock:
+        if _queue is jobs:
+            _queue_pid = None
+    failure = WriterUnavailable(f'writer could not open the database: {error}')
+    failure.__cause__ = error
+    # Requests that picked up this queue just before the reset may still be
+    # putting jobs on it, for up to WRITE_QUEUE_TIMEOUT.
+    while True:
+        try:
+            _, future = jobs.get(timeout=WRITE_QUEUE_TIMEOUT)
+        except queue.Empty:
+            return
+        future.set_exception(failure)
+
+
+def _writer(jobs):
+    try:
+        conn = models._connect()
+        conn.execute('PRAGMA synchronous=FULL')
+    except Exception as e:
+        log.exception('Writer cannot open the database; failing its queued writes')
+        _abandon(jobs, e)
+        return
+    while True:
+        batch = [jobs.get()]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            results = _run_batch(conn, batch)
+        except Exception as e:
+            # BEGIN or COMMIT failed (e.g. another process held the lock past
+            # busy_timeout): nothing from this batch was written.
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(False, e)] * len(batch)
+            with _lock:
+                _stats['failed_batches'] += 1
+        with _lock:
+            _stats['jobs'] += len(batch)
+            _stats['batches'] += 1
+        for (_, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+def _jobs():
+    global _queue, _queue_pid
+    if _queue_pid != os.getpid():
+        with _lock:
+            if _queue_pid != os.getpid():
+                # Threads do not survive a fork; each worker starts its own.
+                jobs = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+                threading.Thread(target=_writer, args=(jobs,), name='puzzle-writer', daemon=True).start()
+                _queue, _queue_pid = jobs, os.getpid()
+    return _queue
+
+
+def submit_write(fn):
+    """Runs ``fn(conn)`` in the next group commit and returns its result
+    once that commit is durable. ``fn`` must not commit or roll back itself;
+    if it raises, its writes are undone and the exception re-raised here."""
+    if not WRITE_BATCHING:
+        with models.get_db() as conn:
+            return fn(conn)
+    future = Future()
+    try:
+        _jobs().put((fn, future), timeout=WRITE_QUEUE_TIMEOUT)
+    except queue.Full:
+        with _lock:
+            _stats['rejected'] += 1
+        raise WriteQueueFull('write queue is full') from None
+    try:
+        return future.result(WRITE_TIMEOUT)
+    except FutureTimeout:
+        with _lock:
+            _stats['timed_out'] += 1
+        raise WriteTimeout('write not committed in time') from None
+
+
+def writer_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats['queued'] = _queue.qsize() if _queue_pid == os.getpid() else 0
+    stats['mean_batch'] = stats['jobs'] / stats['batches'] if stats['batches'] else 0.0
+    return stats
+
+
+@register_collector
+def _collect():
+    stats = writer_stats()
+    return [
+        ('puzzle_write_jobs_total', 'counter', 'Write jobs run by the group committer.', stats['jobs']),
+        ('puzzle_write_batches_total', 'counter', 'Group commits.', stats['batches']),
+        ('puzzle_write_failed_batches_total', 'counter', 'Group commits that failed as a whole.', stats['failed_batches']),
+        ('puzzle_write_rejected_total', 'counter', 'Writes refused because the queue was full.', stats['rejected']),
+        ('puzzle_write_timed_out_total', 'counter', 'Writes not committed within WRITE_TIMEOUT.', stats['timed_out']),
+        ('puzzle_write_queue_depth', 'gauge', 'Write jobs waiting for the committer.', stats['queued']),
+    ]
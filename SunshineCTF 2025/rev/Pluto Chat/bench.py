@@ -0,0 +1,226 @@
+"""Benchmarks for the Pluto Chat solver.
+
+    python bench.py rc4 [--sizes 16,64,512,4096,65536] [--seconds 1]
+    python bench.py scaling [--jobs 1,2,4] [--connections 500] [--messages 40]
+    python bench.py brute [--batches 1024,4096,16384] [--jobs 1,2,4] [--seconds 1]
+    python bench.py parse [--messages 10000] [--repeat 5]
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import random
+import tempfile
+import time
+import timeit
+import numpy as np
+import bruteforce
+import solve
+import synthetic
+
+
+def reference_decrypt(msg_key_bytes, ciphertext):
+    """decrypt_message as it was first written: key schedule every call,
+    one generator step and one XOR per byte."""
+    s_box = solve.key_scheduling_rc4(solve.custom_key_setup(int.from_bytes(msg_key_bytes, 'little')))
+    keystream = solve.pseudo_random_generation(s_box)
+    return bytes([c ^ next(keystream) for c in ciphertext])
+
+
+def reference_fields(plaintext):
+    """Message parsing as it was before MESSAGE_TABLE: slices and decodes
+    written out for each type."""
+    msg_type = plaintext[0]
+    if msg_type == 0:
+        user_len = plaintext[1]
+        username = plaintext[2:2 + user_len].decode(errors='ignore')
+        pass_start = 2 + user_len
+        pass_len = plaintext[pass_start]
+        password = plaintext[pass_start + 1:pass_start + 1 + pass_len].decode(errors='ignore')
+        return {'type': 'login', 'username': username, 'password': password}
+    elif msg_type == 1:
+        return {'type': 'login_ok'}
+    elif msg_type in (2, 3):
+        user_len = plaintext[1]
+        user = plaintext[2:2 + user_len].decode(errors='ignore')
+        msg_start = 2 + user_len
+        msg_len_val = plaintext[msg_start]
+        message = plaintext[msg_start + 1:msg_start + 1 + msg_len_val].decode(errors='ignore')
+        if msg_type == 2:
+            return {'type': 'chat_sent', 'to': user, 'text': message}
+        return {'type': 'chat_received', 'from': user, 'text': message}
+    else:
+        return {'type': 'unknown', 'msg_type': msg_type}
+
+
+def reference_describe(plaintext):
+    """describe_message as it was before MESSAGE_TABLE."""
+    fields = reference_fields(plaintext)
+    kind = fields['type']
+    if kind == 'login':
+        return f"[*] Login packet: Username='{fields['username']}', Password='{fields['password']}'"
+    elif kind == 'login_ok':
+        return f"[*] Server response: [Status: Login successful]"
+    elif kind == 'chat_sent':
+        return f"[*] Chat message -> To: '{fields['to']}', Text: '{fields['text']}'"
+    elif kind == 'chat_received':
+        return f"[*] Chat message -> From: '{fields['from']}', Text: '{fields['text']}'"
+    else:
+        return f"[*] Unknown message type ({fields['msg_type']})"
+
+
+def rate(fn, seconds):
+    """Calls fn() repeatedly for about ``seconds``; returns calls per second."""
+    fn()
+    calls, start = 0, time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def bench_rc4(args):
+    print(f'  {"bytes":>7} {"reference MB/s":>15} {"cold MB/s":>10} {"cached MB/s":>12} {"speedup":>8}')
+    for size in map(int, args.sizes.split(',')):
+        ciphertext = os.urandom(size)
+        key = os.urandom(4)
+        assert solve.decrypt_message(key, ciphertext) == reference_decrypt(key, ciphertext)
+        keys = iter(os.urandom(4) for _ in iter(int, 1))
+
+        def cold():
+            solve.decrypt_message(next(keys), ciphertext)
+
+        results = [rate(lambda: reference_decrypt(key, ciphertext), args.seconds) * size / 2 ** 20,
+                   rate(cold, args.seconds) * size / 2 ** 20,
+                   rate(lambda: solve.decrypt_message(key, ciphertext), args.seconds) * size / 2 ** 20]
+        print(f'  {size:>7} {results[0]:15.2f} {results[1]:10.2f} {results[2]:12.2f} {results[2] / results[0]:7.1f}x')
+    print(f'[*] S-box cache: {solve.message_sbox.cache_info()}')
+
+
+def bench_scaling(args):
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scaling.pcap')
+        start = time.perf_counter()
+        packets = []
+        for port in rng.sample(range(1024, 65535), args.connections):
+            (_, client_data), (_, server_data) = synthetic.conversation(rng, args.messages)
+            packets += synthetic.capture_packets(rng, port, client_data, server_data)[0]
+        synthetic.write_pcap(path, packets)
+        size = os.path.getsize(path)
+        print(f'[*] {args.connections} connections, {args.connections * args.messages} messages, '
+              f'{size / 2 ** 20:.1f} MB, built in {time.perf_counter() - start:.1f}s; {os.cpu_count()} CPUs')
+        print(f'  {"jobs":>4} {"seconds":>8} {"msgs/s":>9} {"MB/s":>6} {"speedup":>8}')
+        baseline = digest = None
+        for jobs in map(int, args.jobs.split(',')):
+            solve.message_sbox.cache_clear()
+            output = hashlib.sha256()
+            messages = 0
+            start = time.perf_counter()
+            for direction, kind, value in solve.decode_pcap(path, jobs=jobs):
+                output.update(repr((direction, kind, value)).encode())
+                messages += kind == 'message'
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            if digest not in (None, output.digest()):
+                print(f'[!] output with --jobs {jobs} differs from --jobs 1')
+            digest = output.digest()
+            print(f'  {jobs:>4} {elapsed:8.2f} {messages / elapsed:9.0f} {size / 2 ** 20 / elapsed:6.2f} '
+                  f'{baseline / elapsed:7.2f}x')
+
+
+def bench_brute(args):
+    ciphertext = os.urandom(32)
+    known = bytes([ciphertext[0] ^ 1, ciphertext[1] ^ 2])  # matches almost nothing
+
+    def scalar():
+        seed = int.from_bytes(os.urandom(4), 'little')
+        sbox = solve.key_scheduling_rc4(solve.custom_key_setup(seed))
+        solve.rc4_keystream(sbox, bruteforce.FILTER_BYTES)
+
+    base = rate(scalar, args.seconds)
+    print(f'  {"method":>22} {"seeds/s":>10} {"2^32 hours":>11} {"speedup":>8}')
+    print(f'  {"scalar":>22} {base:10,.0f} {2 ** 32 / base / 3600:11.1f} {1:7.1f}x')
+    for batch in map(int, args.batches.split(',')):
+        seeds = np.arange(batch, dtype=np.uint32)
+
+        def vectorised():
+            bruteforce.keystream_batch(bruteforce.key_setup_batch(seeds), bruteforce.FILTER_BYTES)
+
+        speed = rate(vectorised, args.seconds) * batch
+        print(f'  {f"numpy, batch {batch}":>22} {speed:10,.0f} {2 ** 32 / speed / 3600:11.1f} {speed / base:7.1f}x')
+    size = bruteforce.CHUNK // 4
+    for jobs in map(int, args.jobs.split(',')):
+        start = time.perf_counter()
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            list(pool.map(bruteforce.search_range, range(0, size * jobs * 2, size),
+                          range(size, size * (jobs * 2 + 1), size),
+                          [ciphertext] * (jobs * 2), [known] * (jobs * 2)))
+        speed = size * jobs * 2 / (time.perf_counter() - start)
+        print(f'  {f"search_range, {jobs} jobs":>22} {speed:10,.0f} {2 ** 32 / speed / 3600:11.1f} '
+              f'{speed / base:7.1f}x')
+    print(f'[*] {os.cpu_count()} CPUs')
+
+
+def bench_parse(args):
+    rng = random.Random(1)
+    mixed = [synthetic.chat_message(rng) for _ in range(args.messages)]
+    chat = bytes([3, 14]) + b'givemethemoney' + bytes([62]) + b'Hey can you give me that sensitive key you were talking about?'
+    for plaintext in mixed + [chat]:
+        message = solve.parse_message(plaintext)
+        assert list(message.as_dict().values()) == list(reference_fields(plaintext).values())
+        assert solve.describe_message(message) == reference_describe(plaintext)
+
+    cases = ('reference_fields(plaintext)', 'parse_message(plaintext)', 'parse_message(plaintext).as_dict()',
+             'reference_describe(plaintext)', 'describe_message(parse_message(plaintext))')
+    print(f'  {"messages":>16} {"reference fields":>17} {"parse":>6} {"+as_dict":>9} '
+          f'{"reference describe":>19} {"parse+describe":>15}   (us per message)')
+    for name, plaintexts in ((f'{len(chat)}-byte chat', [chat]), (f'{len(mixed)} synthetic', mixed)):
+        # The cases are timed in turn on every repeat, so a noisy machine
+        # slows them alike; the best repeat of each is kept.
+        number = max(1, 200000 // len(plaintexts))
+        best = [float('inf')] * len(cases)
+        for _ in range(args.repeat):
+            for i, case in enumerate(cases):
+                elapsed = timeit.timeit(f'for plaintext in plaintexts: {case}', number=number, globals={
+                    'plaintexts': plaintexts, 'reference_fields': reference_fields,
+                    'reference_describe': reference_describe, 'parse_message': solve.parse_message,
+                    'describe_message': solve.describe_message})
+                best[i] = min(best[i], elapsed / number / len(plaintexts) * 1e6)
+        print(f'  {name:>16} {best[0]:17.3f} {best[1]:6.3f} {best[2]:9.3f} {best[3]:19.3f} {best[4]:15.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    rc4 = sub.add_parser('rc4', help='decryption MB/s against the original per-byte generator')
+    rc4.add_argument('--sizes', default='16,64,512,4096,65536')
+    rc4.add_argument('--seconds', type=float, default=1.0)
+    rc4.set_defaults(func=bench_rc4)
+
+    scaling = sub.add_parser('scaling', help='decode time of a synthetic multi-stream capture as --jobs grows')
+    scaling.add_argument('--jobs', default=','.join(str(2 ** i) for i in range((os.cpu_count() or 1).bit_length())))
+    scaling.add_argument('--connections', type=int, default=500)
+    scaling.add_argument('--messages', type=int, default=40, help='per connection')
+    scaling.set_defaults(func=bench_scaling)
+
+    brute = sub.add_parser('brute', help='key-search seeds/s, scalar against bruteforce.py')
+    brute.add_argument('--batches', default=f'1024,{bruteforce.BATCH},16384')
+    brute.add_argument('--jobs', default=','.join(str(2 ** i) for i in range((os.cpu_count() or 1).bit_length())))
+    brute.add_argument('--seconds', type=float, default=1.0)
+    brute.set_defaults(func=bench_brute)
+
+    parse = sub.add_parser('parse', help='message parsing and formatting time against the hand-written code they replaced')
+    parse.add_argument('--messages', type=int, default=10000)
+    parse.add_argument('--repeat', type=int, default=5)
+    parse.set_defaults(func=bench_parse)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Recovers a Pluto Chat message key by brute force.
+
+custom_key_setup derives the RC4 key from one 32-bit integer, so a message
+whose 4-byte key is lost or corrupted can still be decrypted by trying all
+2^32 seeds against a few known plaintext bytes -- the msg_type byte and the
+first length byte, say, or more if the username is known too. Candidates
+must also parse as a well-formed message of printable text.
+
+Seeds are tried a batch at a time with NumPy: the key setup, the RC4 key
+schedule and the first few output bytes run for the whole batch at once,
+one array operation per step. Each seed gets a column of a (256, batch)
+state matrix, so every step's swap is one gather and one scatter. Seeds
+whose keystream matches are checked again with solve.decrypt_message.
+
+The range is split into chunks that a process pool works through. A
+checkpoint file records finished chunks and matches after every chunk, so
+an interrupted run picks up where it stopped.
+
+    python bruteforce.py CIPHERTEXT_HEX KNOWN_PREFIX_HEX [--jobs N] [--checkpoint FILE]
+                         [--start 0] [--stop 4294967296] [--all]
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+import numpy as np
+from solve import MESSAGE_CLASSES, SUBSTITUTION, SWAP_ORDER, decrypt_message, message_length, parse_message
+
+KEY_SPACE = 1 << 32
+# Each batch's state is 256 * BATCH bytes; past a few MB the random swaps
+# miss the cache and throughput drops.
+BATCH = 4096
+CHUNK = 1 << 22
+# Keystream bytes compared in the vectorised pass; the rest of the known
+# prefix is checked per candidate.
+FILTER_BYTES = 4
+
+_SUBSTITUTION = np.frombuffer(SUBSTITUTION, dtype=np.uint8)
+_SWAP_ORDER = np.array(SWAP_ORDER)
+
+
+def key_setup_batch(seeds):
+    """custom_key_setup for an array of uint32 seeds; returns (80, n) uint8
+    with one key per column."""
+    current = seeds.astype(np.uint64)
+    dwords = np.empty((20, len(seeds)), dtype='<u4')
+    for i in range(20):
+        dwords[i] = current
+        rot = current & 0xF
+        current = ((current << rot) | (current >> (32 - rot))) & 0xFFFFFFFF
+    # (20, n) dwords -> (n, 80) bytes in memory order, as struct.pack lays them out
+    state = dwords[_SWAP_ORDER].T.copy().view(np.uint8)
+    return np.bitwise_xor.accumulate(_SUBSTITUTION[state], axis=1).T.copy()
+
+
+def keystream_batch(keys, length):
+    """The first ``length`` RC4 output bytes for every key column of
+    ``keys``; returns (length, n) uint8."""
+    n = np.intp(keys.shape[1])
+    sched = np.repeat(np.arange(256, dtype=np.uint8)[:, None], n, axis=1)
+    flat = sched.reshape(-1)
+    columns = np.arange(n, dtype=np.intp)
+    j = np.zeros(n, dtype=np.uint8)
+    index = np.empty(n, dtype=np.intp)
+    for i in range(256):
+        si = sched[i].copy()
+        j += si
+        j += keys[i % 80]
+        np.multiply(j, n, out=index)
+        index += columns
+        sched[i] = flat[index]
+        flat[index] = si
+    out = np.empty((length, n), dtype=np.uint8)
+    j[:] = 0
+    for i in range(1, length + 1):
+        si = sched[i].copy()
+        j += si
+        np.multiply(j, n, out=index)
+        index += columns
+        sj = flat[index]
+        sched[i] = sj
+        flat[index] = si
+        # uint8 addition wraps, which is the & 0xFF RC4 wants
+        out[i - 1] = flat[(si + sj) * n + columns]
+    return out
+
+
+def verify(seed, ciphertext, known):
+    """Whether ``seed`` decrypts ``ciphertext`` to a believable message:
+    the known prefix, and for a known type, fields that fill the frame
+    exactly and hold printable text. With only a byte or two known, random
+    seeds pass the first two tests by the hundred across the key space."""
+    plaintext = decrypt_message(seed.to_bytes(4, 'little'), ciphertext)
+    if not plaintext.startswith(known):
+        return False
+    # A known type whose fields overrun the frame has no length at all.
+    if plaintext and plaintext[0] in MESSAGE_CLASSES and message_length(plaintext) != len(ciphertext):
+        return False
+    try:
+        message = parse_message(plaintext)
+        return all(str(getattr(message, name), 'utf-8').isprintable() for name in message.fields)
+    except ValueError:
+        # truncated, or not UTF-8 (UnicodeDecodeError is a ValueError)
+        return False
+
+
+def search_range(start, stop, ciphertext, known, batch=BATCH):
+    """Seeds in [start, stop) that decrypt ``ciphertext`` to something
+    starting with ``known``."""
+    width = min(FILTER_BYTES, len(known))
+    target = np.frombuffer(bytes(c ^ p for c, p in zip(ciphertext, known[:width])), dtype=np.uint8)[:, None]
+    found = []
+    for first in range(start, stop, batch):
+        seeds = np.arange(first, min(first + batch, stop), dtype=np.uint64).astype(np.uint32)
+        stream = keystream_batch(key_setup_batch(seeds), width)
+        for column in np.flatnonzero((stream == target).all(axis=0)):
+            seed = int(seeds[column])
+            if verify(seed, ciphertext, known):
+                found.append(seed)
+    return found
+
+
+def _load_checkpoint(path, params):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state['params'] != params:
+            raise SystemExit(f"[!] {path} is for a different search; remove it or pick another --checkpoint")
+        return set(state['done']), state['found']
+    return set(), []
+
+
+def _save_checkpoint(path, params, done, found):
+    if not path:
+        return
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'params': params, 'done': sorted(done), 'found': found}, f)
+    os.replace(path + '.tmp', path)
+
+
+def brute_force(ciphertext, known, start=0, stop=KEY_SPACE, jobs=1, checkpoint=None, find_all=False):
+    """Searches [start, stop) in CHUNK-sized pieces across ``jobs``
+    processes and returns the matching seeds. Stops at the first match
+    unless ``find_all``."""
+    params = {'ciphertext': ciphertext.hex(), 'known': known.hex(), 'start': start, 'stop': stop, 'chunk': CHUNK}
+    done, found = _load_checkpoint(checkpoint, params)
+    chunks = [(first, min(first + CHUNK, stop)) for first in range(start, stop, CHUNK)]
+    todo = [index for index in range(len(chunks)) if index not in done]
+    if done:
+        print(f"[*] Resuming: {len(done)} of {len(chunks)} chunks already searched, {len(found)} matches so far")
+    if found and not find_all:
+        return found
+    began, searched = time.perf_counter(), 0
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = {pool.submit(search_range, *chunks[index], ciphertext, known): index for index in todo}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                index = futures[future]
+                found += future.result()
+                done.add(index)
+                searched += chunks[index][1] - chunks[index][0]
+                _save_checkpoint(checkpoint, params, done, found)
+                elapsed = time.perf_counter() - began
+                print(f"[*] {len(done)}/{len(chunks)} chunks, {searched / elapsed:,.0f} seeds/s, "
+                      f"{len(found)} matches", flush=True)
+                if found and not find_all:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Brute-forces a Pluto Chat message key from known plaintext.")
+    parser.add_argument('ciphertext', type=bytes.fromhex, help="the frame's ciphertext, hex")
+    parser.add_argument('known', type=bytes.fromhex, help="known leading plaintext bytes, hex (e.g. 0011 for "
+                                                          "a login with a 17-character username)")
+    parser.add_argument('--start', type=lambda v: int(v, 0), default=0)
+    parser.add_argument('--stop', type=lambda v: int(v, 0), default=KEY_SPACE)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--checkpoint', help="file to record progress in and resume from")
+    parser.add_argument('--all', action='store_true', help="search the whole range instead of stopping at a match")
+    args = parser.parse_args()
+    if not args.known:
+        parser.error("at least one known plaintext byte is needed")
+    for seed in brute_force(args.ciphertext, args.known, args.start, args.stop, args.jobs, args.checkpoint, args.all):
+        print(f"[+] Key {seed.to_bytes(4, 'little').hex()} (seed {seed:#010x}): "
+              f"{decrypt_message(seed.to_bytes(4, 'little'), args.ciphertext)!r}")
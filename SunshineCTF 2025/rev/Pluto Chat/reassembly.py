@@ -0,0 +1,173 @@
+"""TCP reassembly for the Pluto Chat solver.
+
+Each direction of a connection is reassembled on its own, by sequence
+number: retransmitted and overlapping bytes are delivered once (first copy
+wins), and segments that arrive early wait in a reorder buffer until the
+hole before them is filled. That buffer is bounded; once it holds more than
+REORDER_LIMIT bytes the hole is declared lost and delivery skips over it,
+reporting how many bytes are missing so the caller can resynchronise.
+"""
+import heapq
+
+TCP_FIN, TCP_SYN, TCP_RST = 0x01, 0x02, 0x04
+REORDER_LIMIT = 1024 * 1024
+SEQ_MOD = 1 << 32
+
+
+def seq_diff(a, b):
+    """a - b for 32-bit sequence numbers, allowing for wraparound."""
+    return (a - b + SEQ_MOD // 2) % SEQ_MOD - SEQ_MOD // 2
+
+
+class HalfStream:
+    """One direction of a TCP connection. Positions are kept as absolute
+    byte offsets so sequence numbers may wrap."""
+
+    __slots__ = ('next', 'pending', 'pending_bytes', 'fin', 'delivered', 'duplicate', 'missing',
+                 'reordered', 'peak_pending')
+
+    def __init__(self, seq):
+        self.next = seq
+        # heap of (absolute start, payload) for segments past a hole
+        self.pending = []
+        self.pending_bytes = 0
+        # absolute offset of the FIN, once one has been seen
+        self.fin = None
+        self.delivered = self.duplicate = self.missing = self.reordered = self.peak_pending = 0
+
+    def _absolute(self, seq):
+        # The closest absolute offset with these low 32 bits.
+        return self.next + seq_diff(seq, self.next)
+
+    def add(self, seq, payload, limit=REORDER_LIMIT):
+        """Takes one segment's payload and returns the data it makes
+        contiguous, as a list of (missing, data) pairs: ``missing`` bytes
+        were lost immediately before ``data``."""
+        start = self._absolute(seq)
+        out = []
+        if start > self.next:
+            heapq.heappush(self.pending, (start, bytes(payload)))
+            self.pending_bytes += len(payload)
+            self.reordered += 1
+            self.peak_pending = max(self.peak_pending, self.pending_bytes)
+            if self.pending_bytes > limit:
+                self._skip_hole(out)
+        else:
+            self._deliver(start, payload, out, 0)
+        self._drain(out)
+        return out
+
+    def flush(self):
+        """Delivers everything still waiting, skipping any holes; used when
+        the connection closes or the capture ends."""
+        out = []
+        while self.pending:
+            self._skip_hole(out)
+        return out
+
+    def _skip_hole(self, out):
+        missing = self.pending[0][0] - self.next
+        self.missing += missing
+        self.next = self.pending[0][0]
+        self._drain(out, missing)
+
+    def _deliver(self, start, payload, out, missing):
+        end = start + len(payload)
+        if end <= self.next:
+            self.duplicate += len(payload)
+            return
+        overlap = self.next - start
+        if overlap > 0:
+            self.duplicate += overlap
+            payload = payload[overlap:]
+        out.append((missing, bytes(payload)))
+        self.delivered += len(payload)
+        self.next = end
+
+    def _drain(self, out, missing=0):
+        while self.pending and self.pending[0][0] <= self.next:
+            start, payload = heapq.heappop(self.pending)
+            self.pending_bytes -= len(payload)
+            self._deliver(start, payload, out, missing)
+            missing = 0
+
+    def stats(self):
+        return {'delivered': self.delivered, 'duplicate': self.duplicate, 'missing': self.missing,
+                'reordered': self.reordered, 'peak_pending': self.peak_pending}
+
+
+class Reassembler:
+    """Tracks every direction seen in a capture. ``add`` takes the tuples
+    solve.read_pcap yields and returns (direction, missing, data) chunks;
+    a direction is (src, sport, dst, dport). A direction is flushed and
+    forgotten once its FIN is reached, or on RST; the position where it
+    ended is remembered for a while so late retransmissions are counted as
+    duplicates rather than starting a new stream."""
+
+    def __init__(self, limit=REORDER_LIMIT, remember_closed=65536):
+        self.limit = limit
+        self.remember_closed = remember_closed
+        self.streams = {}
+        # direction -> sequence number just past its last byte
+        self.closed = {}
+        self.totals = {'delivered': 0, 'duplicate': 0, 'missing': 0, 'reordered': 0, 'peak_pending': 0,
+                       'streams': 0}
+
+    def add(self, src, sport, dst, dport, seq, flags, payload):
+        key = (src, sport, dst, dport)
+        stream = self.streams.get(key)
+        chunks = []
+        if flags & TCP_SYN:
+            if stream is not None and stream.next == stream._absolute(seq + 1):
+                return chunks  # retransmitted SYN
+            if stream is not None:
+                chunks = self._close(key)
+            self.closed.pop(key, None)
+            stream = self.streams[key] = HalfStream((seq + 1) % SEQ_MOD)
+            self.totals['streams'] += 1
+            seq += 1
+        elif stream is None:
+            if not payload:
+                return chunks
+            end = self.closed.get(key)
+            if end is not None and seq_diff(seq + len(payload), end) <= 0:
+                self.totals['duplicate'] += len(payload)
+                return chunks
+            # Capture started mid-connection: trust the first segment seen.
+            self.closed.pop(key, None)
+            stream = self.streams[key] = HalfStream(seq)
+            self.totals['streams'] += 1
+        if payload:
+            chunks += [(key, missing, data) for missing, data in stream.add(seq, payload, self.limit)]
+        if flags & TCP_FIN:
+            stream.fin = stream._absolute(seq) + len(payload)
+        if flags & TCP_RST or (stream.fin is not None and stream.next >= stream.fin):
+            chunks += self._close(key)
+        return chunks
+
+    def _close(self, key):
+        stream = self.streams.pop(key)
+        chunks = [(key, missing, data) for missing, data in stream.flush()]
+        for name, value in stream.stats().items():
+            if name == 'peak_pending':
+                self.totals[name] = max(self.totals[name], value)
+            else:
+                self.totals[name] += value
+        self.closed[key] = stream.next % SEQ_MOD
+        if len(self.closed) > self.remember_closed:
+            del self.closed[next(iter(self.closed))]
+        return chunks
+
+    def close_all(self):
+        """Flushes every direction still open, at the end of a capture."""
+        chunks = []
+        for key in list(self.streams):
+            chunks += self._close(key)
+        return chunks
+
+    def stats(self):
+        totals = dict(self.totals)
+        for stream in self.streams.values():
+            for name, value in stream.stats().items():
+                totals[name] = max(totals[name], value) if name == 'peak_pending' else totals[name] + value
+        return totals
@@ -1,5 +1,15 @@
+import argparse
 import collections
-from scapy.all import rdpcap, TCP, Raw
+import concurrent.futures
+import functools
+import itertools
+import json
+import operator
+import os
+import struct
+import sys
+from reassembly import Reassembler, REORDER_LIMIT
+
 
 UNK_4100 = [
     0x0D, 0x08, 0x11, 0x0C, 0x0E, 0x07, 0x00, 0x05, 0x09, 0x04, 0x0B, 0x10,
@@ -36,6 +46,21 @@ def rol32(n, d):
     return ((n << d) | (n >> (32 - d))) & 0xFFFFFFFF
 
 
+def _swap_order():
+    order = list(range(20))
+    for i in range(20):
+        swap_idx = UNK_4100[i]
+        if 0 <= swap_idx < 20:
+            order[i], order[swap_idx] = order[swap_idx], order[i]
+    return order
+
+
+# The swaps in sub_1510 always land dword i in slot SWAP_ORDER.index(i).
+SWAP_ORDER = _swap_order()
+SUBSTITUTION = bytes(UNK_4120)
+PACK_DWORDS = struct.Struct('<20I').pack
+
+
 def custom_key_setup(initial_key_int: int) -> bytes:
     state_dwords = [0] * 20
     current_key = initial_key_int
@@ -44,23 +69,10 @@ def custom_key_setup(initial_key_int: int) -> bytes:
         rot = current_key & 0xF
         current_key = rol32(current_key, rot)
 
-    for i in range(20):
-        swap_idx = UNK_4100[i]
-        if 0 <= swap_idx < 20:
-            state_dwords[i], state_dwords[swap_idx] = state_dwords[swap_idx], state_dwords[i]
-
-    state_bytes = bytearray()
-    for dword in state_dwords:
-        state_bytes.extend(dword.to_bytes(4, 'little'))
-
-    last_val = 0
-    for i in range(80):
-        tmp = state_bytes[i]
-        result = UNK_4120[tmp] ^ last_val
-        state_bytes[i] = result
-        last_val = result
-
-    return bytes(state_bytes)
+    state_bytes = PACK_DWORDS(*[state_dwords[i] for i in SWAP_ORDER])
+    # Each byte is substituted, then XORed with the previous output byte: a
+    # running XOR over the substituted bytes.
+    return bytes(itertools.accumulate(state_bytes.translate(SUBSTITUTION), operator.xor))
 
 
 def key_scheduling_rc4(key: bytes) -> list:
@@ -83,81 +95,432 @@ def pseudo_random_generation(sched: list):
         yield sched[(sched[i] + sched[j]) % 256]
 
 
+# Message keys are random, so repeats are rare in live traffic, but
+# retransmitted or replayed frames and brute-force runs reuse them.
+SBOX_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=SBOX_CACHE_SIZE)
+def message_sbox(msg_key_bytes: bytes) -> bytes:
+    """The RC4 state after key scheduling for a 4-byte message key; the
+    same as key_scheduling_rc4 with the loop kept to local variables."""
+    key = custom_key_setup(int.from_bytes(msg_key_bytes, 'little')) * 4  # 320 >= 256 bytes
+    sched = list(range(256))
+    j = 0
+    for i in range(256):
+        si = sched[i]
+        j = (j + si + key[i]) & 0xFF
+        sched[i] = sched[j]
+        sched[j] = si
+    return bytes(sched)
+
+
+def rc4_keystream(sbox: bytes, length: int) -> bytearray:
+    """``length`` bytes of RC4 output from a fresh copy of ``sbox``."""
+    sched = list(sbox)
+    out = bytearray(length)
+    i = j = 0
+    for n in range(length):
+        i = (i + 1) & 0xFF
+        si = sched[i]
+        j = (j + si) & 0xFF
+        sj = sched[j]
+        sched[i] = sj
+        sched[j] = si
+        out[n] = sched[(si + sj) & 0xFF]
+    return out
+
+
+def xor_bytes(data, keystream) -> bytes:
+    n = len(data)
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(keystream, 'little')).to_bytes(n, 'little')
+
+
 def decrypt_message(msg_key_bytes: bytes, ciphertext: bytes) -> bytes:
-    initial_key = int.from_bytes(msg_key_bytes, 'little')
-    effective_key = custom_key_setup(initial_key)
-    s_box = key_scheduling_rc4(effective_key)
-    keystream = pseudo_random_generation(s_box)
-    plaintext = bytes([c ^ next(keystream) for c in ciphertext])
-    return plaintext
+    return xor_bytes(ciphertext, rc4_keystream(message_sbox(bytes(msg_key_bytes)), len(ciphertext)))
+
+
+# libpcap magic -> (byte order, timestamp unit); nanosecond files differ only in the unit.
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>',
+}
+LINKTYPE_NULL, LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL = 0, 1, 101, 113
+# A frame header announcing more than this means the stream has desynced.
+MAX_MESSAGE_LEN = 16 * 1024 * 1024
+READ_BUFFER = 1024 * 1024
+# Frames handed to a worker at a time with --jobs.
+DECRYPT_BATCH = 256
+
+
+def read_pcap(pcap_file: str):
+    """Yields (src, sport, dst, dport, seq, flags, payload) for each TCP
+    segment in a libpcap file, reading one record at a time so memory use
+    does not depend on the size of the capture."""
+    with open(pcap_file, 'rb', buffering=READ_BUFFER) as f:
+        header = f.read(24)
+        if header[:4] not in PCAP_MAGIC:
+            raise ValueError(f"{pcap_file} is not a libpcap file (pcapng captures need converting with editcap -F pcap)")
+        order = PCAP_MAGIC[header[:4]]
+        linktype = struct.unpack(order + 'I', header[20:24])[0] & 0xFFFF
+        record_header = struct.Struct(order + 'IIII')
+        while True:
+            rec = f.read(16)
+            if len(rec) < 16:
+                return
+            caplen = record_header.unpack(rec)[2]
+            frame = f.read(caplen)
+            if len(frame) < caplen:
+                return
+            segment = parse_frame(frame, linktype)
+            if segment is not None:
+                yield segment
+
+
+def parse_frame(frame: bytes, linktype: int):
+    if linktype == LINKTYPE_ETHERNET:
+        offset, ethertype = 14, frame[12:14]
+        while ethertype == b'\x81\x00':  # 802.1Q tag
+            ethertype, offset = frame[offset + 2:offset + 4], offset + 4
+        if ethertype not in (b'\x08\x00', b'\x86\xdd'):
+            return None
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset = 16
+    elif linktype == LINKTYPE_NULL:
+        offset = 4
+    elif linktype == LINKTYPE_RAW:
+        offset = 0
+    else:
+        raise ValueError(f"Unsupported link type {linktype}")
+
+    version = frame[offset] >> 4 if len(frame) > offset else 0
+    if version == 4:
+        if frame[offset + 9] != 6:
+            return None
+        ihl = (frame[offset] & 0x0F) * 4
+        end = offset + int.from_bytes(frame[offset + 2:offset + 4], 'big')
+        src = '.'.join(map(str, frame[offset + 12:offset + 16]))
+        dst = '.'.join(map(str, frame[offset + 16:offset + 20]))
+        tcp = offset + ihl
+    elif version == 6:
+        # Extension headers are not followed; chat traffic does not use them.
+        if frame[offset + 6] != 6:
+            return None
+        end = offset + 40 + int.from_bytes(frame[offset + 4:offset + 6], 'big')
+        src = frame[offset + 8:offset + 24].hex(':', 2)
+        dst = frame[offset + 24:offset + 40].hex(':', 2)
+        tcp = offset + 40
+    else:
+        return None
+
+    # Trust the IP length over the capture length: Ethernet pads short frames.
+    end = min(end, len(frame))
+    if tcp + 20 > end:
+        return None
+    sport, dport, seq = struct.unpack_from('!HHI', frame, tcp)
+    data = tcp + (frame[tcp + 12] >> 4) * 4
+    return src, sport, dst, dport, seq, frame[tcp + 13], memoryview(frame)[data:end]
+
+
+def take_frames(buffer: bytearray):
+    """Removes every complete [key][len][ciphertext] frame from the front of
+    buffer and returns them as (key, ciphertext) pairs. Raises ValueError if
+    the next frame claims an impossible length."""
+    frames = []
+    cursor = 0
+    while cursor + 8 <= len(buffer):
+        msg_len = int.from_bytes(buffer[cursor + 4:cursor + 8], 'little')
+        if msg_len > MAX_MESSAGE_LEN:
+            raise ValueError(f"frame length {msg_len} exceeds {MAX_MESSAGE_LEN}")
+        if cursor + 8 + msg_len > len(buffer):
+            break
+        frames.append((bytes(buffer[cursor:cursor + 4]), bytes(buffer[cursor + 8:cursor + 8 + msg_len])))
+        cursor += 8 + msg_len
+    del buffer[:cursor]
+    return frames
+
+
+def resync(buffer: bytearray):
+    """After lost bytes, drops data from the front of buffer up to the next
+    frame that decrypts to a well-formed message. Returns (found, skipped);
+    when nothing is found yet, keeps the tail a frame could still start in."""
+    for i in range(len(buffer) - 7):
+        msg_len = int.from_bytes(buffer[i + 4:i + 8], 'little')
+        if not 0 < msg_len <= MAX_KNOWN_LEN:
+            continue
+        if i + 8 + msg_len > len(buffer):
+            del buffer[:i]
+            return False, i
+        plaintext = decrypt_message(bytes(buffer[i:i + 4]), bytes(buffer[i + 8:i + 8 + msg_len]))
+        if message_length(plaintext) == msg_len:
+            del buffer[:i]
+            return True, i
+    skipped = max(0, len(buffer) - 7)
+    del buffer[:skipped]
+    return False, skipped
+
 
+class Message:
+    """A parsed chat message. Field values are bytes sliced from the
+    plaintext; decode() turns one into a str."""
 
-def process_pcap(pcap_file: str):
-    print(f"[*] Analyzing file {pcap_file}...")
+    __slots__ = ('msg_type', 'raw')
+    kind = 'unknown'
+    fields = ()
+    template = None
+
+    def __init__(self, msg_type, raw):
+        self.msg_type = msg_type
+        self.raw = raw
+
+    def decode(self, name) -> str:
+        return str(getattr(self, name), 'utf-8', 'ignore')
+
+    # Known types replace these two with compiled versions; see compile_message.
+    def as_dict(self) -> dict:
+        return {'type': self.kind, 'msg_type': self.msg_type}
+
+    def describe(self) -> str:
+        return f"[*] Unknown message type ({self.msg_type})"
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={self.decode(name)!r}' for name in self.fields)})"
+
+
+# msg_type -> (class name, kind, fields, how solve.py prints it). Every field
+# is a one-byte length followed by that many bytes, in this order.
+MESSAGE_TABLE = {
+    0: ('Login', 'login', ('username', 'password'), "[*] Login packet: Username='{username}', Password='{password}'"),
+    1: ('LoginOk', 'login_ok', (), "[*] Server response: [Status: Login successful]"),
+    2: ('ChatSent', 'chat_sent', ('recipient', 'text'), "[*] Chat message -> To: '{recipient}', Text: '{text}'"),
+    3: ('ChatReceived', 'chat_received', ('sender', 'text'), "[*] Chat message -> From: '{sender}', Text: '{text}'"),
+}
+MESSAGE_CLASSES = {
+    msg_type: type(name, (Message,), {'__slots__': fields, 'kind': kind, 'fields': fields, 'template': template})
+    for msg_type, (name, kind, fields, template) in MESSAGE_TABLE.items()
+}
+# The longest message the table allows: type byte plus full-length fields.
+MAX_KNOWN_LEN = 1 + max(len(fields) for _, _, fields, _ in MESSAGE_TABLE.values()) * (1 + 255)
+
+
+def compile_message(cls):
+    """Builds the parser, as_dict() and describe() for one message class as
+    straight-line code, once, the way collections.namedtuple builds its
+    methods: a slice and a slot store per field, and one decode per field
+    when strings are wanted, with no loop, getattr or setattr. Returns the
+    parser; a length byte past the end raises IndexError there, which
+    parse_message reports."""
+    lines = ['def parse(plaintext):',
+             '    message = new(cls)',
+             '    message.msg_type = plaintext[0]',
+             '    message.raw = plaintext',
+             '    end = 1']
+    for name in cls.fields:
+        lines += ['    start = end + 1',
+                  '    end = start + plaintext[end]',
+                  f'    message.{name} = plaintext[start:end]']
+    lines += ['    if end > len(plaintext):',
+              '        raise ValueError("message truncated")',
+              '    return message']
+    if cls.template is not None:
+        # The template's {field} placeholders become an f-string over locals.
+        strings = [f"    {name} = str(self.{name}, 'utf-8', 'ignore')" for name in cls.fields]
+        lines += ['def as_dict(self):', *strings,
+                  f"    return {{'type': kind, {', '.join(f'{name!r}: {name}' for name in cls.fields)}}}",
+                  'def describe(self):', *strings,
+                  f'    return f{cls.template!r}']
+    namespace = {'new': object.__new__, 'cls': cls, 'kind': cls.kind}
+    exec('\n'.join(lines), namespace)
+    if cls.template is not None:
+        cls.as_dict, cls.describe = namespace['as_dict'], namespace['describe']
+    return namespace['parse']
+
+
+# Indexed by the type byte, so unknown types need no separate lookup.
+MESSAGE_PARSERS = [compile_message(Message)] * 256
+for msg_type, cls in MESSAGE_CLASSES.items():
+    MESSAGE_PARSERS[msg_type] = compile_message(cls)
+
+
+def parse_message(plaintext) -> Message:
+    """Parses a decrypted message by MESSAGE_TABLE; raises ValueError if it
+    is empty or a field runs past the end of it."""
+    try:
+        return MESSAGE_PARSERS[plaintext[0]](plaintext)
+    except IndexError:
+        raise ValueError("message truncated" if plaintext else "empty message") from None
+
+
+def message_length(plaintext):
+    """The length a message of a known type must have, judging by its own
+    length fields; None for unknown types or a truncated header."""
+    view = memoryview(plaintext)
+    cls = MESSAGE_CLASSES.get(view[0]) if view else None
+    if cls is None:
+        return None
+    offset = 1
+    for _ in cls.fields:
+        if offset >= len(view):
+            return None
+        offset += 1 + view[offset]
+    return offset
+
+
+def iter_messages(events):
+    """Turns decode_pcap's 'message' events into parsed Message records,
+    yielding (direction, kind, value); a message that does not parse
+    becomes an 'error' event."""
+    for direction, kind, value in events:
+        if kind == 'message':
+            try:
+                value = parse_message(value)
+            except ValueError as e:
+                kind, value = 'error', e
+        yield direction, kind, value
+
+
+def describe_message(message: Message) -> str:
+    return message.describe()
+
+
+def decrypt_frames(frames):
+    """Decrypts a batch of (key, ciphertext) frames; runs in pool workers."""
+    results = []
+    for msg_key, ciphertext in frames:
+        try:
+            results.append(('message', decrypt_message(msg_key, ciphertext)))
+        except Exception as e:
+            results.append(('error', e))
+    return results
+
+
+def frame_pcap(pcap_file: str, reorder_limit: int = REORDER_LIMIT, stats=None):
+    """Yields (direction, kind, value) as the capture is read: ``kind`` is
+    'frame' with a (key, ciphertext) pair, or 'lost' with a note about data
+    that could not be framed. Each direction keeps only its undecoded tail
+    and is forgotten once it closes, so memory stays flat however large the
+    capture is. Reassembly totals are stored in ``stats`` when given."""
+    reassembler = Reassembler(reorder_limit)
+    # direction -> [frame buffer, in sync]
+    buffers = {}
+
+    def frames(chunks):
+        for direction, missing, data in chunks:
+            state = buffers.setdefault(direction, [bytearray(), True])
+            buffer = state[0]
+            if missing:
+                yield direction, 'lost', f"{missing} bytes missing from the stream"
+                buffer.clear()
+                state[1] = False
+            buffer += data
+            while True:
+                if not state[1]:
+                    state[1], skipped = resync(buffer)
+                    if skipped:
+                        yield direction, 'lost', f"skipped {skipped} bytes to find the next message"
+                    if not state[1]:
+                        break
+                try:
+                    for frame in take_frames(buffer):
+                        yield direction, 'frame', frame
+                    break
+                except ValueError as e:
+                    yield direction, 'lost', f"desynced: {e}"
+                    state[1] = False
+
+    for segment in read_pcap(pcap_file):
+        yield from frames(reassembler.add(*segment))
+        direction = segment[:4]
+        if direction in buffers and direction not in reassembler.streams:
+            del buffers[direction]
+    yield from frames(reassembler.close_all())
+    if stats is not None:
+        stats.update(reassembler.stats())
+
+
+def decode_pcap(pcap_file: str, reorder_limit: int = REORDER_LIMIT, stats=None, jobs: int = 1):
+    """Like frame_pcap, with each frame decrypted: it becomes 'message' with
+    the plaintext or 'error' with the exception; see iter_messages for
+    parsed records. With ``jobs`` > 1 frames
+    are decrypted in batches by a process pool while the capture is still
+    being read; events come out in the same order either way."""
+    events = frame_pcap(pcap_file, reorder_limit, stats)
+    if jobs <= 1:
+        for direction, kind, value in events:
+            if kind == 'frame':
+                yield (direction,) + decrypt_frames([value])[0]
+            else:
+                yield direction, kind, value
+        return
+
+    def merge(batch, future):
+        results = iter(future.result())
+        for direction, kind, value in batch:
+            yield (direction,) + next(results) if kind == 'frame' else (direction, kind, value)
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        # Batches in submission order; only a few per worker are in flight,
+        # so a large capture is not read ahead into memory.
+        pending = collections.deque()
+        while batch := list(itertools.islice(events, DECRYPT_BATCH)):
+            pending.append((batch, pool.submit(decrypt_frames, [v for _, kind, v in batch if kind == 'frame'])))
+            if len(pending) > jobs * 4:
+                yield from merge(*pending.popleft())
+        while pending:
+            yield from merge(*pending.popleft())
+
+
+def event_record(direction, kind, value) -> dict:
+    """One decode_pcap event as a JSON-ready dict."""
+    record = {'src': direction[0], 'sport': direction[1], 'dst': direction[2], 'dport': direction[3], 'event': kind}
+    if kind == 'message':
+        record.update(value.as_dict())
+    else:
+        record['detail'] = str(value)
+    return record
+
+
+def process_pcap(pcap_file: str, reorder_limit: int = REORDER_LIMIT, jobs: int = 1, output: str = 'text'):
+    if output == 'text':
+        print(f"[*] Analyzing file {pcap_file}...")
+    stats = {}
+    # Text output: direction -> its lines, printed per stream once the
+    # capture has been read, since directions interleave on the wire.
+    streams = {}
     try:
-        packets = rdpcap(pcap_file)
+        for direction, kind, value in iter_messages(decode_pcap(pcap_file, reorder_limit, stats, jobs)):
+            if output == 'jsonl':
+                print(json.dumps(event_record(direction, kind, value), ensure_ascii=False))
+            elif kind == 'message':
+                streams.setdefault(direction, []).append(describe_message(value))
+            elif kind == 'error':
+                streams.setdefault(direction, []).append(f"[!] Decryption error: {value}")
+            else:
+                streams.setdefault(direction, []).append(f"[!] {value}")
     except FileNotFoundError:
-        print(f"[!] Error: File '{pcap_file}' not found.")
+        print(f"[!] Error: File '{pcap_file}' not found.", file=sys.stderr if output == 'jsonl' else sys.stdout)
         return
 
-    streams = collections.defaultdict(bytes)
-    for packet in packets:
-        if TCP in packet and Raw in packet:
-            src_ip, dst_ip = packet['IP'].src, packet['IP'].dst
-            src_port, dst_port = packet['TCP'].sport, packet['TCP'].dport
-            stream_key = tuple(sorted(((src_ip, src_port), (dst_ip, dst_port))))
-            streams[stream_key] += packet[Raw].load
-
-    print(f"[*] Found {len(streams)} TCP streams with data.")
-    for stream_key, data in streams.items():
-        print(f"\n--- Decrypting stream: {stream_key[0]} <-> {stream_key[1]} ---")
-        cursor = 0
-        while cursor + 8 <= len(data):
-            msg_key = data[cursor:cursor + 4]
-            msg_len = int.from_bytes(data[cursor + 4:cursor + 8], 'little')
-            cursor += 8
-            if cursor + msg_len > len(data):
-                break
-
-            ciphertext = data[cursor:cursor + msg_len]
-            try:
-                plaintext = decrypt_message(msg_key, ciphertext)
-                msg_type = plaintext[0]
-
-                if msg_type == 0:  # Login
-                    user_len = plaintext[1]
-                    username = plaintext[2:2 + user_len].decode(errors='ignore')
-                    pass_start = 2 + user_len
-                    pass_len = plaintext[pass_start]
-                    password = plaintext[pass_start + 1:pass_start + 1 + pass_len].decode(errors='ignore')
-                    print(f"[*] Login packet: Username='{username}', Password='{password}'")
-
-                elif msg_type == 1:  # Successful server response
-                    print(f"[*] Server response: [Status: Login successful]")
-
-                elif msg_type == 2:  # Chat message (sent)
-                    to_user_len = plaintext[1]
-                    to_user = plaintext[2:2 + to_user_len].decode(errors='ignore')
-                    msg_start = 2 + to_user_len
-                    msg_len_val = plaintext[msg_start]
-                    message = plaintext[msg_start + 1:msg_start + 1 + msg_len_val].decode(errors='ignore')
-                    print(f"[*] Chat message -> To: '{to_user}', Text: '{message}'")
-
-                elif msg_type == 3:  # Chat message (received)
-                    from_user_len = plaintext[1]
-                    from_user = plaintext[2:2 + from_user_len].decode(errors='ignore')
-                    msg_start = 2 + from_user_len
-                    msg_len_val = plaintext[msg_start]
-                    message = plaintext[msg_start + 1:msg_start + 1 + msg_len_val].decode(errors='ignore')
-                    print(f"[*] Chat message -> From: '{from_user}', Text: '{message}'")
-
-                else:
-                    print(f"[*] Unknown message type ({msg_type})")
-            except Exception as e:
-                print(f"[!] Decryption error: {e}")
-            cursor += msg_len
+    for direction, lines in streams.items():
+        print(f"\n--- Decrypting stream: {direction[:2]} -> {direction[2:]} ---")
+        print('\n'.join(lines))
+
+    summary = (f"\n[*] Found {stats['streams']} TCP streams.\n"
+               f"[*] Reassembly: {stats['delivered']} bytes delivered, {stats['duplicate']} duplicate, "
+               f"{stats['missing']} missing, {stats['reordered']} segments reordered "
+               f"(reorder buffer peaked at {stats['peak_pending']} bytes)")
+    print(summary, file=sys.stderr if output == 'jsonl' else sys.stdout)
 
 
 if __name__ == '__main__':
-    PCAP_FILENAME = 'evidence.pcap'
-    process_pcap(PCAP_FILENAME)
+    parser = argparse.ArgumentParser(description="Decrypts Pluto Chat traffic from a libpcap capture.")
+    parser.add_argument('pcap', nargs='?', default='evidence.pcap')
+    parser.add_argument('--reorder-limit', type=int, default=REORDER_LIMIT,
+                        help="bytes of out-of-order data held per direction before a hole is given up on")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="decrypt in this many worker processes (0: one per CPU)")
+    parser.add_argument('--output', choices=('text', 'jsonl'), default='text',
+                        help="text prints each stream's messages together; jsonl prints one JSON object "
+                             "per event in capture order and the summary to stderr")
+    args = parser.parse_args()
+    process_pcap(args.pcap, args.reorder_limit, args.jobs or os.cpu_count(), args.output)
@@ -0,0 +1,206 @@
+"""Synthetic Pluto Chat captures, and a fuzz check of the solver against them.
+
+conversation() invents a chat session and encrypts it the way plutochat
+does; capture_packets() cuts it into TCP segments, which it can reorder,
+retransmit, resegment and drop; write_pcap() saves the result as a
+libpcap file solve.py can read.
+
+    python synthetic.py [--rounds 200] [--seed 1]
+
+runs the fuzz check (test_reassembly.py runs a few rounds of it under
+pytest): every round builds a mangled capture, decodes and
+parses it with solve.iter_messages and checks that
+
+  * without loss, every message comes out exactly once and in order, and
+    every byte on the wire is either delivered or counted as a duplicate;
+  * with loss, what comes out is an in-order subsequence of what was sent,
+    and delivered plus missing bytes never exceed the stream length.
+"""
+import argparse
+import os
+import random
+import struct
+import tempfile
+from solve import decrypt_message, decode_pcap, iter_messages
+
+SERVER = ((10, 0, 0, 1), 31337)
+
+
+def chat_message(rng):
+    msg_type = rng.choice((0, 1, 2, 3))
+    if msg_type == 1:
+        return bytes([1])
+    first = bytes(rng.choices(b'abcdefghijklmnopqrstuvwxyz', k=rng.randint(1, 20)))
+    second = rng.randbytes(rng.choice((0, 1, rng.randint(2, 60), rng.randint(200, 255))))
+    return bytes([msg_type, len(first)]) + first + bytes([len(second)]) + second
+
+
+def encrypt_frame(rng, plaintext):
+    key = rng.randbytes(4)
+    # RC4 is symmetric, so decrypting the plaintext encrypts it.
+    return key + len(plaintext).to_bytes(4, 'little') + decrypt_message(key, plaintext)
+
+
+def conversation(rng, messages):
+    """Returns (client plaintexts, client bytes, server plaintexts, server bytes)."""
+    sides = [[], []]
+    for _ in range(messages):
+        sides[rng.random() < 0.5].append(chat_message(rng))
+    return [(plain, b''.join(encrypt_frame(rng, p) for p in plain)) for plain in sides]
+
+
+def segments(data, isn, rng, mss=1460):
+    """Cuts data into (seq, payload) segments of random sizes."""
+    out = []
+    offset = 0
+    while offset < len(data):
+        size = rng.randint(1, mss)
+        out.append(((isn + offset) % (1 << 32), data[offset:offset + size]))
+        offset += size
+    return out
+
+
+def mangle(segs, rng, reorder=0.0, duplicate=0.0, resegment=0.0, drop=0.0, window=8):
+    """Applies network damage to a list of (seq, payload) segments.
+    Returns (segments, dropped) where dropped says whether any byte may have
+    been lost for good."""
+    out = []
+    dropped = False
+    for i, (seq, payload) in enumerate(segs):
+        if rng.random() < drop:
+            dropped = True
+            continue
+        out.append((seq, payload))
+        if rng.random() < duplicate:
+            out.append((seq, payload))
+        if rng.random() < resegment and len(payload) > 1:
+            # A retransmission that starts inside this segment and runs into
+            # the next one, so it only partly overlaps either.
+            cut = rng.randint(1, len(payload) - 1)
+            following = segs[i + 1][1] if i + 1 < len(segs) else b''
+            out.append(((seq + cut) % (1 << 32), payload[cut:] + following[:rng.randint(0, len(following))]))
+    for i in range(len(out)):
+        if rng.random() < reorder:
+            j = min(len(out) - 1, i + rng.randint(1, window))
+            out[i], out[j] = out[j], out[i]
+    return out, dropped
+
+
+def tcp_packet(src, dst, seq, flags, payload=b''):
+    (src_ip, sport), (dst_ip, dport) = src, dst
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, seq, 0, 5 << 4, flags, 65535, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(payload), 0, 0, 64, 6, 0,
+                     bytes(src_ip), bytes(dst_ip))
+    return b'\0' * 12 + b'\x08\x00' + ip + tcp + payload
+
+
+def write_pcap(path, packets):
+    """Writes Ethernet frames to a microsecond libpcap file."""
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for i, frame in enumerate(packets):
+            f.write(struct.pack('<IIII', i // 1000000, i % 1000000, len(frame), len(frame)))
+            f.write(frame)
+
+
+def capture_packets(rng, client_port, client_data, server_data, **damage):
+    """Packets for one connection: handshake, the two directions' data
+    interleaved after damage, then FINs. Returns (packets, dropped)."""
+    client = ((10, 0, 1 + client_port // 256 % 250, client_port % 256), client_port)
+    # ISNs near the top of the sequence space exercise wraparound.
+    isns = [rng.choice((rng.randrange(1 << 32), (1 << 32) - rng.randint(1, 3000))) for _ in range(2)]
+    packets = [tcp_packet(client, SERVER, isns[0], 0x02), tcp_packet(SERVER, client, isns[1], 0x12)]
+    directions = []
+    dropped = False
+    for (src, dst), isn, data in (((client, SERVER), isns[0], client_data), ((SERVER, client), isns[1], server_data)):
+        segs, lost = mangle(segments(data, isn + 1, rng), rng, **damage)
+        dropped |= lost
+        directions.append([tcp_packet(src, dst, seq, 0x18, payload) for seq, payload in segs])
+    while directions[0] or directions[1]:
+        side = directions[rng.random() < 0.5] or directions[0] or directions[1]
+        packets.append(side.pop(0))
+    packets.append(tcp_packet(client, SERVER, (isns[0] + 1 + len(client_data)) % (1 << 32), 0x11))
+    packets.append(tcp_packet(SERVER, client, (isns[1] + 1 + len(server_data)) % (1 << 32), 0x11))
+    return packets, dropped
+
+
+def is_subsequence(found, sent):
+    remaining = iter(sent)
+    return all(any(item == candidate for candidate in remaining) for item in found)
+
+
+def fuzz_round(rng, path):
+    """Builds one mangled capture at ``path``, decodes it and checks it.
+    Returns a dict with the damage and reorder limit used, whether data was
+    lost, the messages sent and recovered, and a list of problems found."""
+    damage = {
+        'reorder': rng.choice((0.0, 0.1, 0.5)),
+        'duplicate': rng.choice((0.0, 0.1, 0.3)),
+        'resegment': rng.choice((0.0, 0.1, 0.3)),
+        'drop': rng.choice((0.0, 0.0, 0.05)),
+        'window': rng.randint(1, 30),
+    }
+    limit = rng.choice((1 << 20, 4096))
+    packets, expected, lengths, dropped = [], {}, {}, False
+    for port in rng.sample(range(1024, 65535), rng.randint(1, 4)):
+        (client_plain, client_data), (server_plain, server_data) = conversation(rng, rng.randint(0, 40))
+        conn_packets, lost = capture_packets(rng, port, client_data, server_data, **damage)
+        packets += conn_packets
+        dropped |= lost
+        client = ('10.0.%d.%d' % (1 + port // 256 % 250, port % 256), port)
+        server = ('10.0.0.1', 31337)
+        expected[client + server], lengths[client + server] = client_plain, len(client_data)
+        expected[server + client], lengths[server + client] = server_plain, len(server_data)
+    write_pcap(path, packets)
+    wire = sum(len(frame) - 54 for frame in packets)
+
+    found = {direction: [] for direction in expected}
+    stats = {}
+    for direction, kind, value in iter_messages(decode_pcap(path, limit, stats)):
+        if kind == 'message':
+            found[direction].append(bytes(value.raw))
+    problems = []
+    lossy = dropped or stats['missing'] > 0
+    if not lossy:
+        if found != expected:
+            problems.append('messages differ from what was sent')
+        if stats['delivered'] + stats['duplicate'] != wire:
+            problems.append(f"{stats['delivered']} delivered + {stats['duplicate']} duplicate != {wire} on the wire")
+    else:
+        for direction, messages in found.items():
+            if not is_subsequence(messages, expected[direction]):
+                problems.append(f'{direction} produced messages out of order or never sent')
+        if stats['delivered'] + stats['missing'] > sum(lengths.values()):
+            problems.append('delivered + missing exceeds the stream lengths')
+    return {'damage': damage, 'limit': limit, 'lossy': lossy, 'problems': problems,
+            'sent': sum(map(len, expected.values())), 'recovered': sum(map(len, found.values()))}
+
+
+def fuzz(rounds, seed):
+    rng = random.Random(seed)
+    failures = lossy = 0
+    # messages sent and recovered in rounds that lost data
+    sent_lossy = recovered_lossy = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fuzz.pcap')
+        for round_ in range(rounds):
+            result = fuzz_round(rng, path)
+            if result['lossy']:
+                lossy += 1
+                sent_lossy += result['sent']
+                recovered_lossy += result['recovered']
+            if result['problems']:
+                failures += 1
+                print(f"[!] Round {round_} (damage {result['damage']}, limit {result['limit']}): "
+                      f"{'; '.join(result['problems'])}")
+    print(f"[*] {rounds} rounds, {failures} failed; {lossy} rounds lost data and still recovered "
+          f"{recovered_lossy} of {sent_lossy} messages")
+    return failures == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fuzz-checks the Pluto Chat reassembler with synthetic captures.")
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    raise SystemExit(0 if fuzz(args.rounds, args.seed) else 1)